@@ -0,0 +1,72 @@
+"""
+Accounts receivable / payable aging.
+
+Open invoices (customers) and bills (vendors) are bucketed by how many days
+their due date lies before the as-of date. The bucket bounds are turned into
+due-date ranges up front, so each side is one grouped query with one
+conditional Sum per bucket.
+"""
+from datetime import timedelta
+from decimal import Decimal
+from django.db.models import Sum, Count, Q
+from inventory.models import Invoice, Bill
+
+
+# (key, label, min days overdue, max days overdue); None leaves the bound open.
+BUCKETS = [
+    ('current', 'Current', None, 0),
+    ('days_1_30', '1-30', 1, 30),
+    ('days_31_60', '31-60', 31, 60),
+    ('days_61_90', '61-90', 61, 90),
+    ('days_over_90', '90+', 91, None),
+]
+
+SIDES = {
+    'receivable': (Invoice, 'customer', 'customer__business_name'),
+    'payable': (Bill, 'vendor', 'vendor__business_name'),
+}
+
+
+def _bucket_filter(as_of, min_days, max_days):
+    """Due dates between max_days and min_days days before `as_of`."""
+    condition = Q()
+    if max_days is not None:
+        condition &= Q(due_date__date__gte=as_of - timedelta(days=max_days))
+    if min_days is not None:
+        condition &= Q(due_date__date__lte=as_of - timedelta(days=min_days))
+    return condition
+
+
+def aging(side, as_of):
+    """
+    Aging rows for 'receivable' or 'payable' as of a date. Returns (rows,
+    totals): one dict per customer/vendor with its id, name, open document
+    count, each bucket and the total, plus the column totals.
+    """
+    model, party, name_field = SIDES[side]
+    buckets = {
+        key: Sum('unpaid_amount', filter=_bucket_filter(as_of, min_days, max_days))
+        for key, _, min_days, max_days in BUCKETS
+    }
+    rows = model.objects.filter(is_active=True, unpaid_amount__gt=0).values(
+        f'{party}_id', name_field
+    ).annotate(
+        open_documents=Count('id'),
+        total=Sum('unpaid_amount'),
+        **buckets,
+    ).order_by(name_field)
+
+    keys = [key for key, _, _, _ in BUCKETS] + ['total']
+    totals = {key: Decimal('0.00') for key in keys}
+    data = []
+    for row in rows:
+        entry = {
+            'id': row[f'{party}_id'],
+            'name': row[name_field],
+            'open_documents': row['open_documents'],
+        }
+        for key in keys:
+            entry[key] = row[key] or Decimal('0.00')
+            totals[key] += entry[key]
+        data.append(entry)
+    return data, totals
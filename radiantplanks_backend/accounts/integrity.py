@@ -0,0 +1,151 @@
+"""
+Ledger integrity checks.
+
+Two invariants are verified with grouped SQL, one query each:
+
+* every active transaction's active lines balance (debits equal credits);
+* `Account.balance` equals the natural-sign sum of the account's active lines
+  on active transactions.
+
+Runs are incremental by default. A LedgerCheckpoint records the time the
+last pass started, and the next pass only rechecks the transactions and
+accounts touched by lines, transactions or accounts updated since then.
+Drifted balances can be repaired in place. The affected accounts are locked
+like a posting, and their daily snapshots are rebuilt from the lines.
+"""
+from decimal import Decimal
+from django.db import transaction as db_transaction
+from django.db.models import Sum, Q, F, DecimalField
+from django.utils import timezone
+from .models import Account, LedgerCheckpoint, TransactionLine
+from . import ledger, snapshots
+
+
+CHECKPOINT_NAME = 'ledger'
+# SQLite sums decimals as floats, so differences below half a cent are noise.
+TOLERANCE = Decimal('0.005')
+
+_amount = DecimalField(max_digits=15, decimal_places=2)
+
+
+def unbalanced_transactions(transactions=None):
+    """
+    Active transactions whose active lines do not balance, as dicts with the
+    transaction id and its debit and credit totals. `transactions` narrows
+    the check to a queryset of transaction ids.
+    """
+    lines = TransactionLine.objects.filter(is_active=True, transaction__is_active=True)
+    if transactions is not None:
+        lines = lines.filter(transaction_id__in=transactions)
+    rows = lines.values('transaction_id').annotate(
+        debit=Sum('debit_amount'),
+        credit=Sum('credit_amount'),
+        difference=Sum(F('debit_amount') - F('credit_amount'), output_field=_amount),
+    ).filter(Q(difference__gt=TOLERANCE) | Q(difference__lt=-TOLERANCE)).order_by('transaction_id')
+    return [
+        {
+            'transaction_id': row['transaction_id'],
+            'debit': Decimal(row['debit']).quantize(Decimal('0.01')),
+            'credit': Decimal(row['credit']).quantize(Decimal('0.01')),
+        }
+        for row in rows
+    ]
+
+
+def expected_balances(accounts):
+    """{account_id: balance} recomputed from the ledger lines for an Account queryset."""
+    totals = dict(
+        TransactionLine.objects.filter(
+            account__in=accounts, is_active=True, transaction__is_active=True
+        ).values('account_id').annotate(
+            net=Sum(F('debit_amount') - F('credit_amount'), output_field=_amount),
+        ).order_by().values_list('account_id', 'net')
+    )
+    return {
+        account_id: ledger.signed_balance(account_type, Decimal(totals.get(account_id) or 0).quantize(Decimal('0.01')))
+        for account_id, account_type in accounts.values_list('id', 'account_type')
+    }
+
+
+def drifted_accounts(accounts=None):
+    """
+    Accounts whose stored balance differs from the ledger, as dicts with the
+    account id, code, stored and expected balance.
+    """
+    if accounts is None:
+        accounts = Account.objects.all()
+    expected = expected_balances(accounts)
+    drifted = []
+    for account_id, code, balance in accounts.order_by('id').values_list('id', 'code', 'balance'):
+        if abs(balance - expected[account_id]) > TOLERANCE:
+            drifted.append({
+                'account_id': account_id,
+                'code': code,
+                'balance': balance,
+                'expected': expected[account_id],
+            })
+    return drifted
+
+
+def repair_balances(account_ids):
+    """
+    Reset Account.balance to the ledger total for `account_ids` and rebuild
+    their daily snapshots. The accounts stay locked while they are rewritten
+    so no posting can interleave. Returns the number of accounts changed.
+    """
+    repaired = 0
+    with db_transaction.atomic():
+        accounts = Account.objects.select_for_update().filter(id__in=account_ids).order_by('id')
+        expected = expected_balances(accounts)
+        for account_id, balance in accounts.values_list('id', 'balance'):
+            if balance != expected[account_id]:
+                Account.objects.filter(id=account_id).update(balance=expected[account_id], updated_at=timezone.now())
+                repaired += 1
+        snapshots.rebuild(sorted(account_ids))
+    return repaired
+
+
+def verify(full=False, repair=False):
+    """
+    Check the ledger and move the checkpoint forward. Incremental unless
+    `full` is set or no checkpoint exists yet. With `repair`, drifted account
+    balances are corrected. Returns a report dict.
+    """
+    started_at = timezone.now()
+    checkpoint = LedgerCheckpoint.objects.filter(name=CHECKPOINT_NAME).first()
+    incremental = checkpoint is not None and not full
+
+    if incremental:
+        since = checkpoint.checked_through
+        touched_lines = TransactionLine.objects.filter(
+            Q(updated_at__gt=since) | Q(transaction__updated_at__gt=since)
+        )
+        transactions = touched_lines.values('transaction_id')
+        accounts = Account.objects.filter(
+            Q(updated_at__gt=since) | Q(id__in=touched_lines.values('account_id'))
+        )
+    else:
+        transactions = None
+        accounts = Account.objects.all()
+
+    unbalanced = unbalanced_transactions(transactions)
+    drifted = drifted_accounts(accounts)
+    repaired = repair_balances([row['account_id'] for row in drifted]) if repair and drifted else 0
+
+    LedgerCheckpoint.objects.update_or_create(
+        name=CHECKPOINT_NAME,
+        defaults={
+            'checked_through': started_at,
+            'unbalanced_transactions': len(unbalanced),
+            'drifted_accounts': len(drifted),
+            'repaired_accounts': repaired,
+        },
+    )
+    return {
+        'mode': 'incremental' if incremental else 'full',
+        'checked_since': checkpoint.checked_through if incremental else None,
+        'checked_through': started_at,
+        'unbalanced_transactions': unbalanced,
+        'drifted_accounts': drifted,
+        'repaired_accounts': repaired,
+    }
@@ -0,0 +1,242 @@
+"""
+Bulk import of journal entries from CSV or XLSX.
+
+One row per ledger line:
+
+    entry, date, account_code, debit, credit[, description, memo, transaction_type]
+
+Rows sharing an `entry` value form one Transaction whose reference_number is
+that value. The file is read in chunks (pandas chunks for CSV, a read-only
+openpyxl cursor for XLSX) and each chunk is checked with vectorized column
+operations and reduced to the fields needed for posting. Entry-level checks
+(debits equal credits, a single date, an unused reference) then run once over
+the reduced frame, and valid entries are posted through accounts.posting in
+atomic batches. Invalid rows or entries are reported and skipped; a failing
+batch does not undo the batches already written.
+"""
+from decimal import Decimal
+import traceback
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from radiantplanks_backend.logging import log
+from .models import Account, Transaction
+from . import posting
+
+
+REQUIRED_COLUMNS = ['entry', 'date', 'account_code', 'debit', 'credit']
+OPTIONAL_COLUMNS = ['description', 'memo', 'transaction_type']
+TRANSACTION_TYPES = [choice for choice, _ in Transaction.TRANSACTION_TYPES]
+REFERENCE_MAX_LENGTH = Transaction._meta.get_field('reference_number').max_length
+
+CHUNK_ROWS = 5000
+ENTRIES_PER_BATCH = 500
+LOOKUP_BATCH = 900  # stays under SQLite's bound-parameter limit
+
+
+def read_chunks(file, chunk_rows=CHUNK_ROWS):
+    """Yield the rows of an uploaded CSV/XLSX file as DataFrames of strings."""
+    name = file.name.lower()
+    if name.endswith('.csv'):
+        yield from pd.read_csv(file, chunksize=chunk_rows, dtype=str, keep_default_na=False)
+    elif name.endswith('.xlsx'):
+        workbook = load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(cell).strip() if cell is not None else '' for cell in next(rows, [])]
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == chunk_rows:
+                    yield pd.DataFrame(batch, columns=header, dtype=object).fillna('').astype(str)
+                    batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=header, dtype=object).fillna('').astype(str)
+        finally:
+            workbook.close()
+    else:
+        raise ValueError("Unsupported file format. Use CSV or XLSX.")
+
+
+def _cents(column):
+    """Parse an amount column into integer cents; blanks are zero, unparsable values NaN."""
+    amounts = pd.to_numeric(column.str.replace(',', '', regex=False).replace('', '0'), errors='coerce')
+    return (amounts * 100).round()
+
+
+def _message(mask, message):
+    """A Series holding `message` where `mask` is true and None elsewhere."""
+    return pd.Series(np.where(mask, message, None), index=mask.index, dtype=object)
+
+
+def _row_errors(frame, messages):
+    """Collect {'row', 'entry', 'errors'} dicts from a DataFrame of per-column messages (None when valid)."""
+    failed = messages.notna().any(axis=1)
+    errors = []
+    for row, entry, row_messages in zip(frame.loc[failed, 'row'], frame.loc[failed, 'entry'], messages[failed].to_dict('records')):
+        errors.append({
+            'row': int(row),
+            'entry': entry,
+            'errors': {column: message for column, message in row_messages.items() if pd.notna(message)},
+        })
+    return errors
+
+
+def validate_chunk(chunk, account_codes, first_row):
+    """
+    Check one chunk of raw rows. Returns (lines, errors) where `lines` keeps
+    every row with an `invalid` flag so whole entries can be rejected later.
+    """
+    chunk = chunk.rename(columns=lambda column: str(column).strip().lower())
+    missing_columns = [column for column in REQUIRED_COLUMNS if column not in chunk.columns]
+    if missing_columns:
+        raise ValueError(f"Missing required columns: {missing_columns}")
+
+    text = chunk.reindex(columns=REQUIRED_COLUMNS + OPTIONAL_COLUMNS, fill_value='').fillna('').astype(str)
+    text = text.apply(lambda column: column.str.strip())
+
+    dates = pd.to_datetime(text['date'], errors='coerce', format='mixed')
+    debit = _cents(text['debit'])
+    credit = _cents(text['credit'])
+    transaction_type = text['transaction_type'].str.lower().replace('', 'journal')
+
+    messages = pd.DataFrame({
+        'entry': _message(text['entry'].eq(''), "Entry reference is required.").where(
+            text['entry'].str.len() <= REFERENCE_MAX_LENGTH, f"Entry reference must be at most {REFERENCE_MAX_LENGTH} characters."
+        ),
+        'date': _message(dates.isna(), "Invalid or missing date."),
+        'account_code': _message(~text['account_code'].isin(account_codes), "Unknown or inactive account code."),
+        'debit': _message(debit.isna() | (debit < 0), "Debit must be a non-negative number."),
+        'credit': _message(credit.isna() | (credit < 0), "Credit must be a non-negative number."),
+        'amount': _message(
+            debit.fillna(0).eq(0) & credit.fillna(0).eq(0), "Either debit or credit is required."
+        ).where(~((debit > 0) & (credit > 0)), "A line cannot have both a debit and a credit."),
+        'transaction_type': _message(~transaction_type.isin(TRANSACTION_TYPES), f"Transaction type must be one of {TRANSACTION_TYPES}."),
+    })
+
+    lines = pd.DataFrame({
+        'row': np.arange(first_row, first_row + len(chunk)),
+        'entry': text['entry'],
+        'date': dates.dt.date,
+        'account_code': text['account_code'],
+        'debit_cents': debit.fillna(0).astype('int64'),
+        'credit_cents': credit.fillna(0).astype('int64'),
+        'description': text['description'],
+        'memo': text['memo'],
+        'transaction_type': transaction_type,
+        'invalid': messages.notna().any(axis=1),
+    })
+    return lines, _row_errors(lines, messages)
+
+
+def _existing_references(references):
+    existing = set()
+    for start in range(0, len(references), LOOKUP_BATCH):
+        existing.update(Transaction.objects.filter(
+            reference_number__in=references[start:start + LOOKUP_BATCH]
+        ).values_list('reference_number', flat=True))
+    return existing
+
+
+def validate_entries(lines):
+    """
+    Entry-level checks over all validated lines. Returns (valid entry
+    references in file order, errors). Entries with an invalid row are
+    dropped without a further message; their rows were already reported.
+    """
+    lines = lines[lines['entry'].ne('')]
+    grouped = lines.groupby('entry', sort=False)
+    entries = pd.DataFrame({
+        'first_row': grouped['row'].min(),
+        'invalid': grouped['invalid'].any(),
+        'debit': grouped['debit_cents'].sum(),
+        'credit': grouped['credit_cents'].sum(),
+        'dates': grouped['date'].nunique(),
+    })
+    existing = _existing_references(entries.index.tolist())
+
+    totals = "Debits (" + (entries['debit'] / 100).map('{:.2f}'.format) + ") do not equal credits (" + (entries['credit'] / 100).map('{:.2f}'.format) + ")."
+    messages = pd.DataFrame({
+        'entry': _message(entries.index.to_series().isin(existing), "Reference number already exists."),
+        'balance': _message(entries['debit'].ne(entries['credit']), totals),
+        'date': _message(entries['dates'].gt(1), "All lines of an entry must share one date."),
+    })
+    messages = messages[~entries['invalid']]
+    report = pd.DataFrame({'row': entries.loc[messages.index, 'first_row'], 'entry': messages.index})
+    errors = _row_errors(report, messages)
+
+    valid = entries.index[~entries['invalid'] & messages.reindex(entries.index).isna().all(axis=1)]
+    return valid.tolist(), errors
+
+
+def _build_entries(lines, accounts, user):
+    entries = []
+    for entry, rows in lines.groupby('entry', sort=False):
+        first = rows.iloc[0]
+        transaction = Transaction(
+            reference_number=entry,
+            transaction_type=first['transaction_type'],
+            date=first['date'],
+            description=first['description'] or f"Journal entry {entry}",
+            created_by=user,
+        )
+        entry_lines = [
+            posting.Line(
+                accounts[row.account_code],
+                debit=Decimal(int(row.debit_cents)).scaleb(-2),
+                credit=Decimal(int(row.credit_cents)).scaleb(-2),
+                description=row.memo[:255],
+            )
+            for row in rows.itertuples(index=False)
+        ]
+        entries.append((transaction, entry_lines))
+    return entries
+
+
+def import_journal(file, user, entries_per_batch=ENTRIES_PER_BATCH):
+    """
+    Validate and post the journal entries in `file`. Returns a summary dict
+    with the number of entries and lines written and the per-row errors.
+    Raises ValueError when the file itself cannot be read.
+    """
+    accounts = {account.code: account for account in Account.objects.filter(is_active=True).exclude(code=None)}
+    account_codes = list(accounts)
+
+    chunks = []
+    errors = []
+    first_row = 1
+    for chunk in read_chunks(file):
+        lines, chunk_errors = validate_chunk(chunk, account_codes, first_row)
+        chunks.append(lines)
+        errors.extend(chunk_errors)
+        first_row += len(chunk)
+    if not chunks:
+        raise ValueError("The file contains no rows.")
+
+    lines = pd.concat(chunks, ignore_index=True)
+    valid_entries, entry_errors = validate_entries(lines)
+    errors.extend(entry_errors)
+    lines = lines[lines['entry'].isin(valid_entries)]
+
+    imported_entries = 0
+    imported_lines = 0
+    for start in range(0, len(valid_entries), entries_per_batch):
+        batch_entries = valid_entries[start:start + entries_per_batch]
+        batch = lines[lines['entry'].isin(batch_entries)]
+        try:
+            imported_lines += posting.post_transactions(_build_entries(batch, accounts, user))
+            imported_entries += len(batch_entries)
+        except Exception as e:
+            log.trace.trace(f"Journal import batch failed {traceback.format_exc()}")
+            first_rows = batch.groupby('entry', sort=False)['row'].min()
+            errors.extend(
+                {'row': int(row), 'entry': entry, 'errors': {'batch': f"Batch not imported: {e}"}}
+                for entry, row in first_rows.items()
+            )
+
+    errors.sort(key=lambda error: error['row'])
+    return {
+        'imported_entries': imported_entries,
+        'imported_lines': imported_lines,
+        'errors': errors,
+    }
@@ -0,0 +1,262 @@
+"""
+Grouped ledger queries shared by the balance sheet and profit & loss reports.
+
+Balances for every account are fetched in a single query over the daily
+snapshots (see accounts.snapshots) instead of one aggregate per account, so
+report cost grows with neither the chart of accounts nor the ledger history.
+Period P&L comparisons are likewise one query grouped by account and period,
+pivoted in memory. Account registers page by keyset on (date, line id) and
+take their running balance from a window over the page plus the snapshot
+balance before it.
+"""
+from bisect import bisect_right
+from datetime import timedelta
+from decimal import Decimal
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+from django.db.models import Sum, Q, F, Exists, OuterRef, DecimalField, Window
+from django.db.models.functions import TruncMonth, TruncQuarter, TruncYear
+from .models import Account, Transaction, TransactionLine
+from . import snapshots
+
+
+ASSET_TYPES = ['cash', 'bank', 'accounts_receivable', 'inventory', 'fixed_assets', 'other_current_assets']
+LIABILITY_TYPES = ['accounts_payable', 'credit_card', 'current_liabilities', 'long_term_liabilities', 'tax_payable']
+EQUITY_TYPES = ['owner_equity', 'retained_earnings']
+INCOME_TYPES = ['sales_income', 'service_income', 'other_income']
+EXPENSE_TYPES = ['cost_of_goods_sold', 'operating_expenses', 'payroll_expenses', 'marketing_expenses', 'administrative_expenses', 'other_expenses']
+
+# Accounts whose balance grows with debits; everything else grows with credits.
+DEBIT_NORMAL_TYPES = ASSET_TYPES + EXPENSE_TYPES
+
+
+def account_totals(start_date=None, end_date=None):
+    """
+    Return {account_id: debit minus credit} over active lines of active transactions.
+    The date range is only applied when both bounds are given. Read from the
+    daily snapshots, so each account costs two indexed lookups.
+    """
+    return snapshots.net_balances(start_date, end_date)
+
+
+def signed_balance(account_type, net_debit):
+    """Balance in the account's natural direction (debit-normal or credit-normal)."""
+    if account_type in DEBIT_NORMAL_TYPES:
+        return net_debit
+    return -net_debit
+
+
+def active_accounts(account_types):
+    """Active accounts of the given types, ordered by the position of their type and then by code."""
+    type_order = {account_type: index for index, account_type in enumerate(account_types)}
+    accounts = Account.objects.filter(account_type__in=account_types, is_active=True).order_by('code', 'id')
+    # sorted() is stable, so accounts keep their code order within a type
+    return sorted(accounts, key=lambda account: type_order[account.account_type])
+
+
+def section_balances(accounts, account_types, totals):
+    """
+    Pair each account of the given types with its balance from `totals`.
+    Returns a list of (account, balance) and the section total.
+    """
+    rows = []
+    section_total = Decimal('0.00')
+    for account in accounts:
+        if account.account_type not in account_types:
+            continue
+        balance = signed_balance(account.account_type, totals.get(account.id, Decimal('0.00')))
+        rows.append((account, balance))
+        section_total += balance
+    return rows, section_total
+
+
+def balance_sheet(start_date=None, end_date=None):
+    """
+    Asset, liability and equity sections with totals. Costs two queries
+    regardless of how many accounts exist.
+    """
+    accounts = active_accounts(ASSET_TYPES + LIABILITY_TYPES + EQUITY_TYPES)
+    totals = account_totals(start_date, end_date)
+    assets, total_assets = section_balances(accounts, ASSET_TYPES, totals)
+    liabilities, total_liabilities = section_balances(accounts, LIABILITY_TYPES, totals)
+    equity, total_equity = section_balances(accounts, EQUITY_TYPES, totals)
+    return {
+        'assets': assets,
+        'liabilities': liabilities,
+        'equity': equity,
+        'total_assets': total_assets,
+        'total_liabilities': total_liabilities,
+        'total_equity': total_equity,
+    }
+
+
+def generate_periods(start_date, end_date, period_type):
+    """Split [start_date, end_date] into consecutive monthly, quarterly or yearly periods anchored at start_date."""
+    steps = {
+        'monthly': relativedelta(months=1),
+        'quarterly': relativedelta(months=3),
+        'yearly': relativedelta(years=1),
+    }
+    if period_type not in steps:
+        raise ValueError("Invalid period type")
+
+    periods = []
+    current_start = start_date
+    while current_start <= end_date:
+        next_start = current_start + steps[period_type]
+        periods.append((current_start, min(next_start - timedelta(days=1), end_date)))
+        current_start = next_start
+    return periods
+
+
+def _period_bucket(start_date, period_type):
+    """
+    Expression to group lines by. When the periods line up with calendar
+    months/quarters/years the date is truncated in SQL, otherwise lines are
+    grouped per day and bucketed in memory.
+    """
+    if start_date.day == 1:
+        if period_type == 'monthly':
+            return TruncMonth('transaction__date')
+        if period_type == 'quarterly' and (start_date.month - 1) % 3 == 0:
+            return TruncQuarter('transaction__date')
+        if period_type == 'yearly' and start_date.month == 1:
+            return TruncYear('transaction__date')
+    return F('transaction__date')
+
+
+def pnl_by_period(start_date, end_date, period_type, report_type=None):
+    """
+    Income and expense amounts per account and period from one grouped query.
+
+    Income is the credit side of income-account lines on 'income' transactions,
+    expenses the debit side of expense-account lines. `report_type` 'accrual'
+    or 'cash' restricts income to invoice postings or invoice payments.
+
+    Returns (periods, accounts, amounts) where `amounts` is a DataFrame indexed
+    by account id with one (income, expense) column pair per period index.
+    """
+    periods = generate_periods(start_date, end_date, period_type)
+    accounts = active_accounts(INCOME_TYPES + EXPENSE_TYPES)
+
+    income_filter = Q(account__account_type__in=INCOME_TYPES, transaction__transaction_type='income')
+    expense_filter = Q(account__account_type__in=EXPENSE_TYPES)
+    if report_type in ('accrual', 'cash'):
+        invoice_postings = Transaction.objects.filter(
+            pk=OuterRef('transaction_id'),
+            invoice_transactions__is_payment_transaction=(report_type == 'cash'),
+        )
+        income_filter &= Q(Exists(invoice_postings))
+    if report_type == 'cash':
+        expense_filter &= Q(account__account_type__in=['cash', 'bank'])
+
+    account_ids = [account.id for account in accounts]
+    rows = TransactionLine.objects.filter(
+        is_active=True,
+        transaction__is_active=True,
+        account__in=account_ids,
+        transaction__date__gte=start_date,
+        transaction__date__lte=end_date,
+    ).annotate(
+        bucket=_period_bucket(start_date, period_type),
+    ).values('account_id', 'bucket').annotate(
+        income=Sum('credit_amount', filter=income_filter),
+        expense=Sum('debit_amount', filter=expense_filter),
+    ).order_by()
+
+    columns = pd.MultiIndex.from_product([['income', 'expense'], range(len(periods))])
+    df = pd.DataFrame(list(rows), columns=['account_id', 'bucket', 'income', 'expense'])
+    period_starts = [pd.Timestamp(period_start) for period_start, _ in periods]
+    df['period'] = [max(bisect_right(period_starts, bucket) - 1, 0) for bucket in pd.to_datetime(df['bucket'])]
+    amounts = df.groupby(['account_id', 'period'])[['income', 'expense']].sum(min_count=1).unstack('period')
+    amounts = amounts.reindex(index=account_ids, columns=columns).astype(object)
+    amounts = amounts.where(amounts.notna(), Decimal('0.00'))
+
+    return periods, accounts, amounts
+
+
+def pnl_comparison(start_date, end_date, period_type, report_type=None):
+    """Per-period P&L statements (same shape as the comparison API) built from pnl_by_period."""
+    periods, accounts, amounts = pnl_by_period(start_date, end_date, period_type, report_type)
+
+    report = []
+    for index, (period_start, period_end) in enumerate(periods):
+        income_details = []
+        expense_details = []
+        total_income = Decimal('0.00')
+        total_expenses = Decimal('0.00')
+        for account in accounts:
+            if account.account_type in INCOME_TYPES:
+                amount = amounts.at[account.id, ('income', index)]
+                total_income += amount
+                income_details.append({'name': account.name, 'code': account.code, 'amount': float(amount)})
+            else:
+                amount = amounts.at[account.id, ('expense', index)]
+                total_expenses += amount
+                expense_details.append({'name': account.name, 'code': account.code, 'amount': float(amount)})
+
+        statement = {
+            'start_date': str(period_start),
+            'end_date': str(period_end),
+        }
+        if report_type:
+            statement['report_type'] = report_type
+        statement.update({
+            'income': income_details,
+            'expenses': expense_details,
+            'total_income': float(total_income),
+            'total_expenses': float(total_expenses),
+            'net_profit': float(total_income - total_expenses)
+        })
+        report.append(statement)
+    return report
+
+
+def register_page(account, after=None, start_date=None, end_date=None, limit=50):
+    """
+    One page of an account's register, oldest first, ordered by (transaction
+    date, line id). `after` is the (date, line id) key of the last row already
+    seen. Returns (lines, has_more); every line carries `running_balance`, the
+    account balance in its natural direction after that line.
+
+    Costs four queries whatever the page depth: the page keys, the page rows
+    with a window running total, the snapshot balance before the first row's
+    date and the earlier lines of that same day.
+    """
+    lines = TransactionLine.objects.filter(account=account, is_active=True, transaction__is_active=True)
+    if start_date:
+        lines = lines.filter(transaction__date__gte=start_date)
+    if end_date:
+        lines = lines.filter(transaction__date__lte=end_date)
+    if after:
+        after_date, after_id = after
+        lines = lines.filter(Q(transaction__date__gt=after_date) | Q(transaction__date=after_date, id__gt=after_id))
+
+    page_ids = list(lines.order_by('transaction__date', 'id').values_list('id', flat=True)[:limit + 1])
+    has_more = len(page_ids) > limit
+    if not page_ids:
+        return [], False
+
+    net_amount = DecimalField(max_digits=15, decimal_places=2)
+    page = list(TransactionLine.objects.filter(id__in=page_ids[:limit]).select_related('transaction').annotate(
+        net_to_line=Window(
+            Sum(F('debit_amount') - F('credit_amount'), output_field=net_amount),
+            order_by=[F('transaction__date').asc(), F('id').asc()],
+        ),
+    ).order_by('transaction__date', 'id'))
+
+    first = page[0]
+    same_day_before = TransactionLine.objects.filter(
+        account=account,
+        is_active=True,
+        transaction__is_active=True,
+        transaction__date=first.transaction.date,
+        id__lt=first.id,
+    ).aggregate(net=Sum(F('debit_amount') - F('credit_amount'), output_field=net_amount))['net']
+    opening = snapshots.net_before(account.id, first.transaction.date) + (same_day_before or Decimal('0.00'))
+
+    for line in page:
+        # SQLite sums decimals as floats; bring the total back to cents.
+        net_debit = (opening + Decimal(line.net_to_line)).quantize(Decimal('0.01'))
+        line.running_balance = signed_balance(account.account_type, net_debit)
+    return page, has_more
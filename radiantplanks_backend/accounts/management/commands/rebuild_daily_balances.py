@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from accounts import snapshots
+
+
+class Command(BaseCommand):
+    help = "Rebuild AccountDailyBalance snapshots from the active transaction lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--account', action='append', type=int, dest='accounts',
+            help="Only rebuild the given account id (may be repeated).",
+        )
+
+    def handle(self, *args, **options):
+        written = snapshots.rebuild(options['accounts'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} daily balance rows."))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from accounts import integrity
+
+
+class Command(BaseCommand):
+    help = "Verify that transactions balance and account balances match the ledger lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help="Check the whole ledger instead of what changed since the last run.",
+        )
+        parser.add_argument(
+            '--repair', action='store_true',
+            help="Reset drifted account balances to the ledger totals.",
+        )
+
+    def handle(self, *args, **options):
+        report = integrity.verify(full=options['full'], repair=options['repair'])
+
+        for row in report['unbalanced_transactions']:
+            self.stdout.write(self.style.ERROR(
+                f"Transaction {row['transaction_id']} does not balance: debits {row['debit']}, credits {row['credit']}"
+            ))
+        for row in report['drifted_accounts']:
+            self.stdout.write(self.style.WARNING(
+                f"Account {row['account_id']} ({row['code']}) balance {row['balance']}, ledger {row['expected']}"
+            ))
+
+        summary = (
+            f"{report['mode'].capitalize()} check through {report['checked_through']:%Y-%m-%d %H:%M:%S}: "
+            f"{len(report['unbalanced_transactions'])} unbalanced transactions, "
+            f"{len(report['drifted_accounts'])} drifted accounts, "
+            f"{report['repaired_accounts']} repaired."
+        )
+        if report['unbalanced_transactions'] or (report['drifted_accounts'] and not report['repaired_accounts']):
+            self.stdout.write(self.style.WARNING(summary))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,62 @@
+# Generated by Django 5.1.2 on 2026-10-18 03:02
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def populate_daily_balances(apps, schema_editor):
+    TransactionLine = apps.get_model('accounts', 'TransactionLine')
+    AccountDailyBalance = apps.get_model('accounts', 'AccountDailyBalance')
+    rows = TransactionLine.objects.filter(is_active=True, transaction__is_active=True).values(
+        'account_id', 'transaction__date'
+    ).annotate(
+        debit_sum=Sum('debit_amount'),
+        credit_sum=Sum('credit_amount'),
+    ).order_by('account_id', 'transaction__date')
+
+    snapshots = []
+    current_account = None
+    running_balance = Decimal('0.00')
+    for row in rows:
+        if row['account_id'] != current_account:
+            current_account = row['account_id']
+            running_balance = Decimal('0.00')
+        debit_sum = row['debit_sum'] or Decimal('0.00')
+        credit_sum = row['credit_sum'] or Decimal('0.00')
+        running_balance += debit_sum - credit_sum
+        snapshots.append(AccountDailyBalance(
+            account_id=row['account_id'],
+            date=row['transaction__date'],
+            debit_total=debit_sum,
+            credit_total=credit_sum,
+            running_balance=running_balance,
+        ))
+    AccountDailyBalance.objects.bulk_create(snapshots, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0016_transactionline_bill_id_transactionline_invoice_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountDailyBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('debit_total', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('credit_total', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('running_balance', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_balances', to='accounts.account')),
+            ],
+            options={
+                'ordering': ['account', 'date'],
+                'unique_together': {('account', 'date')},
+            },
+        ),
+        migrations.RunPython(populate_daily_balances, migrations.RunPython.noop),
+    ]
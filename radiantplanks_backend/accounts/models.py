@@ -7,6 +7,7 @@ from datetime import datetime, timedelta
 from django.http import JsonResponse
 from customers.models import Customer, Vendor
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 # Create your models here.
 
 class Account(models.Model):
@@ -201,6 +202,7 @@ class TransactionLine(models.Model):
     invoice_id = models.IntegerField(null=True, blank=True, default=None)
     bill_id = models.IntegerField(null=True, blank=True, default=None)
     is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
     class Meta:
         ordering = ['id']
@@ -225,4 +227,71 @@ class PayableTracking(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"{self.vendor.business_name} - {self.payable_amount}"
\ No newline at end of file
+        return f"{self.vendor.business_name} - {self.payable_amount}"
+
+class AccountDailyBalance(models.Model):
+    """
+    Per-account, per-day totals of active ledger lines (active lines on active
+    transactions). `running_balance` is the cumulative debit minus credit up to
+    and including `date`. Maintained by accounts.snapshots.
+    """
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='daily_balances')
+    date = models.DateField()
+    debit_total = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    credit_total = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    running_balance = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('account', 'date')
+        ordering = ['account', 'date']
+
+    def __str__(self):
+        return f"{self.account.name} - {self.date} - {self.running_balance}"
+
+
+class LedgerCheckpoint(models.Model):
+    """
+    High-water mark of the ledger integrity check (accounts.integrity).
+    Lines, transactions and accounts updated after `checked_through` are
+    rechecked by the next incremental run.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    checked_through = models.DateTimeField()
+    unbalanced_transactions = models.IntegerField(default=0)
+    drifted_accounts = models.IntegerField(default=0)
+    repaired_accounts = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} - {self.checked_through}"
+
+
+class IdempotencyRecord(models.Model):
+    """
+    Outcome of a write request sent with an Idempotency-Key header (see
+    radiantplanks_backend.idempotency). `status_code` is null while the
+    first request is still running. Rows are deleted after `expires_at`.
+    """
+    key = models.CharField(max_length=300, unique=True)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.IntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.key} - {self.status_code}"
+
+
+class SystemAccountVersion(models.Model):
+    """
+    Version of the set of system accounts (accounts.registry.SYSTEM_CODES),
+    bumped by accounts.signals when one is created, recoded, (de)activated or
+    deleted. Kept as a single row; the registry reloads its cached ids when
+    the version it loaded them at is no longer current.
+    """
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"System accounts v{self.version}"
@@ -0,0 +1,217 @@
+"""
+Ledger posting service.
+
+Every journal entry goes through post_lines/post_transaction (or
+post_transactions for imports): the lines are validated (non-negative, debits equal credits), inserted with one bulk_create
+and the account balances are moved with F() expressions while the affected
+Account rows are locked with select_for_update, in id order so concurrent
+postings cannot deadlock. Only the accounts touched by an entry are locked,
+so unrelated postings from other workers proceed in parallel.
+
+`Account.balance` is kept in the account's natural direction: debit-normal
+accounts (assets, expenses) grow with debits, all others with credits.
+Bulk inserts and queryset updates bypass the model signals, so the daily
+snapshots are maintained here as well.
+
+post_adjustment amends a posted entry without reversing it: only the
+per-account difference between its active lines and the new lines is
+posted, as one adjusting line per changed account.
+"""
+from collections import defaultdict, namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import connection, transaction as db_transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import Account, Transaction, TransactionLine
+from . import ledger, snapshots
+
+
+# `account` is an Account or an account id (e.g. from accounts.registry).
+Line = namedtuple(
+    'Line',
+    ['account', 'debit', 'credit', 'description', 'invoice_id', 'bill_id'],
+    defaults=(0, 0, '', None, None),
+)
+
+# Above this many (account, day) snapshot changes in one batch, post_transactions
+# rebuilds the affected accounts' snapshots instead of applying each delta.
+SNAPSHOT_REBUILD_THRESHOLD = 500
+
+
+def _account_id(account):
+    return getattr(account, 'pk', account)
+
+
+def _amount(value):
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def _apply_balances(deltas):
+    """
+    Move Account.balance by {account_id: (debit, credit)}. The accounts are
+    locked in id order before any of them is written.
+    """
+    account_ids = sorted(deltas)
+    account_types = dict(
+        Account.objects.select_for_update().filter(id__in=account_ids).order_by('id').values_list('id', 'account_type')
+    )
+    for account_id in account_ids:
+        debit, credit = deltas[account_id]
+        change = ledger.signed_balance(account_types[account_id], debit - credit)
+        if change:
+            Account.objects.filter(id=account_id).update(balance=F('balance') + change, updated_at=timezone.now())
+
+
+def _add_deltas(target, key, debit, credit):
+    current_debit, current_credit = target.get(key, (Decimal('0.00'), Decimal('0.00')))
+    target[key] = (current_debit + debit, current_credit + credit)
+
+
+def _build_rows(transaction, lines):
+    """Validate `lines` and build unsaved TransactionLine rows plus {account_id: (debit, credit)}."""
+    rows = []
+    deltas = {}
+    total_debit = Decimal('0.00')
+    total_credit = Decimal('0.00')
+    for line in lines:
+        debit, credit = _amount(line.debit), _amount(line.credit)
+        if debit < 0 or credit < 0:
+            raise ValueError(f"Negative amount on ledger line for account {line.account}.")
+        if not debit and not credit:
+            continue
+        total_debit += debit
+        total_credit += credit
+        account_id = _account_id(line.account)
+        _add_deltas(deltas, account_id, debit, credit)
+        rows.append(TransactionLine(
+            transaction=transaction,
+            account_id=account_id,
+            description=line.description,
+            debit_amount=debit,
+            credit_amount=credit,
+            invoice_id=line.invoice_id,
+            bill_id=line.bill_id,
+        ))
+
+    if total_debit != total_credit:
+        raise ValueError(f"Unbalanced entry: debits {total_debit} do not equal credits {total_credit}.")
+    return rows, deltas
+
+
+def post_lines(transaction, lines):
+    """
+    Post `lines` (an iterable of Line) against an existing Transaction.
+    Zero lines are skipped. Raises ValueError for negative amounts or when
+    debits and credits do not balance. Returns the created TransactionLine rows.
+    """
+    rows, deltas = _build_rows(transaction, lines)
+    with db_transaction.atomic():
+        TransactionLine.objects.bulk_create(rows)
+        if transaction.is_active:
+            _apply_balances(deltas)
+            day = snapshots.as_date(transaction.date)
+            snapshots.apply_deltas({(account_id, day): amounts for account_id, amounts in deltas.items()})
+    return rows
+
+
+def post_transactions(entries, batch_size=1000):
+    """
+    Post many entries at once. `entries` is a list of (unsaved Transaction,
+    lines). Every entry is validated before anything is written; the
+    transactions and their lines are then inserted with bulk_create and the
+    balance and snapshot deltas of the whole batch are applied together.
+    Returns the number of lines written.
+
+    The lines need the ids of their transactions. Databases that cannot
+    return them from a bulk insert (MySQL) get one INSERT per transaction
+    instead; the lines are still inserted in bulk.
+    """
+    prepared = [(transaction, _build_rows(transaction, lines)) for transaction, lines in entries]
+    with db_transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            Transaction.objects.bulk_create([transaction for transaction, _ in prepared], batch_size=batch_size)
+        else:
+            for transaction, _ in prepared:
+                transaction.save(force_insert=True)
+        rows = []
+        balance_deltas = {}
+        snapshot_deltas = {}
+        for transaction, (transaction_rows, deltas) in prepared:
+            for row in transaction_rows:
+                row.transaction = transaction
+            rows.extend(transaction_rows)
+            if not transaction.is_active:
+                continue
+            day = snapshots.as_date(transaction.date)
+            for account_id, (debit, credit) in deltas.items():
+                _add_deltas(balance_deltas, account_id, debit, credit)
+                _add_deltas(snapshot_deltas, (account_id, day), debit, credit)
+        TransactionLine.objects.bulk_create(rows, batch_size=batch_size)
+        _apply_balances(balance_deltas)
+        if len(snapshot_deltas) > SNAPSHOT_REBUILD_THRESHOLD:
+            # Cheaper to recompute the touched accounts in one pass than to shift them day by day.
+            snapshots.rebuild(sorted(balance_deltas))
+        else:
+            snapshots.apply_deltas(snapshot_deltas)
+    return len(rows)
+
+
+def post_transaction(lines, **transaction_fields):
+    """Create a Transaction from `transaction_fields` and post `lines` against it."""
+    with db_transaction.atomic():
+        transaction = Transaction.objects.create(**transaction_fields)
+        post_lines(transaction, lines)
+    return transaction
+
+
+def post_adjustment(transaction, current, lines, description, invoice_id=None, bill_id=None):
+    """
+    Bring the active lines of `current` (a TransactionLine queryset of
+    `transaction`) to the amounts of `lines` by posting, against
+    `transaction`, one line per account whose net amount changes. Returns
+    the created TransactionLine rows (none when nothing changed).
+    """
+    posted = current.filter(is_active=True).values('account_id').annotate(
+        net=Sum(F('debit_amount') - F('credit_amount'))
+    ).order_by()
+    differences = defaultdict(Decimal)
+    for row in posted:
+        differences[row['account_id']] -= _amount(row['net'])
+    for line in lines:
+        differences[_account_id(line.account)] += _amount(line.debit) - _amount(line.credit)
+    adjustments = [
+        Line(account_id, debit=max(difference, 0), credit=max(-difference, 0),
+             description=description, invoice_id=invoice_id, bill_id=bill_id)
+        for account_id, difference in sorted(differences.items())
+        if difference
+    ]
+    if not adjustments:
+        return []
+    return post_lines(transaction, adjustments)
+
+
+def reverse_lines(lines):
+    """
+    Deactivate the active lines of a TransactionLine queryset and take their
+    amounts back out of the account balances and snapshots.
+    """
+    with db_transaction.atomic():
+        lines = lines.filter(is_active=True)
+        totals = lines.filter(transaction__is_active=True).values('account_id').annotate(
+            debit_sum=Sum('debit_amount'),
+            credit_sum=Sum('credit_amount'),
+        ).order_by()
+        deltas = {
+            row['account_id']: (-(row['debit_sum'] or 0), -(row['credit_sum'] or 0))
+            for row in totals
+        }
+        _apply_balances(deltas)
+        return snapshots.deactivate_lines(lines)
+
+
+def reverse_transaction(transaction):
+    """Reverse every line of `transaction` and mark it inactive."""
+    with db_transaction.atomic():
+        reverse_lines(TransactionLine.objects.filter(transaction=transaction))
+        transaction.is_active = False
+        transaction.save()
@@ -0,0 +1,108 @@
+"""
+Process-wide registry of the system accounts the posting code uses by code.
+
+The ids of all system accounts are loaded with one query the first time any
+of them is needed and reused afterwards, so posting paths reference them by
+id without querying Account again. The cached ids are tagged with the version
+of the SystemAccountVersion row they were loaded at. Saving or deleting an
+account whose code is (or was) a system code bumps that row in the same
+transaction (see accounts.signals). The version is read by primary key,
+so each process reloads once the change has committed, with no shared cache
+required.
+
+Within a request the version is read at the first lookup only; the later
+lookups of the request (a document posting looks up several accounts) use
+the ids as they were then, unless the request itself changes a system
+account. Outside a request, e.g. in management commands, every lookup reads
+the version.
+"""
+import threading
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .models import Account, SystemAccountVersion
+
+
+INVENTORY = 'INV-001'
+RECEIVABLE = 'AR-001'
+PAYABLE = 'AP-001'
+TAX_PAYABLE = 'AP-002'
+COST_OF_GOODS_SOLD = 'COGS-001'
+SALES_INCOME = 'INC-001'
+OWNER_EQUITY = 'OWN-001'
+MISCELLANEOUS_LOSS = 'MIS-001'
+
+SYSTEM_CODES = [
+    INVENTORY, RECEIVABLE, PAYABLE, TAX_PAYABLE,
+    COST_OF_GOODS_SOLD, SALES_INCOME, OWNER_EQUITY, MISCELLANEOUS_LOSS,
+]
+
+VERSION_ID = 1
+
+_state = {'version': None, 'ids': {}}
+
+# per thread: whether a request is being served and whether it has read the version yet
+_request = threading.local()
+
+
+def _current_version():
+    return SystemAccountVersion.objects.filter(pk=VERSION_ID).values_list('version', flat=True).first() or 0
+
+
+def _ids():
+    in_request = getattr(_request, 'active', False)
+    if in_request and _request.checked and _state['version'] is not None:
+        return _state['ids']
+    version = _current_version()
+    if _state['version'] != version:
+        _state['ids'] = dict(
+            Account.objects.filter(code__in=SYSTEM_CODES, is_active=True).values_list('code', 'id')
+        )
+        _state['version'] = version
+    _request.checked = in_request
+    return _state['ids']
+
+
+def start_request():
+    """Called when a request starts: its first lookup reads the version, the others do not."""
+    _request.active = True
+    _request.checked = False
+
+
+def end_request():
+    _request.active = False
+
+
+def _lookup(ids, code):
+    if code not in ids:
+        raise Account.DoesNotExist(f"System account {code} does not exist or is inactive.")
+    return ids[code]
+
+
+def account_id(code):
+    """Id of the active system account with `code`; raises Account.DoesNotExist if there is none."""
+    return _lookup(_ids(), code)
+
+
+def account_ids(*codes):
+    """Ids of several system accounts, in the order of `codes`."""
+    ids = _ids()
+    return tuple(_lookup(ids, code) for code in codes)
+
+
+def invalidate():
+    """
+    Bump the version in the current transaction, so every process reloads the
+    system account ids on its next lookup once the change has committed.
+    """
+    versions = SystemAccountVersion.objects.filter(pk=VERSION_ID)
+    if not versions.update(version=F('version') + 1):
+        try:
+            with transaction.atomic():
+                SystemAccountVersion.objects.create(pk=VERSION_ID, version=1)
+        except IntegrityError:
+            versions.update(version=F('version') + 1)
+    _state['version'] = None
+
+
+def is_system_code(code):
+    return code in SYSTEM_CODES
@@ -0,0 +1,106 @@
+"""
+Keep AccountDailyBalance in step with per-object saves and deletes of
+TransactionLine and Transaction. Bulk operations (bulk_create, queryset
+update) do not send signals and must go through accounts.snapshots directly.
+
+Also invalidates the system account registry when an account's code or
+active flag changes in a way that can move a system code, and tells it when
+requests start and finish.
+"""
+from decimal import Decimal
+from django.core.signals import request_started, request_finished
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from .models import Account, Transaction, TransactionLine
+from . import registry, snapshots
+
+
+def _amount(value):
+    # Amounts may still be floats on an unsaved-from-DB instance; store them the way the column does.
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+
+
+def _add(deltas, key, debit, credit, sign):
+    current_debit, current_credit = deltas.get(key, (Decimal('0.00'), Decimal('0.00')))
+    deltas[key] = (current_debit + sign * _amount(debit), current_credit + sign * _amount(credit))
+
+
+@receiver(pre_save, sender=TransactionLine)
+def capture_line_state(sender, instance, raw=False, **kwargs):
+    instance._snapshot_state = None
+    if raw or instance.pk is None:
+        return
+    instance._snapshot_state = TransactionLine.objects.filter(pk=instance.pk).values(
+        'account_id', 'debit_amount', 'credit_amount', 'is_active',
+        'transaction__date', 'transaction__is_active',
+    ).first()
+
+
+@receiver(post_save, sender=TransactionLine)
+def apply_line_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = {}
+    old = getattr(instance, '_snapshot_state', None)
+    if old and old['is_active'] and old['transaction__is_active']:
+        _add(deltas, (old['account_id'], old['transaction__date']), old['debit_amount'], old['credit_amount'], -1)
+    parent = instance.transaction
+    if instance.is_active and parent.is_active:
+        _add(deltas, (instance.account_id, snapshots.as_date(parent.date)), instance.debit_amount, instance.credit_amount, 1)
+    snapshots.apply_deltas(deltas)
+
+
+@receiver(pre_delete, sender=TransactionLine)
+def remove_line(sender, instance, **kwargs):
+    snapshots.reverse_lines(TransactionLine.objects.filter(pk=instance.pk))
+
+
+@receiver(pre_save, sender=Transaction)
+def capture_transaction_state(sender, instance, raw=False, **kwargs):
+    instance._snapshot_state = None
+    if raw or instance.pk is None:
+        return
+    instance._snapshot_state = Transaction.objects.filter(pk=instance.pk).values('date', 'is_active').first()
+
+
+@receiver(post_save, sender=Transaction)
+def apply_transaction_change(sender, instance, raw=False, **kwargs):
+    old = getattr(instance, '_snapshot_state', None)
+    if raw or not old:
+        return
+    new_date = snapshots.as_date(instance.date)
+    if old['date'] != new_date or old['is_active'] != instance.is_active:
+        snapshots.move_transaction(instance.pk, old['date'], old['is_active'], new_date, instance.is_active)
+
+
+@receiver(pre_save, sender=Account)
+def capture_account_state(sender, instance, raw=False, **kwargs):
+    instance._registry_state = None
+    if raw or instance.pk is None:
+        return
+    instance._registry_state = Account.objects.filter(pk=instance.pk).values_list('code', 'is_active').first()
+
+
+@receiver(post_save, sender=Account)
+def invalidate_registry_on_save(sender, instance, raw=False, **kwargs):
+    previous = getattr(instance, '_registry_state', None)
+    if previous == (instance.code, instance.is_active):
+        return
+    if registry.is_system_code(instance.code) or (previous and registry.is_system_code(previous[0])):
+        registry.invalidate()
+
+
+@receiver(post_delete, sender=Account)
+def invalidate_registry_on_delete(sender, instance, **kwargs):
+    if registry.is_system_code(instance.code):
+        registry.invalidate()
+
+
+@receiver(request_started)
+def start_registry_request(sender, **kwargs):
+    registry.start_request()
+
+
+@receiver(request_finished)
+def end_registry_request(sender, **kwargs):
+    registry.end_request()
@@ -0,0 +1,188 @@
+"""
+Maintenance and lookups for AccountDailyBalance.
+
+A line contributes to the snapshot of (line.account, line.transaction.date)
+while both the line and its transaction are active. Every change in that
+contribution is applied as a delta: the day row absorbs the debit/credit and
+the running balance of that day and every later day of the account shifts by
+the net amount. As-of and range balances then need one snapshot row per bound
+instead of a scan over the whole ledger.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import F, Sum, OuterRef, Subquery
+from django.utils import timezone
+from .models import Account, AccountDailyBalance, Transaction, TransactionLine
+
+
+def as_date(value):
+    """Normalize a Transaction.date value; views assign strings or datetimes before saving."""
+    return Transaction._meta.get_field('date').to_python(value)
+
+
+def net_before(account_id, day):
+    """Debit minus credit of an account over everything dated before `day`."""
+    previous_balance = AccountDailyBalance.objects.filter(
+        account_id=account_id, date__lt=day
+    ).order_by('-date').values_list('running_balance', flat=True).first()
+    return previous_balance or Decimal('0.00')
+
+
+def _add_to_day(account_id, day, debit, credit):
+    """Add to the (account, day) row, creating it when the day has none yet."""
+    day_row = AccountDailyBalance.objects.filter(account_id=account_id, date=day)
+    if day_row.update(debit_total=F('debit_total') + debit, credit_total=F('credit_total') + credit):
+        return
+    try:
+        with db_transaction.atomic():
+            AccountDailyBalance.objects.create(
+                account_id=account_id,
+                date=day,
+                debit_total=debit,
+                credit_total=credit,
+                running_balance=net_before(account_id, day),
+            )
+    except IntegrityError:
+        # another worker created the day between the update and the insert
+        day_row.update(debit_total=F('debit_total') + debit, credit_total=F('credit_total') + credit)
+
+
+def apply_deltas(deltas):
+    """
+    Apply {(account_id, date): (debit, credit)} to the snapshot table.
+    Negative amounts remove a previous contribution.
+    """
+    with db_transaction.atomic():
+        for (account_id, day), (debit, credit) in sorted(deltas.items()):
+            if not debit and not credit:
+                continue
+            _add_to_day(account_id, day, debit, credit)
+            AccountDailyBalance.objects.filter(account_id=account_id, date__gte=day).update(
+                running_balance=F('running_balance') + (debit - credit)
+            )
+            # A day with no remaining activity carries the previous running balance; drop it.
+            AccountDailyBalance.objects.filter(
+                account_id=account_id, date=day, debit_total=0, credit_total=0
+            ).delete()
+
+
+def _line_deltas(lines, sign):
+    deltas = defaultdict(lambda: (Decimal('0.00'), Decimal('0.00')))
+    rows = lines.filter(is_active=True, transaction__is_active=True).values(
+        'account_id', 'transaction__date'
+    ).annotate(
+        debit_sum=Sum('debit_amount'),
+        credit_sum=Sum('credit_amount'),
+    ).order_by()
+    for row in rows:
+        key = (row['account_id'], row['transaction__date'])
+        debit, credit = deltas[key]
+        deltas[key] = (debit + sign * (row['debit_sum'] or 0), credit + sign * (row['credit_sum'] or 0))
+    return deltas
+
+
+def record_lines(lines):
+    """Add the contribution of the active lines in `lines` (a TransactionLine queryset)."""
+    apply_deltas(_line_deltas(lines, 1))
+
+
+def reverse_lines(lines):
+    """Remove the contribution of the active lines in `lines` (a TransactionLine queryset)."""
+    apply_deltas(_line_deltas(lines, -1))
+
+
+def deactivate_lines(lines):
+    """Deactivate a TransactionLine queryset, keeping the snapshots in step."""
+    with db_transaction.atomic():
+        reverse_lines(lines)
+        return lines.update(is_active=False, updated_at=timezone.now())
+
+
+def move_transaction(transaction_id, old_date, old_active, new_date, new_active):
+    """Re-key the active lines of a transaction after its date or active flag changed."""
+    deltas = defaultdict(lambda: (Decimal('0.00'), Decimal('0.00')))
+    rows = TransactionLine.objects.filter(transaction_id=transaction_id, is_active=True).values(
+        'account_id'
+    ).annotate(
+        debit_sum=Sum('debit_amount'),
+        credit_sum=Sum('credit_amount'),
+    ).order_by()
+    for row in rows:
+        debit_sum, credit_sum = row['debit_sum'] or 0, row['credit_sum'] or 0
+        if old_active:
+            debit, credit = deltas[(row['account_id'], old_date)]
+            deltas[(row['account_id'], old_date)] = (debit - debit_sum, credit - credit_sum)
+        if new_active:
+            debit, credit = deltas[(row['account_id'], new_date)]
+            deltas[(row['account_id'], new_date)] = (debit + debit_sum, credit + credit_sum)
+    apply_deltas(deltas)
+
+
+def rebuild(account_ids=None):
+    """
+    Recompute snapshots from TransactionLine. Returns the number of rows written.
+    """
+    lines = TransactionLine.objects.filter(is_active=True, transaction__is_active=True)
+    snapshots = AccountDailyBalance.objects.all()
+    if account_ids is not None:
+        lines = lines.filter(account_id__in=account_ids)
+        snapshots = snapshots.filter(account_id__in=account_ids)
+
+    rows = lines.values('account_id', 'transaction__date').annotate(
+        debit_sum=Sum('debit_amount'),
+        credit_sum=Sum('credit_amount'),
+    ).order_by('account_id', 'transaction__date')
+
+    new_rows = []
+    current_account = None
+    running_balance = Decimal('0.00')
+    for row in rows.iterator():
+        if row['account_id'] != current_account:
+            current_account = row['account_id']
+            running_balance = Decimal('0.00')
+        debit_sum = row['debit_sum'] or Decimal('0.00')
+        credit_sum = row['credit_sum'] or Decimal('0.00')
+        running_balance += debit_sum - credit_sum
+        new_rows.append(AccountDailyBalance(
+            account_id=row['account_id'],
+            date=row['transaction__date'],
+            debit_total=debit_sum,
+            credit_total=credit_sum,
+            running_balance=running_balance,
+        ))
+
+    with db_transaction.atomic():
+        snapshots.delete()
+        AccountDailyBalance.objects.bulk_create(new_rows, batch_size=1000)
+    return len(new_rows)
+
+
+def _running_balance_before(day, inclusive):
+    snapshots = AccountDailyBalance.objects.filter(account=OuterRef('pk'))
+    if day is not None:
+        snapshots = snapshots.filter(date__lte=day) if inclusive else snapshots.filter(date__lt=day)
+    return Subquery(snapshots.order_by('-date').values('running_balance')[:1])
+
+
+def net_balances(start_date=None, end_date=None, accounts=None):
+    """
+    Return {account_id: debit minus credit} for the given Account queryset
+    (all accounts by default). With both bounds the result covers the range,
+    otherwise the full history. One query, two snapshot lookups per account.
+    """
+    if accounts is None:
+        accounts = Account.objects.all()
+    bounded = bool(start_date and end_date)
+    accounts = accounts.annotate(
+        closing_balance=_running_balance_before(end_date if bounded else None, inclusive=True),
+    )
+    if bounded:
+        accounts = accounts.annotate(opening_balance=_running_balance_before(start_date, inclusive=False))
+
+    balances = {}
+    for row in accounts.values('id', 'closing_balance', *(['opening_balance'] if bounded else [])):
+        closing_balance = row['closing_balance'] or Decimal('0.00')
+        opening_balance = (row.get('opening_balance') or Decimal('0.00')) if bounded else Decimal('0.00')
+        balances[row['id']] = closing_balance - opening_balance
+    return balances
@@ -1,3 +1,157 @@
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+from django.db import connection
+from django.db.models import F, QuerySet
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from authentication.models import NewUser
+from .models import Account, AccountDailyBalance, SystemAccountVersion, Transaction, TransactionLine
+from . import integrity, posting, registry, snapshots
 
-# Create your tests here.
+
+class RegistryTests(TestCase):
+    def setUp(self):
+        Account.create_default_accounts()
+
+    def test_lookup_follows_changes_committed_by_other_workers(self):
+        inventory_id = registry.account_id(registry.INVENTORY)
+        # another worker recodes the account; its signal bumps the version row
+        Account.objects.filter(id=inventory_id).update(code='INV-OLD')
+        SystemAccountVersion.objects.update(version=F('version') + 1)
+        with self.assertRaises(Account.DoesNotExist):
+            registry.account_id(registry.INVENTORY)
+
+    def test_saving_a_system_account_reloads_the_ids(self):
+        receivable = Account.objects.get(code=registry.RECEIVABLE)
+        self.assertEqual(registry.account_ids(registry.RECEIVABLE), (receivable.id,))
+        receivable.is_active = False
+        receivable.save()
+        with self.assertRaises(Account.DoesNotExist):
+            registry.account_id(registry.RECEIVABLE)
+        receivable.is_active = True
+        receivable.save()
+        self.assertEqual(registry.account_id(registry.RECEIVABLE), receivable.id)
+
+
+    def test_version_is_read_once_per_request(self):
+        registry.start_request()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                registry.account_ids(registry.INVENTORY, registry.RECEIVABLE)
+                registry.account_id(registry.PAYABLE)
+                registry.account_id(registry.SALES_INCOME)
+            self.assertEqual(sum('systemaccountversion' in query['sql'] for query in queries.captured_queries), 1)
+            # a change made by the request itself is still seen
+            Account.objects.filter(code=registry.PAYABLE).get().delete()
+            with self.assertRaises(Account.DoesNotExist):
+                registry.account_id(registry.PAYABLE)
+        finally:
+            registry.end_request()
+
+
+class PostTransactionsTests(TestCase):
+    def setUp(self):
+        Account.create_default_accounts()
+        self.user = NewUser.objects.create(email='books@example.com', username='books', user_type='admin')
+
+    def entries(self):
+        cash, sales = Account.objects.get(code='CASH-001'), Account.objects.get(code=registry.SALES_INCOME)
+        return [
+            (Transaction(reference_number=f'IMP-{n}', transaction_type='journal', date=date(2024, 1, n),
+                         description='import', created_by=self.user),
+             [posting.Line(cash, debit=n), posting.Line(sales, credit=n)])
+            for n in (1, 2, 3)
+        ]
+
+    def test_lines_belong_to_their_transactions_without_bulk_returning(self):
+        features = type(connection.features)
+        with mock.patch.object(features, 'can_return_rows_from_bulk_insert', new_callable=mock.PropertyMock, return_value=False):
+            self.assertEqual(posting.post_transactions(self.entries()), 6)
+        for transaction in Transaction.objects.all():
+            amounts = TransactionLine.objects.filter(transaction=transaction).values_list('debit_amount', 'credit_amount')
+            number = Decimal(transaction.reference_number.split('-')[1])
+            self.assertEqual(sorted(amounts), [(Decimal('0.00'), number), (number, Decimal('0.00'))])
+        self.assertEqual(Account.objects.get(code='CASH-001').balance, Decimal('6.00'))
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        Account.create_default_accounts()
+        self.user = NewUser.objects.create(email='books@example.com', username='books', user_type='admin')
+        self.cash = Account.objects.get(code='CASH-001')
+        self.sales = Account.objects.get(code=registry.SALES_INCOME)
+
+    def days(self, account):
+        return list(AccountDailyBalance.objects.filter(account=account).order_by('date').values_list(
+            'date', 'debit_total', 'credit_total', 'running_balance'
+        ))
+
+    def post(self, day, amount):
+        return posting.post_transaction(
+            [posting.Line(self.cash, debit=amount), posting.Line(self.sales, credit=amount)],
+            reference_number=f'SALE-{day.isoformat()}-{amount}', transaction_type='income', date=day,
+            description='sale', created_by=self.user,
+        )
+
+    def test_apply_deltas_shifts_later_days_and_drops_empty_ones(self):
+        snapshots.apply_deltas({(self.cash.id, date(2024, 1, 5)): (Decimal('10'), Decimal('0'))})
+        snapshots.apply_deltas({(self.cash.id, date(2024, 1, 2)): (Decimal('0'), Decimal('4'))})
+        self.assertEqual(self.days(self.cash), [
+            (date(2024, 1, 2), Decimal('0.00'), Decimal('4.00'), Decimal('-4.00')),
+            (date(2024, 1, 5), Decimal('10.00'), Decimal('0.00'), Decimal('6.00')),
+        ])
+        snapshots.apply_deltas({(self.cash.id, date(2024, 1, 5)): (Decimal('-10'), Decimal('0'))})
+        self.assertEqual(self.days(self.cash), [(date(2024, 1, 2), Decimal('0.00'), Decimal('4.00'), Decimal('-4.00'))])
+
+    def test_apply_deltas_adds_to_a_day_created_concurrently(self):
+        day = date(2024, 1, 5)
+        # another worker creates the day right after our update found nothing to change
+        AccountDailyBalance.objects.create(account=self.cash, date=day, debit_total=5, running_balance=5)
+        update = QuerySet.update
+        calls = []
+
+        def miss_first_update(queryset, **fields):
+            calls.append(fields)
+            return 0 if len(calls) == 1 else update(queryset, **fields)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=miss_first_update):
+            snapshots.apply_deltas({(self.cash.id, day): (Decimal('10'), Decimal('0'))})
+        self.assertEqual(self.days(self.cash), [(day, Decimal('15.00'), Decimal('0.00'), Decimal('15.00'))])
+
+    def test_rebuild_and_net_balances_agree_with_the_ledger(self):
+        self.post(date(2024, 1, 3), 30)
+        self.post(date(2024, 1, 1), 10)
+        transaction = self.post(date(2024, 1, 2), 20)
+        transaction.date = date(2024, 1, 4)
+        transaction.save()
+        incremental = self.days(self.cash)
+        self.assertEqual(snapshots.rebuild(), 6)
+        self.assertEqual(self.days(self.cash), incremental)
+        self.assertEqual([row[3] for row in incremental], [Decimal('10.00'), Decimal('40.00'), Decimal('60.00')])
+
+        accounts = Account.objects.filter(id__in=[self.cash.id, self.sales.id])
+        self.assertEqual(snapshots.net_balances(accounts=accounts),
+                         {self.cash.id: Decimal('60.00'), self.sales.id: Decimal('-60.00')})
+        self.assertEqual(snapshots.net_balances(date(2024, 1, 2), date(2024, 1, 3), accounts),
+                         {self.cash.id: Decimal('30.00'), self.sales.id: Decimal('-30.00')})
+
+
+class IntegrityTests(TestCase):
+    def setUp(self):
+        Account.create_default_accounts()
+        self.user = NewUser.objects.create(email='books@example.com', username='books', user_type='admin')
+
+    def test_lines_of_inactive_transactions_are_not_reported(self):
+        cash, sales = Account.objects.get(code='CASH-001'), Account.objects.get(code=registry.SALES_INCOME)
+        transaction = posting.post_transaction(
+            [posting.Line(cash, debit=10), posting.Line(sales, credit=10)],
+            reference_number='SALE-1', transaction_type='income', date=date(2024, 1, 1),
+            description='sale', created_by=self.user,
+        )
+        # a voided transaction whose lines were only partly retired
+        Transaction.objects.filter(id=transaction.id).update(is_active=False)
+        TransactionLine.objects.filter(transaction=transaction, account=sales).update(is_active=False)
+        self.assertEqual(integrity.unbalanced_transactions(), [])
+        Transaction.objects.filter(id=transaction.id).update(is_active=True)
+        self.assertEqual([row['transaction_id'] for row in integrity.unbalanced_transactions()], [transaction.id])
@@ -22,7 +22,13 @@ from .views import (AddAccountAPI,
                     ProfitLossComparisonAccrualView,
                     ProfitLossComparisonXLSXView,
                     BankAccountTransactionsAPIView,
-                    BankAccountTransactionsExportAPIView
+                    BankAccountTransactionsExportAPIView,
+                    BankAccountTransactionsCSVExportAPIView,
+                    BankRegisterView,
+                    JournalImportView,
+                    LedgerIntegrityView,
+                    AgingReportView,
+                    AgingReportXLSXView
                     )
 
 urlpatterns = [
@@ -35,6 +41,8 @@ urlpatterns = [
     path('accounts-recievable/', AccountReceivablesView.as_view(), name='account-receivables'),
     path('accounts-recievable/<int:customer_id>/', AccountReceivablesSingleView.as_view(), name='account-receivables'),
     path('accounts-recievable-datewise/', AccountsReceivableAPIView.as_view(), name='account-receivables-datewise'),
+    path('aging/', AgingReportView.as_view(), name='aging-report'),
+    path('aging-xlsx/', AgingReportXLSXView.as_view(), name='aging-report-xlsx'),
     
     path('balancesheet/', BalanceSheetView.as_view(), name='balancesheet'),
     path('balancesheet/compare/', CompareBalanceSheetView.as_view(), name='balancesheet-compare'),
@@ -54,4 +62,9 @@ urlpatterns = [
   
     path('view-bank-transactions/', BankAccountTransactionsAPIView.as_view(), name='view-bank-transactions'),
     path('view-bank-transactions/xlsx/', BankAccountTransactionsExportAPIView.as_view(), name='view-bank-transactions-xlsx'),
+    path('view-bank-transactions/csv/', BankAccountTransactionsCSVExportAPIView.as_view(), name='view-bank-transactions-csv'),
+    path('bank-register/', BankRegisterView.as_view(), name='bank-register'),
+
+    path('journal-import/', JournalImportView.as_view(), name='journal-import'),
+    path('ledger-integrity/', LedgerIntegrityView.as_view(), name='ledger-integrity'),
 ] 
@@ -1,7 +1,7 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Account, ReceivableTracking, Transaction, TransactionLine, PayableTracking, OwnerPaymentDetails
+from .models import Account, ReceivableTracking, Transaction, TransactionLine, PayableTracking, OwnerPaymentDetails, LedgerCheckpoint
 from django.core.exceptions import ValidationError
 from django.db.models import Sum, Q
 import io
@@ -10,7 +10,7 @@ from collections import defaultdict
 from rest_framework.pagination import PageNumberPagination
 from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment, Border, Side
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, FileResponse, StreamingHttpResponse
 from django.core.paginator import Paginator, EmptyPage
 from customers.models import Customer, Vendor
 from rest_framework.permissions import IsAuthenticated
@@ -26,6 +26,9 @@ from django.utils.timezone import now
 from dateutil.relativedelta import relativedelta
 from io import BytesIO
 import math
+import base64
+from rest_framework.parsers import MultiPartParser
+from . import aging, exports, integrity, journal_import, ledger, posting, snapshots
 
 
 class AddAccountAPI(APIView):
@@ -363,6 +366,94 @@ class AccountPayableSingleView(APIView):
             )
 
 
+class AgingReportView(APIView):
+    """
+    Receivable and payable aging (current, 1-30, 31-60, 61-90, 90+ days past
+    due) as of `as_of` (default today). `type` limits the report to
+    'receivable' or 'payable'.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @staticmethod
+    def parse_params(request):
+        as_of = request.query_params.get('as_of')
+        as_of = datetime.strptime(as_of, "%Y-%m-%d").date() if as_of else now().date()
+        report_type = request.query_params.get('type')
+        if report_type and report_type not in aging.SIDES:
+            raise ValueError(f"type must be one of {list(aging.SIDES)}.")
+        return as_of, [report_type] if report_type else list(aging.SIDES)
+
+    def get(self, request):
+        try:
+            as_of, sides = self.parse_params(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            report = {
+                'as_of': as_of,
+                'buckets': [{'key': key, 'label': label} for key, label, _, _ in aging.BUCKETS],
+            }
+            for side in sides:
+                data, totals = aging.aging(side, as_of)
+                report[side] = {'data': data, 'totals': totals}
+
+            audit_log(user=request.user,
+                      action="Aging report viewed",
+                      ip_add=request.META.get('HTTP_X_FORWARDED_FOR'),
+                      model_name="Invoice",
+                      record_id=0)
+            return Response(report, status=status.HTTP_200_OK)
+        except Exception as e:
+            log.trace.trace(f"Error generating aging report {traceback.format_exc()}")
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class AgingReportXLSXView(APIView):
+    """Aging report as a workbook with one sheet per side."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            as_of, sides = AgingReportView.parse_params(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            party_headers = {'receivable': 'Customer', 'payable': 'Vendor'}
+            bucket_keys = [key for key, _, _, _ in aging.BUCKETS] + ['total']
+            bucket_labels = [label for _, label, _, _ in aging.BUCKETS] + ['Total']
+
+            workbook = Workbook()
+            workbook.remove(workbook.active)
+            bold = Font(bold=True)
+            for side in sides:
+                data, totals = aging.aging(side, as_of)
+                sheet = workbook.create_sheet(title=f"{side.capitalize()} Aging")
+                sheet.append([f"{side.capitalize()} aging as of {as_of}"])
+                sheet['A1'].font = bold
+                sheet.append([party_headers[side], 'Open Documents'] + bucket_labels)
+                for cell in sheet[2]:
+                    cell.font = bold
+                for row in data:
+                    sheet.append([row['name'], row['open_documents']] + [float(row[key]) for key in bucket_keys])
+                sheet.append(['Total', sum(row['open_documents'] for row in data)] + [float(totals[key]) for key in bucket_keys])
+                for cell in sheet[sheet.max_row]:
+                    cell.font = bold
+                sheet.column_dimensions['A'].width = 35
+                for row in sheet.iter_rows(min_row=3, min_col=3):
+                    for cell in row:
+                        cell.number_format = '#,##0.00'
+
+            response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+            response['Content-Disposition'] = f'attachment; filename=aging_report_{as_of}.xlsx'
+            workbook.save(response)
+            return response
+        except Exception as e:
+            log.trace.trace(f"Error exporting aging report {traceback.format_exc()}")
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 class BalanceSheetView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -378,84 +469,21 @@ class BalanceSheetView(APIView):
         except ValueError:
             return JsonResponse({'error': 'Invalid date format. Use YYYY-MM-DD.'}, status=400)
 
-        def calculate_balance(account, non_asset=False):
-            if start_date and end_date:
-                transaction_lines = TransactionLine.objects.filter(
-                    account=account,
-                    transaction__date__gte=start_date,
-                    transaction__date__lte=end_date,
-                    transaction__is_active=True,
-                    is_active=True
-                )
-            else:
-                transaction_lines = TransactionLine.objects.filter(
-                    account=account,
-                    transaction__is_active=True,
-                    is_active=True
-                )
-            debit_sum = transaction_lines.aggregate(Sum('debit_amount'))['debit_amount__sum'] or Decimal('0.00')
-            credit_sum = transaction_lines.aggregate(Sum('credit_amount'))['credit_amount__sum'] or Decimal('0.00')
-            if non_asset:
-                return_val = credit_sum - debit_sum
-            else:
-                return_val = debit_sum - credit_sum 
-            return return_val
-
-        # Asset Accounts
-        asset_types = ['cash', 'bank', 'accounts_receivable', 'inventory', 'fixed_assets', 'other_current_assets']
-        assets = []
-        total_assets = Decimal('0.00')
+        sheet = ledger.balance_sheet(start_date, end_date)
 
-        for asset_type in asset_types:
-            accounts = Account.objects.filter(account_type=asset_type, is_active=True)
-            for account in accounts:
-                balance = calculate_balance(account)
-                assets.append({
-                    'name': account.name,
-                    'code': account.code,
-                    'balance': float(balance)
-                })
-                total_assets += balance
-
-        # Liability Accounts
-        liability_types = ['accounts_payable', 'credit_card', 'current_liabilities', 'long_term_liabilities', 'tax_payable']
-        liabilities = []
-        total_liabilities = Decimal('0.00')
-
-        for liability_type in liability_types:
-            accounts = Account.objects.filter(account_type=liability_type, is_active=True)
-            for account in accounts:
-                balance = calculate_balance(account, non_asset=True)
-                liabilities.append({
-                    'name': account.name,
-                    'code': account.code,
-                    'balance': float(balance)
-                })
-                total_liabilities += balance
-
-        # Equity Accounts
-        equity_types = ['owner_equity', 'retained_earnings']
-        equity = []
-        total_equity = Decimal('0.00')
-
-        for equity_type in equity_types:
-            accounts = Account.objects.filter(account_type=equity_type, is_active=True)
-            for account in accounts:
-                balance = calculate_balance(account, non_asset=True)
-                equity.append({
-                    'name': account.name,
-                    'code': account.code,
-                    'balance': float(balance)
-                })
-                total_equity += balance
+        def serialize(rows):
+            return [
+                {'name': account.name, 'code': account.code, 'balance': float(balance)}
+                for account, balance in rows
+            ]
 
         return JsonResponse({
-            'assets': assets,
-            'liabilities': liabilities,
-            'equity': equity,
-            'total_assets': float(total_assets),
-            'total_liabilities': float(total_liabilities),
-            'total_equity': float(total_equity)
+            'assets': serialize(sheet['assets']),
+            'liabilities': serialize(sheet['liabilities']),
+            'equity': serialize(sheet['equity']),
+            'total_assets': float(sheet['total_assets']),
+            'total_liabilities': float(sheet['total_liabilities']),
+            'total_equity': float(sheet['total_equity'])
         })
 
 
@@ -476,46 +504,28 @@ class CompareBalanceSheetView(APIView):
         except ValueError:
             return JsonResponse({'error': 'Invalid date format. Use YYYY-MM-DD.'}, status=400)
 
-        def calculate_balance(account, start_date, end_date, non_asset=False):
-            transaction_lines = TransactionLine.objects.filter(
-                account=account,
-                transaction__is_active=True,
-                is_active=True
-            )
-            if start_date and end_date:
-                transaction_lines = transaction_lines.filter(
-                    transaction__date__gte=start_date,
-                    transaction__date__lte=end_date
-                )
-            
-            debit_sum = transaction_lines.aggregate(Sum('debit_amount'))['debit_amount__sum'] or Decimal('0.00')
-            credit_sum = transaction_lines.aggregate(Sum('credit_amount'))['credit_amount__sum'] or Decimal('0.00')
-            return credit_sum - debit_sum if non_asset else debit_sum - credit_sum
+        accounts = ledger.active_accounts(ledger.ASSET_TYPES + ledger.LIABILITY_TYPES + ledger.EQUITY_TYPES)
+        period1_totals = ledger.account_totals(period1_start, period1_end)
+        period2_totals = ledger.account_totals(period2_start, period2_end)
 
-        def get_comparison_data(account_types, non_asset=False):
+        def get_comparison_data(account_types):
+            period1_rows, _ = ledger.section_balances(accounts, account_types, period1_totals)
+            period2_rows, _ = ledger.section_balances(accounts, account_types, period2_totals)
             comparison = []
-            for account_type in account_types:
-                accounts = Account.objects.filter(account_type=account_type, is_active=True)
-                for account in accounts:
-                    balance_period1 = calculate_balance(account, period1_start, period1_end, non_asset)
-                    balance_period2 = calculate_balance(account, period2_start, period2_end, non_asset)
-                    comparison.append({
-                        'name': account.name,
-                        'code': account.code,
-                        'period1_balance': float(balance_period1),
-                        'period2_balance': float(balance_period2),
-                        'difference': float(balance_period2 - balance_period1)
-                    })
+            for (account, balance_period1), (_, balance_period2) in zip(period1_rows, period2_rows):
+                comparison.append({
+                    'name': account.name,
+                    'code': account.code,
+                    'period1_balance': float(balance_period1),
+                    'period2_balance': float(balance_period2),
+                    'difference': float(balance_period2 - balance_period1)
+                })
             return comparison
 
-        asset_types = ['cash', 'bank', 'accounts_receivable', 'inventory', 'fixed_assets', 'other_current_assets']
-        liability_types = ['accounts_payable', 'credit_card', 'current_liabilities', 'long_term_liabilities', 'tax_payable']
-        equity_types = ['owner_equity', 'retained_earnings']
-
         return JsonResponse({
-            'assets': get_comparison_data(asset_types),
-            'liabilities': get_comparison_data(liability_types, non_asset=True),
-            'equity': get_comparison_data(equity_types, non_asset=True)
+            'assets': get_comparison_data(ledger.ASSET_TYPES),
+            'liabilities': get_comparison_data(ledger.LIABILITY_TYPES),
+            'equity': get_comparison_data(ledger.EQUITY_TYPES)
         })
 
 
@@ -536,79 +546,19 @@ class BalanceSheetXLSXView(APIView):
         except ValueError:
             return JsonResponse({'error': 'Invalid date format. Use YYYY-MM-DD.'}, status=400)
 
-        def calculate_balance(account, non_asset=False):
-            if start_date and end_date:
-                transaction_lines = TransactionLine.objects.filter(
-                    account=account,
-                    transaction__date__gte=start_date,
-                    transaction__date__lte=end_date,
-                    transaction__is_active=True,
-                    is_active=True
-                )
-            else:
-                transaction_lines = TransactionLine.objects.filter(
-                    account=account,
-                    transaction__is_active=True,
-                    is_active=True
-                )
-            debit_sum = transaction_lines.aggregate(Sum('debit_amount'))['debit_amount__sum'] or Decimal('0.00')
-            credit_sum = transaction_lines.aggregate(Sum('credit_amount'))['credit_amount__sum'] or Decimal('0.00')
-            if non_asset:
-                return_val = credit_sum - debit_sum
-            else:
-                return_val = debit_sum - credit_sum 
-            return return_val
-
-        # Asset Accounts
-        asset_types = ['cash', 'bank', 'accounts_receivable', 'inventory', 'fixed_assets', 'other_current_assets']
-        assets = []
-        total_assets = Decimal('0.00')
-        assets.append({"name":"Assets","balance":None})
-        for asset_type in asset_types:
-            accounts = Account.objects.filter(account_type=asset_type, is_active=True)
-            for account in accounts:
-                balance = calculate_balance(account)
-                assets.append({
-                    'name': account.name,
-                    'balance': float(balance)
-                })
-                total_assets += balance
-        assets.append({"name":"Total Assets","balance":float(total_assets)})
-
-        # Liability Accounts
-        liability_types = ['accounts_payable', 'credit_card', 'current_liabilities', 'long_term_liabilities', 'tax_payable']
-        liabilities = []
-        total_liabilities = Decimal('0.00')
-        liabilities.append({"name":"Liabilities","balance":None})
-        for liability_type in liability_types:
-            accounts = Account.objects.filter(account_type=liability_type, is_active=True)
-            for account in accounts:
-                balance = calculate_balance(account, non_asset=True)
-                liabilities.append({
-                    'name': account.name,
-                    'balance': float(balance)
-                })
-                total_liabilities += balance
-        liabilities.append({"name":"Total Liabilities","balance":float(total_liabilities)})
-
-        # Equity Accounts
-        equity_types = ['owner_equity', 'retained_earnings']
-        equity = []
-        total_equity = Decimal('0.00')
+        sheet = ledger.balance_sheet(start_date, end_date)
 
-        equity.append({"name":"Equity","balance":None})
-        for equity_type in equity_types:
-            accounts = Account.objects.filter(account_type=equity_type, is_active=True)
-            for account in accounts:
-                balance = calculate_balance(account, non_asset=True)
-                equity.append({
-                    'name': account.name,
-                    'balance': float(balance)
-                })
-                total_equity += balance
-        equity.append({"name":"Total Equity","balance":float(total_equity)})
+        def section(title, rows, total):
+            data = [{"name": title, "balance": None}]
+            data.extend({'name': account.name, 'balance': float(balance)} for account, balance in rows)
+            data.append({"name": f"Total {title}", "balance": float(total)})
+            return data
 
-        final_data = assets + liabilities + equity
+        final_data = (
+            section("Assets", sheet['assets'], sheet['total_assets'])
+            + section("Liabilities", sheet['liabilities'], sheet['total_liabilities'])
+            + section("Equity", sheet['equity'], sheet['total_equity'])
+        )
         df = pd.DataFrame(final_data)
 
         response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
@@ -731,87 +681,9 @@ class ProfitLossComparisonView(APIView):
         start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
         end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
         
-        period_ranges = self.generate_periods(start_date, end_date, period_type)
-        
-        report = []
-        for period_start, period_end in period_ranges:
-            report.append(self.generate_detailed_pnl_statement(period_start, period_end))
+        report = ledger.pnl_comparison(start_date, end_date, period_type)
         
         return JsonResponse({'report': report})
-    
-    def generate_periods(self, start_date, end_date, period_type):
-        periods = []
-        current_start = start_date
-        
-        while current_start <= end_date:
-            if period_type == 'monthly':
-                next_start = current_start + relativedelta(months=1)
-            elif period_type == 'quarterly':
-                next_start = current_start + relativedelta(months=3)
-            elif period_type == 'yearly':
-                next_start = current_start + relativedelta(years=1)
-            else:
-                raise ValueError("Invalid period type")
-            
-            period_end = min(next_start - timedelta(days=1), end_date)
-            periods.append((current_start, period_end))
-            current_start = next_start
-        
-        return periods
-    
-    def generate_detailed_pnl_statement(self, start_date, end_date):
-        income_types = ['sales_income', 'service_income', 'other_income']
-        expense_types = ['cost_of_goods_sold', 'operating_expenses', 'payroll_expenses', 'marketing_expenses', 'administrative_expenses', 'other_expenses']
-        
-        total_income = Decimal('0.00')
-        total_expenses = Decimal('0.00')
-        income_details = []
-        expense_details = []
-        
-        # Calculate Income
-        for income_type in income_types:
-            accounts = Account.objects.filter(account_type=income_type, is_active=True)
-            for account in accounts:
-                income_amount = TransactionLine.objects.filter(
-                    account=account,
-                    transaction__transaction_type='income',
-                    transaction__date__gte=start_date,
-                    transaction__date__lte=end_date,
-                    is_active=True
-                ).aggregate(total=Sum('credit_amount'))['total'] or Decimal('0.00')
-                total_income += income_amount
-                income_details.append({
-                    'name': account.name,
-                    'code': account.code,
-                    'amount': float(income_amount)
-                })
-        
-        # Calculate Expenses
-        for expense_type in expense_types:
-            accounts = Account.objects.filter(account_type=expense_type, is_active=True)
-            for account in accounts:
-                expense_amount = TransactionLine.objects.filter(
-                    account=account,
-                    transaction__date__gte=start_date,
-                    transaction__date__lte=end_date,
-                    is_active=True
-                ).aggregate(total=Sum('debit_amount'))['total'] or Decimal('0.00')
-                total_expenses += expense_amount
-                expense_details.append({
-                    'name': account.name,
-                    'code': account.code,
-                    'amount': float(expense_amount)
-                })
-        
-        return {
-            'start_date': str(start_date),
-            'end_date': str(end_date),
-            'income': income_details,
-            'expenses': expense_details,
-            'total_income': float(total_income),
-            'total_expenses': float(total_expenses),
-            'net_profit': float(total_income - total_expenses)
-        }
 
 
 class ProfitLossComparisonAccrualView(APIView):
@@ -829,100 +701,9 @@ class ProfitLossComparisonAccrualView(APIView):
         start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
         end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
         
-        period_ranges = self.generate_periods(start_date, end_date, period_type)
-        
-        report = []
-        for period_start, period_end in period_ranges:
-            report.append(self.generate_detailed_pnl_statement(period_start, period_end, report_type))
+        report = ledger.pnl_comparison(start_date, end_date, period_type, report_type)
         
         return JsonResponse({'report': report})
-    
-    def generate_periods(self, start_date, end_date, period_type):
-        periods = []
-        current_start = start_date
-        
-        while current_start <= end_date:
-            if period_type == 'monthly':
-                next_start = current_start + relativedelta(months=1)
-            elif period_type == 'quarterly':
-                next_start = current_start + relativedelta(months=3)
-            elif period_type == 'yearly':
-                next_start = current_start + relativedelta(years=1)
-            else:
-                raise ValueError("Invalid period type")
-            
-            period_end = min(next_start - timedelta(days=1), end_date)
-            periods.append((current_start, period_end))
-            current_start = next_start
-        
-        return periods
-    
-    def generate_detailed_pnl_statement(self, start_date, end_date, report_type):
-        income_types = ['sales_income', 'service_income', 'other_income']
-        expense_types = ['cost_of_goods_sold', 'operating_expenses', 'payroll_expenses', 'marketing_expenses', 'administrative_expenses', 'other_expenses']
-        
-        total_income = Decimal('0.00')
-        total_expenses = Decimal('0.00')
-        income_details = []
-        expense_details = []
-        
-        # Calculate Income
-        for income_type in income_types:
-            accounts = Account.objects.filter(account_type=income_type, is_active=True)
-            for account in accounts:
-                income_query = TransactionLine.objects.filter(
-                    account=account,
-                    transaction__transaction_type='income',
-                    transaction__date__gte=start_date,
-                    transaction__date__lte=end_date,
-                    is_active=True
-                )
-                
-                if report_type == 'cash':
-                    income_query = income_query.filter(transaction__invoice_transactions__is_payment_transaction=True)
-                else:
-                    income_query = income_query.filter(transaction__invoice_transactions__is_payment_transaction=False)
-                
-                income_amount = income_query.aggregate(total=Sum('credit_amount'))['total'] or Decimal('0.00')
-                total_income += income_amount
-                income_details.append({
-                    'name': account.name,
-                    'code': account.code,
-                    'amount': float(income_amount)
-                })
-        
-        # Calculate Expenses
-        for expense_type in expense_types:
-            accounts = Account.objects.filter(account_type=expense_type, is_active=True)
-            for account in accounts:
-                expense_query = TransactionLine.objects.filter(
-                    account=account,
-                    transaction__date__gte=start_date,
-                    transaction__date__lte=end_date,
-                    is_active=True
-                )
-                
-                if report_type == 'cash':
-                    expense_query = expense_query.filter(account__account_type__in=['cash', 'bank'])
-                
-                expense_amount = expense_query.aggregate(total=Sum('debit_amount'))['total'] or Decimal('0.00')
-                total_expenses += expense_amount
-                expense_details.append({
-                    'name': account.name,
-                    'code': account.code,
-                    'amount': float(expense_amount)
-                })
-        
-        return {
-            'start_date': str(start_date),
-            'end_date': str(end_date),
-            'report_type': report_type,
-            'income': income_details,
-            'expenses': expense_details,
-            'total_income': float(total_income),
-            'total_expenses': float(total_expenses),
-            'net_profit': float(total_income - total_expenses)
-        }
 
 
 
@@ -1137,136 +918,24 @@ class ProfitLossComparisonXLSXView(APIView):
         start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
         end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
         
-        period_ranges = self.generate_periods(start_date, end_date, period_type)
-        
-        report = []
-        for period_start, period_end in period_ranges:
-            report.append(self.generate_detailed_pnl_statement(period_start, period_end))
-
-
-        df = self.convert_to_dataframe(report)
+        df = self.convert_to_dataframe(*ledger.pnl_by_period(start_date, end_date, period_type))
         
         # Export to Excel
         return self.export_to_excel(df)
     
-    def generate_periods(self, start_date, end_date, period_type):
-        periods = []
-        current_start = start_date
-        
-        while current_start <= end_date:
-            if period_type == 'monthly':
-                next_start = current_start + relativedelta(months=1)
-            elif period_type == 'quarterly':
-                next_start = current_start + relativedelta(months=3)
-            elif period_type == 'yearly':
-                next_start = current_start + relativedelta(years=1)
-            else:
-                raise ValueError("Invalid period type")
-            
-            period_end = min(next_start - timedelta(days=1), end_date)
-            periods.append((current_start, period_end))
-            current_start = next_start
-        
-        return periods
-    
-    def generate_detailed_pnl_statement(self, start_date, end_date):
-        income_types = ['sales_income', 'service_income', 'other_income']
-        expense_types = ['cost_of_goods_sold', 'operating_expenses', 'payroll_expenses', 'marketing_expenses', 'administrative_expenses', 'other_expenses']
-        
-        total_income = Decimal('0.00')
-        total_expenses = Decimal('0.00')
-        income_details = []
-        expense_details = []
-        
-        # Calculate Income
-        for income_type in income_types:
-            accounts = Account.objects.filter(account_type=income_type, is_active=True)
-            for account in accounts:
-                income_amount = TransactionLine.objects.filter(
-                    account=account,
-                    transaction__transaction_type='income',
-                    transaction__date__gte=start_date,
-                    transaction__date__lte=end_date,
-                    is_active=True
-                ).aggregate(total=Sum('credit_amount'))['total'] or Decimal('0.00')
-                total_income += income_amount
-                income_details.append({
-                    'name': account.name,
-                    'code': account.code,
-                    'amount': float(income_amount)
-                })
-        
-        # Calculate Expenses
-        for expense_type in expense_types:
-            accounts = Account.objects.filter(account_type=expense_type, is_active=True)
-            for account in accounts:
-                expense_amount = TransactionLine.objects.filter(
-                    account=account,
-                    transaction__date__gte=start_date,
-                    transaction__date__lte=end_date,
-                    is_active=True
-                ).aggregate(total=Sum('debit_amount'))['total'] or Decimal('0.00')
-                total_expenses += expense_amount
-                expense_details.append({
-                    'name': account.name,
-                    'code': account.code,
-                    'amount': float(expense_amount)
-                })
-        
-        return {
-            'start_date': str(start_date),
-            'end_date': str(end_date),
-            'income': income_details,
-            'expenses': expense_details,
-            'total_income': float(total_income),
-            'total_expenses': float(total_expenses),
-            'net_profit': float(total_income - total_expenses)
-        }
-    
-    def convert_to_dataframe(self, input_data):
-        # Initialize lists to store data
-        main_income_df = pd.DataFrame()
-        main_expenses_df = pd.DataFrame()
-
-        # Process each report entry
-        for entry in input_data:
-            income_data = []
-            expenses_data = []
-            period_label = f"{entry['start_date']} – {entry['end_date']}"
-
-            # Process income
-            for income in entry["income"]:
-                income_data.append({
-                    "Account": income["name"],
-                    "Type": "Income",
-                    period_label: income["amount"]
-                })
-
-            # Process expenses
-            for expense in entry["expenses"]:
-                expenses_data.append({
-                    "Account": expense["name"],
-                    "Type": "Expenses",
-                    period_label: expense["amount"]
-                })
+    def convert_to_dataframe(self, periods, accounts, amounts):
+        period_labels = [f"{period_start} – {period_end}" for period_start, period_end in periods]
 
-            income_df = pd.DataFrame(income_data)
-            expenses_df = pd.DataFrame(expenses_data)
-            if main_income_df.empty:
-                main_income_df = income_df
-            else:
-                main_income_df = pd.merge(main_income_df, income_df, on=["Account", "Type"], how="outer")
-            if main_expenses_df.empty:
-                main_expenses_df = expenses_df
+        rows = []
+        for account in accounts:
+            if account.account_type in ledger.INCOME_TYPES:
+                row_type, values = "Income", amounts.loc[account.id, 'income']
             else:
-                main_expenses_df = pd.merge(main_expenses_df, expenses_df, on=["Account", "Type"], how="outer")
-
-        # Combine income and expenses
-        combined_df = pd.concat([main_income_df, main_expenses_df])
+                row_type, values = "Expenses", amounts.loc[account.id, 'expense']
+            rows.append([account.name, row_type] + [float(value) for value in values])
+        combined_df = pd.DataFrame(rows, columns=["Account", "Type"] + period_labels)
 
-        # Fill missing values with 0
-        combined_df = combined_df.fillna(0)
-            # Calculate Net Profit
+        # Calculate Net Profit
         numeric_cols = combined_df.columns[2:]  # Skip 'Account' and 'Type'
         total_income = combined_df[combined_df["Type"] == "Income"][numeric_cols].sum()
         total_expenses = combined_df[combined_df["Type"] == "Expenses"][numeric_cols].sum()
@@ -1302,13 +971,9 @@ class AccountsReceivableAPIView(APIView):
 
 
             receivable_account = Account.objects.filter(account_type='accounts_receivable')
-            receivables = TransactionLine.objects.filter(
-                transaction__date__range=[start_date, end_date],
-                account__in=receivable_account,
-                is_active=True
-            ).aggregate(total_receivable=Sum('debit_amount') - Sum('credit_amount'))
+            receivables = snapshots.net_balances(start_date, end_date, accounts=receivable_account)
                 
-            return Response({"total_receivable": receivables['total_receivable'] or 0}, status=status.HTTP_200_OK)
+            return Response({"total_receivable": sum(receivables.values()) or 0}, status=status.HTTP_200_OK)
         except Exception as e:
             log.trace.trace(f"Error getting receivables {traceback.format_exc()}")
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -1325,13 +990,9 @@ class AccountsPayableAPIView(APIView):
 
 
             payable_account = Account.objects.filter(account_type='accounts_payable')
-            payables = TransactionLine.objects.filter(
-                transaction__date__range=[start_date, end_date],
-                account__in=payable_account,
-                is_active=True
-            ).aggregate(total_payable=Sum('credit_amount') - Sum('debit_amount'))
+            payables = snapshots.net_balances(start_date, end_date, accounts=payable_account)
 
-            return Response({"total_payable": payables['total_payable'] or 0}, status=status.HTTP_200_OK)
+            return Response({"total_payable": -sum(payables.values()) or 0}, status=status.HTTP_200_OK)
         except Exception as e:
             log.trace.trace(f"Error getting payables {traceback.format_exc()}")
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -1358,7 +1019,11 @@ class OwnerContributionAPI(APIView):
 
             with transaction.atomic():
                 # Create the transaction
-                transaction_entry = Transaction.objects.create(
+                transaction_entry = posting.post_transaction(
+                    [
+                        posting.Line(source_account, debit=amount, description=f"Debit {description}"),
+                        posting.Line(owner_equity_account, credit=amount, description=f"Credit {description}"),
+                    ],
                     reference_number=f"OC-{Transaction.objects.count() + 1}",
                     transaction_type='journal',
                     date=contribution_date,
@@ -1366,22 +1031,6 @@ class OwnerContributionAPI(APIView):
                     created_by=request.user,
                 )
 
-                # Create transaction lines
-                TransactionLine.objects.create(
-                    transaction=transaction_entry,
-                    account=source_account,
-                    debit_amount=amount,
-                    credit_amount=0,
-                    description=f"Debit {description}"
-                )
-                TransactionLine.objects.create(
-                    transaction=transaction_entry,
-                    account=owner_equity_account,
-                    debit_amount=0,
-                    credit_amount=amount,
-                    description=f"Credit {description}"
-                )
-
                 owner_entry = OwnerPaymentDetails.objects.create(
                     transaction=transaction_entry,
                     transaction_type='money_added',
@@ -1392,12 +1041,8 @@ class OwnerContributionAPI(APIView):
                     money_flag=1,
                     payment_date=contribution_date)
 
-                # Update account balances
-                source_account.balance += amount
-                source_account.save()
-
-                owner_equity_account.balance += amount
-                owner_equity_account.save()
+            source_account.refresh_from_db(fields=['balance'])
+            owner_equity_account.refresh_from_db(fields=['balance'])
 
             audit_log_entry = audit_log(user=request.user,
                               action="Owner Contribution recorded", 
@@ -1483,7 +1128,11 @@ class OwnerTakeOutMoneyAPI(APIView):
 
             with transaction.atomic():
                 # Create the transaction
-                transaction_entry = Transaction.objects.create(
+                transaction_entry = posting.post_transaction(
+                    [
+                        posting.Line(owner_equity_account, debit=amount, description=f"Debit {description}"),
+                        posting.Line(destination_account, credit=amount, description=f"Credit {description}"),
+                    ],
                     reference_number=f"OW-{Transaction.objects.count() + 1}",
                     transaction_type='journal',
                     date=withdrawal_date,
@@ -1491,22 +1140,6 @@ class OwnerTakeOutMoneyAPI(APIView):
                     created_by=request.user,
                 )
 
-                # Create transaction lines
-                TransactionLine.objects.create(
-                    transaction=transaction_entry,
-                    account=owner_equity_account,
-                    debit_amount=amount,
-                    credit_amount=0,
-                    description=f"Debit {description}"
-                )
-                TransactionLine.objects.create(
-                    transaction=transaction_entry,
-                    account=destination_account,
-                    debit_amount=0,
-                    credit_amount=amount,
-                    description=f"Credit {description}"
-                )
-
                 owner_entry = OwnerPaymentDetails.objects.create(
                     transaction=transaction_entry,
                     transaction_type='money_removed',
@@ -1517,12 +1150,8 @@ class OwnerTakeOutMoneyAPI(APIView):
                     money_flag=0,
                     payment_date=withdrawal_date)
 
-                # Update account balances
-                owner_equity_account.balance -= amount
-                owner_equity_account.save()
-
-                destination_account.balance -= amount
-                destination_account.save()
+            owner_equity_account.refresh_from_db(fields=['balance'])
+            destination_account.refresh_from_db(fields=['balance'])
 
             audit_log_entry = audit_log(user=request.user,
                               action="Owner Money Withdrawal recorded", 
@@ -1559,19 +1188,15 @@ class EditOwnerTransactionAPI(APIView):
 
             # Fetch the existing transaction
             transaction_entry = get_object_or_404(Transaction, id=owner_entry.transaction.id)
-            old_transaction_lines = TransactionLine.objects.filter(transaction=transaction_entry, is_active=True).all()
+            old_transaction_lines = TransactionLine.objects.filter(transaction=transaction_entry)
 
             # Fetch accounts
-            old_transaction_source_account = None
-            for transaction_line in old_transaction_lines:
-                if transaction_line.account.code != 'OWN-001':
-                    old_transaction_source_account = transaction_line.account
-                    break
-            # if old_transaction_source_account.code == source_account_code: 
             owner_equity_account = get_object_or_404(Account, code='OWN-001', is_active=True)
+            source_account = get_object_or_404(Account, code=source_account_code, is_active=True)
 
             with transaction.atomic():
-                # Set existing transaction lines to inactive
+                # Reverse the existing transaction lines and set them inactive
+                posting.reverse_lines(old_transaction_lines)
 
                 if owner_entry:
                         owner_entry.description = description
@@ -1586,69 +1211,20 @@ class EditOwnerTransactionAPI(APIView):
                 transaction_entry.description = description
                 transaction_entry.save()
 
-                for line in old_transaction_lines:
-                    if line.account == old_transaction_source_account:
-                        if owner_entry.transaction_type == "money_added":
-                            old_transaction_source_account.balance -= line.debit_amount
-                            old_transaction_source_account.save()
-                        if owner_entry.transaction_type == "money_removed":
-                            old_transaction_source_account.balance += line.debit_amount
-                            old_transaction_source_account.save()
-                    elif line.account == owner_equity_account:
-                        if owner_entry.transaction_type == "money_added":
-                            owner_equity_account.balance -= line.credit_amount
-                        if owner_entry.transaction_type == "money_removed":
-                            owner_equity_account.balance += line.credit_amount
-                        
-
-                old_transaction_lines.update(is_active=False)
                 # Create new transaction lines
-                source_account = get_object_or_404(Account, code=source_account_code, is_active=True)
                 if owner_entry.transaction_type == "money_added":
-                    TransactionLine.objects.create(
-                        transaction=transaction_entry,
-                        account=source_account,
-                        debit_amount=amount,
-                        credit_amount=0,
-                        description=f"Debit {description}"
-                    )
-                    TransactionLine.objects.create(
-                        transaction=transaction_entry,
-                        account=owner_equity_account,
-                        debit_amount=0,
-                        credit_amount=amount,
-                        description=f"Credit {description}"
-                    )
+                    posting.post_lines(transaction_entry, [
+                        posting.Line(source_account, debit=amount, description=f"Debit {description}"),
+                        posting.Line(owner_equity_account, credit=amount, description=f"Credit {description}"),
+                    ])
                 elif owner_entry.transaction_type == "money_removed":
-                    TransactionLine.objects.create(
-                        transaction=transaction_entry,
-                        account=source_account,
-                        debit_amount=0,
-                        credit_amount=amount,
-                        description=f"Credit {description}"
-                    )
-                    TransactionLine.objects.create(
-                        transaction=transaction_entry,
-                        account=owner_equity_account,
-                        debit_amount=amount,
-                        credit_amount=0,
-                        description=f"Debit {description}"
-                    )
-                # Update OwnerPaymentDetails if necessary
-
-                # Update account balances
-                # Subtract the old amounts from the account balances
-
-                # Add the new amounts to the account balances
-                if owner_entry.transaction_type == "money_added":
-                    source_account.balance += amount
-                    owner_equity_account.balance += amount
-                if owner_entry.transaction_type == "money_removed":
-                    source_account.balance -= amount
-                    owner_equity_account.balance -= amount
+                    posting.post_lines(transaction_entry, [
+                        posting.Line(source_account, credit=amount, description=f"Credit {description}"),
+                        posting.Line(owner_equity_account, debit=amount, description=f"Debit {description}"),
+                    ])
 
-                source_account.save()
-                owner_equity_account.save()
+            source_account.refresh_from_db(fields=['balance'])
+            owner_equity_account.refresh_from_db(fields=['balance'])
 
             audit_log_entry = audit_log(user=request.user,
                               action="Transaction updated", 
@@ -1672,35 +1248,11 @@ class DeleteOwnerTransactionAPI(APIView):
         try:
             owner_entry = get_object_or_404(OwnerPaymentDetails, id=id)
             transaction_entry = get_object_or_404(Transaction, id=owner_entry.transaction.id)
-            transaction_lines = TransactionLine.objects.filter(transaction=transaction_entry, is_active=True)
-
-            owner_equity_account = get_object_or_404(Account, code='OWN-001', is_active=True)
-            source_account = None
-
-            for line in transaction_lines:
-                if line.account.code != 'OWN-001':
-                    source_account = line.account
-                    break
+            transaction_lines = TransactionLine.objects.filter(transaction=transaction_entry)
 
             with transaction.atomic():
-                # Reverse balances before deletion
-                for line in transaction_lines:
-                    if line.account == source_account:
-                        if owner_entry.transaction_type == "money_added":
-                            source_account.balance -= line.debit_amount
-                        if owner_entry.transaction_type == "money_removed":
-                            source_account.balance += line.credit_amount
-                    elif line.account == owner_equity_account:
-                        if owner_entry.transaction_type == "money_added":
-                            owner_equity_account.balance -= line.credit_amount
-                        if owner_entry.transaction_type == "money_removed":
-                            owner_equity_account.balance += line.debit_amount
-                
-                source_account.save()
-                owner_equity_account.save()
-
-                # Set transaction lines to inactive
-                transaction_lines.update(is_active=False)
+                # Reverse balances and set transaction lines to inactive before deletion
+                posting.reverse_lines(transaction_lines)
 
                 # Delete owner entry and transaction
                 owner_entry.delete()
@@ -1721,6 +1273,99 @@ class DeleteOwnerTransactionAPI(APIView):
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class JournalImportView(APIView):
+    """
+    Import journal entries from a CSV or XLSX upload. One row per ledger line
+    with columns entry, date, account_code, debit, credit and optionally
+    description, memo, transaction_type. Rows sharing an entry value form one
+    balanced transaction; invalid rows and entries are reported and skipped.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        file = request.FILES.get('file')
+        if not file:
+            return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            summary = journal_import.import_journal(file, request.user)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            log.trace.trace(f"Error importing journal entries {traceback.format_exc()}")
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        audit_log(
+            user=request.user,
+            action="Journal import",
+            ip_add=request.META.get('HTTP_X_FORWARDED_FOR'),
+            model_name="Transaction",
+            record_id=0,
+            additional_details=f"{summary['imported_entries']} entries imported from {file.name}"[:200],
+        )
+        log.app.info(f"Journal import: {summary['imported_entries']} entries, {summary['imported_lines']} lines, {len(summary['errors'])} errors")
+        if not summary['imported_entries'] and summary['errors']:
+            return Response({'message': 'No entries imported', **summary}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'message': 'Journal import completed', **summary}, status=status.HTTP_201_CREATED)
+
+
+class LedgerIntegrityView(APIView):
+    """
+    GET returns the last integrity check; POST runs one. POST accepts
+    `full` (scan everything instead of changes since the last run) and
+    `repair` (reset drifted account balances). Administrators only.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def check_admin(self, request):
+        if request.user.user_type != 'admin':
+            return Response({"error": "Only administrators can verify the ledger."}, status=status.HTTP_403_FORBIDDEN)
+        return None
+
+    def get(self, request):
+        denied = self.check_admin(request)
+        if denied:
+            return denied
+        checkpoint = LedgerCheckpoint.objects.filter(name=integrity.CHECKPOINT_NAME).first()
+        if not checkpoint:
+            return Response({"message": "The ledger has not been verified yet."}, status=status.HTTP_200_OK)
+        return Response({
+            "checked_through": checkpoint.checked_through,
+            "unbalanced_transactions": checkpoint.unbalanced_transactions,
+            "drifted_accounts": checkpoint.drifted_accounts,
+            "repaired_accounts": checkpoint.repaired_accounts,
+            "ran_at": checkpoint.updated_at,
+        }, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        denied = self.check_admin(request)
+        if denied:
+            return denied
+        try:
+            full = str(request.data.get('full', False)).lower() in ('true', '1')
+            repair = str(request.data.get('repair', False)).lower() in ('true', '1')
+            report = integrity.verify(full=full, repair=repair)
+
+            if repair:
+                audit_log(
+                    user=request.user,
+                    action="Ledger balances repaired",
+                    ip_add=request.META.get('HTTP_X_FORWARDED_FOR'),
+                    model_name="Account",
+                    record_id=0,
+                    additional_details=f"{report['repaired_accounts']} accounts repaired",
+                )
+            log.app.info(
+                f"Ledger {report['mode']} check: {len(report['unbalanced_transactions'])} unbalanced transactions, "
+                f"{len(report['drifted_accounts'])} drifted accounts, {report['repaired_accounts']} repaired"
+            )
+            return Response(report, status=status.HTTP_200_OK)
+        except Exception as e:
+            log.trace.trace(f"Error verifying ledger {traceback.format_exc()}")
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 class CustomPagination(PageNumberPagination):
     page_size = 10  # Default page size
     page_size_query_param = 'page_size'  # Allow client to override the page size
@@ -1859,6 +1504,76 @@ class BankAccountTransactionsAPIView(APIView):
         }, status=status.HTTP_200_OK)
 
 
+class BankRegisterView(APIView):
+    """
+    Register of one bank/cash account with a running balance per line.
+
+    Pages by cursor instead of page number: pass the `next_cursor` of a
+    response as `cursor` to get the following rows, so deep pages cost the
+    same as the first one.
+    """
+    permission_classes = [IsAuthenticated]
+    default_page_size = 50
+    max_page_size = 500
+
+    @staticmethod
+    def encode_cursor(line):
+        key = f"{line.transaction.date.isoformat()}|{line.id}"
+        return base64.urlsafe_b64encode(key.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        day, line_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.strptime(day, "%Y-%m-%d").date(), int(line_id)
+
+    def get(self, request):
+        account_id = request.GET.get('account_id')
+        if not account_id:
+            return Response(
+                {"error": "account_id is required as a query parameter."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        account = get_object_or_404(Account, id=account_id)
+        try:
+            start_date = request.GET.get('start_date')
+            end_date = request.GET.get('end_date')
+            try:
+                page_size = min(int(request.GET.get('page_size', self.default_page_size)), self.max_page_size)
+                after = self.decode_cursor(request.GET['cursor']) if request.GET.get('cursor') else None
+                start_date = datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None
+                end_date = datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None
+            except ValueError:
+                return Response({"error": "Invalid cursor, page_size or date."}, status=status.HTTP_400_BAD_REQUEST)
+            if page_size < 1:
+                return Response({"error": "page_size must be positive."}, status=status.HTTP_400_BAD_REQUEST)
+
+            lines, has_more = ledger.register_page(account, after, start_date, end_date, page_size)
+            data = [{
+                "id": line.id,
+                "transaction_id": line.transaction_id,
+                "reference_number": line.transaction.reference_number,
+                "transaction_type": line.transaction.transaction_type,
+                "date": line.transaction.date,
+                "description": line.transaction.description,
+                "line_description": line.description,
+                "debit_amount": str(line.debit_amount),
+                "credit_amount": str(line.credit_amount),
+                "invoice_id": line.invoice_id,
+                "bill_id": line.bill_id,
+                "running_balance": str(line.running_balance),
+            } for line in lines]
+
+            return Response({
+                "account": {"id": account.id, "name": account.name, "code": account.code},
+                "page_size": page_size,
+                "next_cursor": self.encode_cursor(lines[-1]) if has_more else None,
+                "data": data,
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            log.trace.trace(f"Error fetching bank register {traceback.format_exc()}")
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 class BankAccountTransactionsExportAPIView(APIView):
     def get(self, request, *args, **kwargs):
         # Get the account_id from query parameters
@@ -1871,72 +1586,41 @@ class BankAccountTransactionsExportAPIView(APIView):
                 {"error": "account_id is required as a query parameter."},
                 status=status.HTTP_400_BAD_REQUEST
             )
-            
-        # Fetch transactions that have at least one TransactionLine linked to the specified account
-        transactions = Transaction.objects.filter(lines__account_id=account_id, is_active=True).distinct()
-        
-        if start_date and end_date:
-            transactions = transactions.filter(date__range=[start_date, end_date])
-        
-        # Prepare data for pandas DataFrame
-        data = []
-        for transaction in transactions:
-            # Fetch transaction lines for the current transaction and the specified account
-            transaction_lines = TransactionLine.objects.filter(transaction=transaction, account_id=account_id, is_active=True)
-            
-            for line in transaction_lines:
-                data.append({
-                    'Transaction ID': transaction.id,
-                    'Reference Number': transaction.reference_number,
-                    'Transaction Type': transaction.transaction_type,
-                    'Date': transaction.date,
-                    'Description': transaction.description,
-                    'Line ID': line.id,
-                    'Account': line.account.id,
-                    'Line Description': line.description,
-                    'Debit Amount': float(line.debit_amount) if line.debit_amount else 0,
-                    'Credit Amount': float(line.credit_amount) if line.credit_amount else 0,
-                })
-        
-        # Create DataFrame from data
-        df = pd.DataFrame(data)
-        
-        # Generate Excel file
-        output = BytesIO()
-        
-        # Create a Pandas Excel writer using BytesIO as the target
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, sheet_name='Transactions', index=False)
-            
-            # Get the xlsxwriter workbook and worksheet objects
-            workbook = writer.book
-            worksheet = writer.sheets['Transactions']
-            
-            # Add some formatting
-            header_format = workbook.add_format({'bold': True, 'bg_color': '#D9E1F2', 'border': 1})
-            
-            # Write the column headers with the defined format
-            for col_num, value in enumerate(df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-                
-            # Adjust column widths
-            for i, col in enumerate(df.columns):
-                # Set column width based on max length in column
-                max_len = max(df[col].astype(str).apply(len).max(), len(str(col))) + 2
-                worksheet.set_column(i, i, max_len)
-        
+
+        # Rows are streamed from the database into a constant-memory workbook on disk
+        rows = exports.account_line_rows(account_id, start_date, end_date)
+        output = exports.write_xlsx(rows)
+
+        return FileResponse(
+            output,
+            as_attachment=True,
+            filename=self.export_filename(account_id, start_date, end_date, 'xlsx'),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+
+    @staticmethod
+    def export_filename(account_id, start_date, end_date, extension):
         # Generate filename with account_id and date range
         filename = f"transactions_account_{account_id}"
         if start_date and end_date:
             filename += f"_{start_date}_to_{end_date}"
-        filename += ".xlsx"
-        
-        # Set up the response with appropriate headers
-        output.seek(0)
-        response = HttpResponse(
-            output.getvalue(),
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        return f"{filename}.{extension}"
+
+
+class BankAccountTransactionsCSVExportAPIView(APIView):
+    def get(self, request, *args, **kwargs):
+        account_id = request.GET.get('account_id', None)
+        start_date = request.GET.get('start_date')
+        end_date = request.GET.get('end_date')
+
+        if not account_id:
+            return Response(
+                {"error": "account_id is required as a query parameter."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        rows = exports.account_line_rows(account_id, start_date, end_date)
+        filename = BankAccountTransactionsExportAPIView.export_filename(account_id, start_date, end_date, 'csv')
+        response = StreamingHttpResponse(exports.csv_lines(rows), content_type='text/csv')
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        
-        return response
\ No newline at end of file
+        return response
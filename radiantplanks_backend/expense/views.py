@@ -22,6 +22,7 @@ from customers.models import Customer, Vendor
 from django.utils import timezone
 from django.core.mail import EmailMessage
 from accounts.models import Account, Transaction, TransactionLine, ReceivableTracking, VendorPaymentDetails
+from accounts import posting
 from django.template.loader import render_to_string
 import math
 import uuid
@@ -111,7 +112,29 @@ class CreateExpenseView(APIView):
                 )
 
 
-                transaction = Transaction.objects.create(
+                # Credit the paying account for the total
+                lines = [posting.Line(expense_account, credit=total_amount,
+                                      description=f"Payment to vendor: {vendor.business_name}")]
+
+                # Process each item in the invoice
+                for item_data in items:
+                    account = Account.objects.get(id=item_data['account_id'])
+                    description = item_data.get("description","")  # Can be 'tile', 'box', or 'pallet'
+                    price = float(item_data['price'])
+                
+
+                    # Create invoice item
+                    ExpenseItems.objects.create(
+                        expense=expense,
+                        account=account,
+                        price=price,  # Store as selected unit (pallets, boxes, sqf, etc.)
+                        description=description,
+                        created_by=user
+                    )
+                    lines.append(posting.Line(account, debit=price, description=description))
+
+                transaction = posting.post_transaction(
+                    lines,
                     reference_number=expense_number,
                     transaction_type="expense",
                     date=payment_date,
@@ -122,18 +145,6 @@ class CreateExpenseView(APIView):
                     created_by=request.user
                 )
 
-                # Create a TransactionLine for the expense account
-                TransactionLine.objects.create(
-                    transaction=transaction,
-                    account=expense_account,
-                    description=f"Payment to vendor: {vendor.business_name}",
-                    debit_amount=0,
-                    credit_amount=total_amount
-                )
-                expense_account.balance -= Decimal(total_amount)
-                expense_account.save()
-                # Process each item in the invoice
-
                 VendorPaymentDetails.objects.create(
                     vendor=vendor,
                     transaction=transaction,
@@ -144,31 +155,6 @@ class CreateExpenseView(APIView):
                     payment_amount=total_amount,
                 )
 
-                for item_data in items:
-                    account = Account.objects.get(id=item_data['account_id'])
-                    description = item_data.get("description","")  # Can be 'tile', 'box', or 'pallet'
-                    price = float(item_data['price'])
-                
-
-                    # Create invoice item
-                    ExpenseItems.objects.create(
-                        expense=expense,
-                        account=account,
-                        price=price,  # Store as selected unit (pallets, boxes, sqf, etc.)
-                        description=description,
-                        created_by=user
-                    )
-                    
-                    TransactionLine.objects.create(
-                        transaction=transaction,
-                        account=account,
-                        description=description,
-                        debit_amount=price,
-                        credit_amount=0
-                    )
-                    account.balance += Decimal(price)
-                    account.save()
-
                 expense.save()
             audit_log_entry = audit_log(user=request.user,
                               action="Expense Created", 
@@ -340,25 +326,16 @@ class EditExpenseView(APIView):
                 # Step 1: Capture original data
                 original_total = expense.total_amount
                 original_expense_account = expense.expense_account
-                original_items = list(ExpenseItems.objects.filter(expense=expense))
-
-                # Step 2: Reverse original accounting entries
-                # Revert expense account
-                original_expense_account.balance += original_total
-                original_expense_account.save()
-
-                # Revert item accounts
-                for item in original_items:
-                    item.account.balance -= Decimal(item.price)
-                    item.account.save()
 
-                # Step 3: Delete existing transaction lines and items
+                # Step 2: Reverse original accounting entries, then delete the lines and items
                 try:
                     transaction_obj = Transaction.objects.get(reference_number=expense.expense_number, transaction_type="expense")
                 except Transaction.DoesNotExist:
                     return Response({"detail": "Associated transaction not found."}, status=status.HTTP_404_NOT_FOUND)
                 
-                TransactionLine.objects.filter(transaction=transaction_obj).delete()
+                original_lines = TransactionLine.objects.filter(transaction=transaction_obj)
+                posting.reverse_lines(original_lines)
+                original_lines.delete()
                 ExpenseItems.objects.filter(expense=expense).delete()
 
                 # Step 4: Update Expense fields
@@ -420,15 +397,8 @@ class EditExpenseView(APIView):
                 vendor_payment.save()
 
                 # Step 7: Create new expense account transaction line
-                TransactionLine.objects.create(
-                    transaction=transaction_obj,
-                    account=new_expense_account,
-                    description=f"Payment to vendor: {vendor.business_name}",
-                    debit_amount=0,
-                    credit_amount=new_total_amount
-                )
-                new_expense_account.balance -= new_total_amount
-                new_expense_account.save()
+                lines = [posting.Line(new_expense_account, credit=new_total_amount,
+                                      description=f"Payment to vendor: {vendor.business_name}")]
 
                 # Step 8: Process new items
                 for item_data in items:
@@ -445,16 +415,9 @@ class EditExpenseView(APIView):
                         created_by=user
                     )
 
-                    # Create TransactionLine
-                    TransactionLine.objects.create(
-                        transaction=transaction_obj,
-                        account=account,
-                        description=description,
-                        debit_amount=price,
-                        credit_amount=0
-                    )
-                    account.balance += price
-                    account.save()
+                    lines.append(posting.Line(account, debit=price, description=description))
+
+                posting.post_lines(transaction_obj, lines)
 
                 # Audit log
                 audit_log(
@@ -517,9 +480,14 @@ class DuplicateExpenseView(APIView):
                     is_active=True
                 )
 
-                # Step 2: Duplicate the Transaction
+                # Step 2: Duplicate the Transaction with a copy of its active lines
                 original_transaction = Transaction.objects.get(reference_number=original_expense.expense_number, transaction_type="expense")
-                new_transaction = Transaction.objects.create(
+                new_transaction = posting.post_transaction(
+                    [
+                        posting.Line(line.account, debit=line.debit_amount, credit=line.credit_amount,
+                                     description=line.description)
+                        for line in TransactionLine.objects.filter(transaction=original_transaction, is_active=True)
+                    ],
                     reference_number=new_expense.expense_number,
                     transaction_type="expense",
                     date=new_expense.payment_date,
@@ -530,21 +498,7 @@ class DuplicateExpenseView(APIView):
                     created_by=user
                 )
 
-                # Step 3: Duplicate TransactionLine for the Expense Account
-                original_expense_line = TransactionLine.objects.filter(transaction=original_transaction, account=original_expense.expense_account).first()
-                if original_expense_line:
-                    TransactionLine.objects.create(
-                        transaction=new_transaction,
-                        account=original_expense.expense_account,
-                        description=original_expense_line.description,
-                        debit_amount=original_expense_line.debit_amount,
-                        credit_amount=original_expense_line.credit_amount
-                    )
-                    # Adjust the expense account balance
-                    original_expense.expense_account.balance -= original_expense.total_amount
-                    original_expense.expense_account.save()
-
-                # Step 4: Duplicate VendorPaymentDetails
+                # Step 3: Duplicate VendorPaymentDetails
                 original_vendor_payment = VendorPaymentDetails.objects.filter(transaction=original_transaction).first()
                 if original_vendor_payment:
                     VendorPaymentDetails.objects.create(
@@ -558,10 +512,9 @@ class DuplicateExpenseView(APIView):
                         payment_amount=new_expense.total_amount
                     )
 
-                # Step 5: Duplicate ExpenseItems and TransactionLines for Items
+                # Step 4: Duplicate ExpenseItems
                 original_items = ExpenseItems.objects.filter(expense=original_expense)
                 for original_item in original_items:
-                    # Duplicate ExpenseItem
                     new_item = ExpenseItems.objects.create(
                         expense=new_expense,
                         account=original_item.account,
@@ -570,21 +523,7 @@ class DuplicateExpenseView(APIView):
                         created_by=user
                     )
 
-                    # Duplicate TransactionLine for the item
-                    original_item_line = TransactionLine.objects.filter(transaction=original_transaction, account=original_item.account).first()
-                    if original_item_line:
-                        TransactionLine.objects.create(
-                            transaction=new_transaction,
-                            account=original_item.account,
-                            description=original_item_line.description,
-                            debit_amount=original_item_line.debit_amount,
-                            credit_amount=original_item_line.credit_amount
-                        )
-                        # Adjust the item account balance
-                        original_item.account.balance += original_item.price
-                        original_item.account.save()
-
-                # Step 6: Duplicate Attachments (if applicable)
+                # Step 5: Duplicate Attachments (if applicable)
                 if original_expense.attachments:
                     # Copy the file to a new location
                     old_path = os.path.join(settings.MEDIA_ROOT, original_expense.attachments)
@@ -596,7 +535,7 @@ class DuplicateExpenseView(APIView):
                         new_expense.attachments = posixpath.join('media/expense_attachments', new_filename)
                         new_expense.save()
 
-                # Step 7: Audit Log
+                # Step 6: Audit Log
                 audit_log(
                     user=user,
                     action="Expense Duplicated",
@@ -675,8 +614,29 @@ class UploadExpenseCSVView(APIView):
                         created_by=user
                     )
                     
+                    # Create TransactionLine for Expense Account
+                    lines = [posting.Line(expense_account, credit=total_amount,
+                                          description=f"Payment to vendor: {vendor.business_name}")]
+
+                    # Create ExpenseItems and TransactionLines for Items
+                    for row in rows:
+                        item_account_id = row['item_account_id']
+                        item_price = Decimal(row['item_price'])
+                        item_description = row.get('item_description', '')
+                        
+                        account = Account.objects.get(id=item_account_id)
+                        ExpenseItems.objects.create(
+                            expense=expense,
+                            account=account,
+                            price=item_price,
+                            description=item_description,
+                            created_by=user
+                        )
+                        lines.append(posting.Line(account, debit=item_price, description=item_description))
+
                     # Create Transaction
-                    transaction_obj = Transaction.objects.create(
+                    transaction_obj = posting.post_transaction(
+                        lines,
                         reference_number=expense_number,
                         transaction_type="expense",
                         date=payment_date,
@@ -686,17 +646,6 @@ class UploadExpenseCSVView(APIView):
                         created_by=user
                     )
                     
-                    # Create TransactionLine for Expense Account
-                    TransactionLine.objects.create(
-                        transaction=transaction_obj,
-                        account=expense_account,
-                        description=f"Payment to vendor: {vendor.business_name}",
-                        debit_amount=0,
-                        credit_amount=total_amount
-                    )
-                    expense_account.balance -= total_amount
-                    expense_account.save()
-                    
                     # Create VendorPaymentDetails
                     VendorPaymentDetails.objects.create(
                         vendor=vendor,
@@ -708,30 +657,6 @@ class UploadExpenseCSVView(APIView):
                         payment_date=payment_date,
                         payment_amount=total_amount
                     )
-                    
-                    # Create ExpenseItems and TransactionLines for Items
-                    for row in rows:
-                        item_account_id = row['item_account_id']
-                        item_price = Decimal(row['item_price'])
-                        item_description = row.get('item_description', '')
-                        
-                        account = Account.objects.get(id=item_account_id)
-                        ExpenseItems.objects.create(
-                            expense=expense,
-                            account=account,
-                            price=item_price,
-                            description=item_description,
-                            created_by=user
-                        )
-                        TransactionLine.objects.create(
-                            transaction=transaction_obj,
-                            account=account,
-                            description=item_description,
-                            debit_amount=item_price,
-                            credit_amount=0
-                        )
-                        account.balance += item_price
-                        account.save()
                 
                 return Response({"message": "Expenses uploaded successfully."}, status=status.HTTP_201_CREATED)
         
@@ -756,22 +681,11 @@ class DeleteExpenseView(APIView):
                 transaction_obj = Transaction.objects.get(reference_number=expense.expense_number, transaction_type="expense")
                 
                 # Reverse accounting entries
-                # Revert expense account balance
-                expense.expense_account.balance += expense.total_amount
-                expense.expense_account.save()
-                
-                # Revert item account balances
-                expense_items = ExpenseItems.objects.filter(expense=expense)
-                for item in expense_items:
-                    item.account.balance -= item.price
-                    item.account.save()
+                posting.reverse_transaction(transaction_obj)
                 
                 # Delete associated records
                 VendorPaymentDetails.objects.filter(transaction=transaction_obj).delete()
-                TransactionLine.objects.filter(transaction=transaction_obj).update(is_active=False)
                 ExpenseItems.objects.filter(expense=expense).update(is_active=False)
-                transaction_obj.is_active = False
-                transaction_obj.save()
                 expense.is_active = False
                 expense.save()
                 return Response({"message": "Expense and associated records deleted successfully."}, status=status.HTTP_200_OK)
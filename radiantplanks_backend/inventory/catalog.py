@@ -0,0 +1,87 @@
+"""
+Product catalog listings.
+
+Catalog rows are read with one values() query joined to the category, and
+only the requested fields are selected. Derived columns such as the price
+per square foot are computed in SQL.
+
+The catalog validator combines the latest product and category
+updated_date with the product count. Stock and cost changes made with
+queryset updates (inventory.stock, inventory.costing) set updated_date as
+well, so a client that still holds the current validator can be answered
+with 304 Not Modified after a single aggregate query.
+"""
+import hashlib
+from django.db.models import F, Q, Case, When, Max, Count, ExpressionWrapper, DecimalField
+from django.db.models.functions import Round
+from .models import Product, Category
+
+
+# output name -> source column of the catalog rows
+PRODUCT_FIELDS = {
+    'id': 'id',
+    'product_image': 'images',
+    'product_type': 'product_type',
+    'product_name': 'product_name',
+    'product_description': 'purchase_description',
+    'category': 'category_id__name',
+    'sku': 'sku',
+    'product_barcode': 'barcode',
+    'product_length': 'tile_length',
+    'product_area': 'tile_area',
+    'product_width': 'tile_width',
+    'stock_quantity': 'stock_quantity',
+}
+
+STOCK_FIELDS = {
+    **PRODUCT_FIELDS,
+    'product_price': 'purchase_price',
+    'product_price_per_sqf': 'price_per_sqf',
+}
+
+ANNOTATIONS = {
+    'price_per_sqf': Case(
+        When(Q(tile_area__gt=0), then=Round(ExpressionWrapper(
+            F('purchase_price') / F('tile_area'), output_field=DecimalField(max_digits=12, decimal_places=2),
+        ), 2)),
+        default=None,
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    ),
+}
+
+
+def parse_fields(value, available):
+    """Output names listed in a comma separated `fields` value (all when empty); ValueError on unknown names."""
+    if not value:
+        return list(available)
+    names = list(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(available)}.")
+    # the id is the pagination key and is always returned
+    return ['id'] + [name for name in names if name != 'id']
+
+
+def rows(products, names, available):
+    """values() queryset of `products` selecting the source columns of the named fields."""
+    columns = [available[name] for name in names]
+    annotations = {column: ANNOTATIONS[column] for column in columns if column in ANNOTATIONS}
+    return products.annotate(**annotations).values(*columns)
+
+
+def present(row, names, available):
+    """One catalog row, keyed by output name."""
+    return {name: row[available[name]] for name in names}
+
+
+def validator():
+    """(etag seed, last modified datetime or None) describing the current state of the catalog."""
+    products = Product.objects.aggregate(updated=Max('updated_date'), count=Count('id'))
+    category_updated = Category.objects.aggregate(updated=Max('updated_date'))['updated']
+    last_modified = max(filter(None, [products['updated'], category_updated]), default=None)
+    seed = f"{products['updated']}|{products['count']}|{category_updated}"
+    return seed, last_modified
+
+
+def etag(seed, *parts):
+    return hashlib.md5('|'.join([seed, *map(str, parts)]).encode()).hexdigest()
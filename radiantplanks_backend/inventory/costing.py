@@ -0,0 +1,228 @@
+"""
+Inventory cost layers.
+
+Every receipt of stock (bill line, opening stock, upward adjustment) becomes
+a CostLayer at its unit cost. Stock that leaves through an invoice or a loss
+consumes the product's open layers oldest first, and each CostConsumption
+row records the layer, the quantity and the unit cost charged. The charge is
+the layer's own cost under FIFO, or the average cost of all open layers
+under the moving-average method (settings.INVENTORY_COSTING_METHOD). When a
+document gives stock back, its latest consumptions are released into the
+layers they came from.
+
+Consumption reads only the layers it touches. A window Sum over the open
+layers of each product gives the quantity ahead of every layer, and layers
+already fully covered by earlier ones are filtered out in SQL. Posting cost
+therefore grows with the number of invoice lines, not with the number of
+open layers. Product.purchase_price is kept at the average cost of the open
+layers by revalue(), which recomputes any set of products with one grouped
+query.
+
+Callers hold the product row locks (inventory.stock.adjust), so two
+documents never consume the same layer at once.
+"""
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import F, Sum, Case, When, Value, Window, IntegerField, DecimalField, ExpressionWrapper
+from django.utils import timezone
+from .models import Product, CostLayer, CostConsumption
+
+
+FIFO = 'fifo'
+AVERAGE = 'average'
+
+_value = ExpressionWrapper(F('remaining_quantity') * F('unit_cost'), output_field=DecimalField(max_digits=15, decimal_places=2))
+
+
+def costing_method():
+    return getattr(settings, 'INVENTORY_COSTING_METHOD', FIFO) or FIFO
+
+
+def _unit_cost(value):
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def _layer(product, quantity, unit_cost, source_type, source_id, date):
+    from .stock import movement_date
+    return CostLayer(
+        product_id=getattr(product, 'pk', product),
+        source_type=source_type,
+        source_id=source_id,
+        received_date=movement_date(date),
+        quantity=quantity,
+        remaining_quantity=quantity,
+        unit_cost=_unit_cost(unit_cost),
+    )
+
+
+def receive(product, quantity, unit_cost, source_type, source_id=None, date=None):
+    """Add a cost layer for `quantity` units received at `unit_cost`. Returns the layer or None."""
+    quantity = int(quantity)
+    if quantity <= 0:
+        return None
+    layer = _layer(product, quantity, unit_cost, source_type, source_id, date)
+    layer.save()
+    return layer
+
+
+def receive_many(receipts, source_type):
+    """
+    Add the layers of many receipts with one bulk insert. `receipts` holds
+    (product, quantity, unit_cost, source_id, date) tuples; non-positive
+    quantities are skipped. Returns the created layers.
+    """
+    layers = [
+        _layer(product, int(quantity), unit_cost, source_type, source_id, date)
+        for product, quantity, unit_cost, source_id, date in receipts
+        if int(quantity) > 0
+    ]
+    return CostLayer.objects.bulk_create(layers, batch_size=1000)
+
+
+def _average_costs(layers):
+    """{product_id: average unit cost} of a CostLayer queryset, in one grouped query."""
+    rows = layers.values('product_id').annotate(value=Sum(_value), on_hand=Sum('remaining_quantity')).order_by()
+    return {row['product_id']: _unit_cost(Decimal(row['value']) / row['on_hand']) for row in rows if row['on_hand']}
+
+
+def average_costs(product_ids):
+    """{product_id: average unit cost of its open layers}."""
+    return _average_costs(CostLayer.objects.filter(product_id__in=product_ids, remaining_quantity__gt=0))
+
+
+def _touched_layers(quantities):
+    """Open layers needed to cover {product_id: quantity}, oldest first, with the quantity ahead of each."""
+    needed = Case(
+        *[When(product_id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        default=Value(0), output_field=IntegerField(),
+    )
+    ahead = Window(
+        Sum('remaining_quantity'),
+        partition_by=[F('product_id')],
+        order_by=[F('received_date').asc(), F('id').asc()],
+    ) - F('remaining_quantity')
+    return CostLayer.objects.filter(product_id__in=quantities, remaining_quantity__gt=0).annotate(
+        needed=needed, ahead=ahead,
+    ).filter(ahead__lt=F('needed')).order_by('product_id', 'received_date', 'id')
+
+
+def consume(quantities, source_type, source_id=None, date=None):
+    """
+    Take {product_id: quantity} out of the open layers for a document. Stock
+    not covered by any layer (e.g. entered before cost layers existed) is
+    first given a layer at the product's purchase_price.
+    """
+    quantities = {product_id: int(quantity) for product_id, quantity in quantities.items() if int(quantity) > 0}
+    if not quantities:
+        return
+    with db_transaction.atomic():
+        averages = average_costs(list(quantities)) if costing_method() == AVERAGE else {}
+        remaining = dict(quantities)
+        layers, consumptions = [], []
+        for layer in _touched_layers(quantities):
+            take = min(layer.remaining_quantity, remaining[layer.product_id])
+            if take <= 0:
+                continue
+            layer.remaining_quantity -= take
+            remaining[layer.product_id] -= take
+            layers.append(layer)
+            consumptions.append(CostConsumption(
+                layer=layer, product_id=layer.product_id, source_type=source_type, source_id=source_id,
+                quantity=take, unit_cost=averages.get(layer.product_id, layer.unit_cost),
+            ))
+        CostLayer.objects.bulk_update(layers, ['remaining_quantity'])
+
+        uncovered = {product_id: quantity for product_id, quantity in remaining.items() if quantity > 0}
+        if uncovered:
+            prices = dict(Product.objects.filter(id__in=uncovered).values_list('id', 'purchase_price'))
+            for product_id, quantity in uncovered.items():
+                layer = receive(product_id, quantity, prices[product_id], 'opening', date=date)
+                layer.remaining_quantity = 0
+                layer.save(update_fields=['remaining_quantity'])
+                consumptions.append(CostConsumption(
+                    layer=layer, product_id=product_id, source_type=source_type, source_id=source_id,
+                    quantity=quantity, unit_cost=averages.get(product_id, layer.unit_cost),
+                ))
+        CostConsumption.objects.bulk_create(consumptions)
+
+
+def release(quantities, source_type, source_id=None, date=None):
+    """
+    Give {product_id: quantity} back to the layers the document's latest
+    consumptions came from. Any quantity the document never consumed is
+    received as a new layer at the product's purchase_price.
+    """
+    quantities = {product_id: int(quantity) for product_id, quantity in quantities.items() if int(quantity) > 0}
+    if not quantities:
+        return
+    with db_transaction.atomic():
+        remaining = dict(quantities)
+        returned = defaultdict(int)
+        changed, emptied = [], []
+        consumptions = CostConsumption.objects.filter(
+            source_type=source_type, source_id=source_id, product_id__in=quantities
+        ).order_by('product_id', '-id')
+        for consumption in consumptions:
+            give = min(consumption.quantity, remaining[consumption.product_id])
+            if give <= 0:
+                continue
+            remaining[consumption.product_id] -= give
+            returned[consumption.layer_id] += give
+            consumption.quantity -= give
+            (changed if consumption.quantity else emptied).append(consumption)
+        CostConsumption.objects.bulk_update(changed, ['quantity'])
+        CostConsumption.objects.filter(id__in=[consumption.id for consumption in emptied]).delete()
+        for layer_id, quantity in returned.items():
+            CostLayer.objects.filter(id=layer_id).update(remaining_quantity=F('remaining_quantity') + quantity)
+
+        uncovered = {product_id: quantity for product_id, quantity in remaining.items() if quantity > 0}
+        if uncovered:
+            prices = dict(Product.objects.filter(id__in=uncovered).values_list('id', 'purchase_price'))
+            for product_id, quantity in uncovered.items():
+                receive(product_id, quantity, prices[product_id], source_type, source_id, date)
+
+
+def document_costs(source_type, source_id):
+    """{product_id: (quantity, total cost)} currently charged to one document."""
+    rows = CostConsumption.objects.filter(source_type=source_type, source_id=source_id).values('product_id').annotate(
+        consumed=Sum('quantity'),
+        cost=Sum(ExpressionWrapper(F('quantity') * F('unit_cost'), output_field=DecimalField(max_digits=15, decimal_places=2))),
+    ).order_by()
+    return {
+        row['product_id']: (row['consumed'], Decimal(row['cost']).quantize(Decimal('0.01')))
+        for row in rows
+    }
+
+
+def document_unit_costs(source_type, source_id):
+    """{product_id: average unit cost charged to one document}, unrounded so quantity x cost gives the charged total."""
+    return {
+        product_id: cost / quantity
+        for product_id, (quantity, cost) in document_costs(source_type, source_id).items()
+        if quantity
+    }
+
+
+def revalue(product_ids=None):
+    """
+    Set Product.purchase_price to the average cost of the open layers for the
+    given products (all products with open layers by default). Products
+    without open layers keep their price. Returns the number of products
+    whose price changed.
+    """
+    layers = CostLayer.objects.filter(remaining_quantity__gt=0)
+    if product_ids is not None:
+        layers = layers.filter(product_id__in=product_ids)
+    costs = _average_costs(layers)
+    products = [
+        product for product in Product.objects.filter(id__in=costs).only('id', 'purchase_price')
+        if product.purchase_price != costs[product.id]
+    ]
+    now = timezone.now()
+    for product in products:
+        product.purchase_price = costs[product.id]
+        product.updated_date = now
+    Product.objects.bulk_update(products, ['purchase_price', 'updated_date'], batch_size=500)
+    return len(products)
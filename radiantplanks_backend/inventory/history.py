@@ -0,0 +1,65 @@
+"""
+Inventory history report engine shared by the JSON and XLSX views.
+
+Opening and closing stock of every stocked product come from one grouped
+query over the stock movement ledger, with a conditional Sum for each
+bound. The period's transactions are read with one values() query that
+joins the product name and, for sales, the invoice line's selling price.
+"""
+from django.db.models import Sum, Q, Case, When, Value, F, OuterRef, Subquery, CharField
+from .models import Product, StockMovement, InvoiceItem
+
+
+TRANSACTION_TYPES = {
+    'opening': 'Opening Stock',
+    'bill': 'Purchase',
+    'invoice': 'Sale',
+    'loss': 'Loss',
+    'adjustment': 'Adjustment',
+}
+
+
+def stock_bounds(start_date, end_date):
+    """{product_id: (opening, closing)} stock around a date range for every stocked product."""
+    totals = {
+        row['product_id']: (row['opening'] or 0, row['closing'] or 0)
+        for row in StockMovement.objects.filter(date__lte=end_date).values('product_id').annotate(
+            opening=Sum('quantity', filter=Q(date__lt=start_date)),
+            closing=Sum('quantity'),
+        ).order_by()
+    }
+    return {
+        product_id: totals.get(product_id, (0, 0))
+        for product_id in Product.objects.filter(product_type="product").values_list('id', flat=True)
+    }
+
+
+def transactions(start_date, end_date):
+    """Stock movements of the date range as report rows (keys in column order), oldest first."""
+    sale_price = InvoiceItem.objects.filter(
+        invoice_id=OuterRef('source_id'), product_id=OuterRef('product_id')
+    ).values('unit_price')[:1]
+    rows = StockMovement.objects.filter(date__range=[start_date, end_date]).annotate(
+        type=Case(
+            *[When(source_type=key, then=Value(label)) for key, label in TRANSACTION_TYPES.items()],
+            output_field=CharField(),
+        ),
+        product_name=F('product__product_name'),
+        unit_price=Case(
+            When(source_type='invoice', then=Subquery(sale_price)),
+            default=F('unit_cost'),
+        ),
+    ).order_by('date', 'id')
+    keys = ('date', 'type', 'product_name', 'quantity', 'unit_price')
+    return [dict(zip(keys, row)) for row in rows.values_list(*keys)]
+
+
+def inventory_history(start_date, end_date):
+    """Opening stock, transactions and closing stock keyed by product name for a date range."""
+    names = dict(Product.objects.filter(product_type="product").values_list('id', 'product_name'))
+    bounds = stock_bounds(start_date, end_date)
+    return {
+        'initial_inventory': {names[product_id]: opening for product_id, (opening, _) in bounds.items()},
+        'transactions': transactions(start_date, end_date),
+        'closing_inventory': {names[product_id]: closing for product_id, (_, closing) in bounds.items()},
+    }
@@ -0,0 +1,194 @@
+"""
+Bulk product import.
+
+Products are read from a CSV or Excel sheet (one row per product) and
+validated with pandas. Rows with errors are reported by row number and
+skipped. The valid rows are then created together with bulk_create:
+products, inventory account mappings, opening stock movements and cost
+layers. The opening stock of the whole import is posted as one journal
+that debits the inventory account and credits owner's equity. Creating
+products one at a time posts one such journal per product instead.
+
+bulk_create bypasses Product.save(), so needs_reorder is set afterwards
+with inventory.reorder.refresh. The search index is filled by the
+database triggers of inventory.search.
+"""
+import uuid
+from decimal import Decimal
+import pandas as pd
+from django.db import transaction as db_transaction
+from django.utils import timezone
+from accounts import posting, registry
+from accounts.models import Account
+from .models import Product, Category, ProductAccountMapping
+from . import stock, costing, reorder
+
+
+REQUIRED_COLUMNS = ['product_name', 'product_type']
+
+OPTIONAL_COLUMNS = [
+    'category', 'sku', 'barcode', 'purchase_description', 'quantity', 'unit', 'reorder_level',
+    'as_on_date', 'total_sq_ft', 'batch_lot_number', 'tile_length', 'tile_width', 'no_of_tiles',
+    'purchase_price', 'specifications', 'tags',
+]
+
+# tiles per unit, as in ProductCreateView.calculate_stock_quantity
+UNITS = {'box': 1, 'pallet': 55}
+
+PRODUCT_TYPES = ['product', 'service']
+
+
+def read(file):
+    """DataFrame of the uploaded sheet, every cell as a stripped string or None; ValueError if unreadable."""
+    name = file.name.lower()
+    if name.endswith('.csv'):
+        df = pd.read_csv(file, dtype=str)
+    elif name.endswith(('.xls', '.xlsx')):
+        df = pd.read_excel(file, dtype=str)
+    else:
+        raise ValueError('Unsupported file format. Use CSV or Excel.')
+    df.columns = [str(column).strip().lower() for column in df.columns]
+    for column in REQUIRED_COLUMNS + OPTIONAL_COLUMNS:
+        if column not in df.columns:
+            df[column] = None
+    df = df.apply(lambda column: column.str.strip() if column.dtype == object else column)
+    df = df.replace({'': None}).astype(object)
+    return df.where(df.notna(), None)
+
+
+def missing_columns(df):
+    return [column for column in REQUIRED_COLUMNS if df[column].isna().all()]
+
+
+def validate(df):
+    """
+    Check every row. Returns (valid rows as dicts ready for Product, errors
+    as [{'row': n, 'errors': {column: message}}]).
+    """
+    errors = {}
+
+    def fail(mask, column, message):
+        for index in df.index[mask]:
+            errors.setdefault(index, {}).setdefault(column, message)
+
+    def number(column, default=None):
+        values = pd.to_numeric(df[column], errors='coerce')
+        fail(df[column].notna() & values.isna(), column, f'{column} must be a number.')
+        fail(values < 0, column, f'{column} cannot be negative.')
+        return values.where(values.notna(), default)
+
+    product_type = df['product_type'].str.lower()
+    is_product = product_type == 'product'
+    fail(df['product_name'].isna(), 'product_name', 'product_name is required.')
+    fail(~product_type.isin(PRODUCT_TYPES), 'product_type', "product_type must be 'product' or 'service'.")
+
+    categories = {name.lower(): category_id for category_id, name in Category.objects.filter(is_active=True).values_list('id', 'name')}
+    category_ids = df['category'].str.lower().map(categories)
+    fail(is_product & df['category'].isna(), 'category', 'Category is required for products.')
+    fail(is_product & df['category'].notna() & category_ids.isna(), 'category', 'Category not found.')
+
+    tile_length, tile_width, no_of_tiles = number('tile_length'), number('tile_width'), number('no_of_tiles')
+    for column, values in (('tile_length', tile_length), ('tile_width', tile_width), ('no_of_tiles', no_of_tiles)):
+        fail(is_product & values.isna() & df[column].isna(), column,
+             'Tile length and width and number of tiles are required to calculate the area.')
+    total_sq_ft = number('total_sq_ft')
+    quantity = number('quantity', 0)
+    fail(quantity.notna() & (quantity % 1 != 0), 'quantity', 'quantity must be a whole number.')
+    reorder_level = number('reorder_level', 0)
+    purchase_price = number('purchase_price', 0)
+    unit = df['unit'].str.lower().fillna('box')
+    fail(is_product & ~unit.isin(list(UNITS)), 'unit', "unit must be 'box' or 'pallet'.")
+    as_on_date = pd.to_datetime(df['as_on_date'], errors='coerce')
+    fail(df['as_on_date'].notna() & as_on_date.isna(), 'as_on_date', 'as_on_date is not a valid date.')
+
+    fail(df['sku'].notna() & df['sku'].duplicated(), 'sku', 'Duplicate SKU in the file.')
+    existing = set(Product.objects.filter(sku__in=df['sku'].dropna().unique().tolist()).values_list('sku', flat=True))
+    fail(df['sku'].isin(existing), 'sku', 'Product with this SKU already exists.')
+
+    rows = []
+    for index in df.index:
+        if index in errors:
+            continue
+        product = product_type[index] == 'product'
+        area = None
+        if product:
+            area = total_sq_ft[index]
+            if pd.isna(area):
+                area = tile_length[index] * tile_width[index] * no_of_tiles[index] / 144
+            area = round(Decimal(str(area)), 2)
+        rows.append({
+            'row': index + 1,
+            'product_type': product_type[index],
+            'product_name': df['product_name'][index],
+            'sku': df['sku'][index],
+            'barcode': df['barcode'][index],
+            'category_id_id': int(category_ids[index]) if product else None,
+            'purchase_description': df['purchase_description'][index],
+            'stock_quantity': int(quantity[index]) * UNITS[unit[index]] if product else 0,
+            'reorder_level': int(reorder_level[index]),
+            'batch_lot_number': df['batch_lot_number'][index],
+            'as_on_date': as_on_date[index].date() if not pd.isna(as_on_date[index]) else timezone.localdate(),
+            'tile_length': _decimal(tile_length[index]),
+            'tile_width': _decimal(tile_width[index]),
+            'no_of_tiles': int(no_of_tiles[index]) if not pd.isna(no_of_tiles[index]) else 0,
+            'tile_area': area,
+            'purchase_price': _decimal(purchase_price[index]),
+            'specifications': df['specifications'][index],
+            'tags': df['tags'][index],
+        })
+    report = [{'row': index + 1, 'errors': row_errors} for index, row_errors in sorted(errors.items())]
+    return rows, report
+
+
+def _decimal(value):
+    if value is None or pd.isna(value):
+        return None
+    return round(Decimal(str(value)), 2)
+
+
+def import_products(rows, inventory_account, user):
+    """
+    Create the validated rows. Products get a mapping to `inventory_account`
+    and their opening stock, whose total value is posted as one journal.
+    Returns (created products, journal Transaction or None).
+    """
+    with db_transaction.atomic():
+        products = Product.objects.bulk_create([
+            Product(images='', created_by=user, **{key: value for key, value in row.items() if key != 'row'})
+            for row in rows
+        ], batch_size=500)
+        stocked = [product for product in products if product.product_type == 'product']
+        ProductAccountMapping.objects.bulk_create([
+            ProductAccountMapping(product=product, inventory_account=inventory_account) for product in stocked
+        ], batch_size=500)
+        stock.record_openings(
+            (product, product.stock_quantity, product.as_on_date, product.purchase_price) for product in stocked
+        )
+        costing.receive_many(
+            [(product, product.stock_quantity, product.purchase_price, product.id, product.as_on_date) for product in stocked],
+            'opening',
+        )
+        reorder.refresh([product.id for product in stocked])
+
+        total_cost = sum((Decimal(product.stock_quantity) * product.purchase_price for product in stocked), Decimal('0'))
+        journal = None
+        if total_cost > 0:
+            try:
+                owner_equity_account = registry.account_id(registry.OWNER_EQUITY)
+            except Account.DoesNotExist:
+                raise ValueError("Owner equity account does not exist.")
+            count = sum(1 for product in stocked if product.stock_quantity)
+            journal = posting.post_transaction(
+                [
+                    posting.Line(inventory_account, debit=total_cost,
+                                 description=f"Inventory addition for {count} imported products"),
+                    posting.Line(owner_equity_account, credit=total_cost,
+                                 description=f"Fund allocation for inventory import of {count} products"),
+                ],
+                reference_number=f"INV-{uuid.uuid4().hex[:6].upper()}-{inventory_account.id}",
+                transaction_type='journal',
+                date=timezone.localdate(),
+                description=f"Opening inventory for {count} imported products",
+                created_by=user,
+            )
+    return products, journal
@@ -0,0 +1,251 @@
+"""
+Invoice ledger lines.
+
+An invoice's sale is posted as one Transaction. With the "aggregated"
+posting mode (settings.INVOICE_POSTING_MODE, the default) the sales side
+of that transaction has one inventory credit, one COGS debit and one
+sales revenue credit, whatever the number of items. The "itemized" mode
+keeps the earlier form: three lines per product and one per service.
+In both modes the quantity, cost and revenue of every product are saved
+as InvoiceCostBreakdown rows for drill-down. Amounts are rounded per
+item, so the rows add up exactly to the ledger lines.
+
+compact() rewrites an invoice posted itemized, or amended by adjusting
+lines, into the aggregated form (see the compact_invoice_ledger command).
+The old lines are deactivated, not deleted. The per-account totals of the
+transaction do not change, and the daily snapshots are moved out for the
+old lines and back in for the new ones, so balances and reports stay as
+they are.
+"""
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from django.db import transaction as db_transaction
+from accounts import posting, registry, snapshots
+from accounts.models import TransactionLine
+from .models import InvoiceItem, InvoiceCostBreakdown
+
+
+AGGREGATED = 'aggregated'
+ITEMIZED = 'itemized'
+
+CENT = Decimal('0.01')
+
+
+def posting_mode():
+    return getattr(settings, 'INVOICE_POSTING_MODE', AGGREGATED) or AGGREGATED
+
+
+def _round(value):
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def item_amounts(products, service_products):
+    """
+    One dict per invoice line (product_id, product_name, quantity, cost,
+    revenue, service) from the product and service dicts the invoice views
+    build. Services have no stock quantity or cost.
+    """
+    amounts = []
+    for product in products or []:
+        quantity = Decimal(product.get("quantity"))
+        amounts.append({
+            'product_id': product.get("product_id"),
+            'product_name': product.get("product_name"),
+            'quantity': quantity,
+            'cost': _round(quantity * Decimal(product.get("unit_cost"))),
+            'revenue': _round(quantity * Decimal(product.get("unit_price"))),
+            'service': False,
+        })
+    for service_product in service_products or []:
+        amounts.append({
+            'product_id': service_product.get("product_id"),
+            'product_name': service_product.get("product_name"),
+            'quantity': Decimal('0'),
+            'cost': Decimal('0.00'),
+            'revenue': _round(Decimal(service_product.get("unit_price"))),
+            'service': True,
+        })
+    return amounts
+
+
+def round_amount(value):
+    """`value` (a float, string or Decimal from a request) rounded to cents as the ledger posts it."""
+    return Decimal(str(value or 0)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def expected_total(products, service_products, tax_amount):
+    """
+    The total an invoice with these lines must have: the item revenue,
+    rounded per item as item_amounts() has it, plus the tax when there is any.
+    """
+    revenue = sum((_round(Decimal(product.get("quantity")) * Decimal(product.get("unit_price")))
+                   for product in products or []), Decimal('0.00'))
+    revenue += sum((_round(Decimal(service_product.get("unit_price")))
+                    for service_product in service_products or []), Decimal('0.00'))
+    return revenue + max(round_amount(tax_amount), Decimal('0.00'))
+
+
+def aggregated_lines(invoice_id, cost, revenue):
+    """The inventory, COGS and sales revenue lines of an invoice, one per account."""
+    inventory_account, cogs_account, sales_revenue_account = registry.account_ids(
+        registry.INVENTORY, registry.COST_OF_GOODS_SOLD, registry.SALES_INCOME
+    )
+    return [
+        posting.Line(inventory_account, credit=cost, invoice_id=invoice_id,
+                     description=f"Inventory adjustment for invoice {invoice_id}"),
+        posting.Line(cogs_account, debit=cost, invoice_id=invoice_id,
+                     description=f"Cost of goods sold for invoice {invoice_id}"),
+        posting.Line(sales_revenue_account, credit=revenue, invoice_id=invoice_id,
+                     description=f"Sales revenue for invoice {invoice_id}"),
+    ]
+
+
+def itemized_lines(invoice_id, amounts):
+    """The inventory, COGS and sales revenue lines of an invoice, per product and service."""
+    inventory_account, cogs_account, sales_revenue_account = registry.account_ids(
+        registry.INVENTORY, registry.COST_OF_GOODS_SOLD, registry.SALES_INCOME
+    )
+    lines = []
+    for amount in amounts:
+        name = amount['product_name']
+        if amount['service']:
+            lines.append(posting.Line(sales_revenue_account, credit=amount['revenue'], invoice_id=invoice_id,
+                                      description=f"Service Sales revenue for {name}, invoice_id {invoice_id}"))
+            continue
+        lines += [
+            posting.Line(inventory_account, credit=amount['cost'], invoice_id=invoice_id,
+                         description=f"Inventory adjustment for {name}"),
+            posting.Line(cogs_account, debit=amount['cost'], invoice_id=invoice_id,
+                         description=f"Cost of goods sold for {name}"),
+            posting.Line(sales_revenue_account, credit=amount['revenue'], invoice_id=invoice_id,
+                         description=f"Sales revenue for {name}"),
+        ]
+    return lines
+
+
+def sales_lines(invoice_id, amounts):
+    """Inventory, COGS and revenue lines for `amounts` in the configured posting mode."""
+    if posting_mode() == ITEMIZED:
+        return itemized_lines(invoice_id, amounts)
+    return aggregated_lines(
+        invoice_id,
+        sum((amount['cost'] for amount in amounts), Decimal('0.00')),
+        sum((amount['revenue'] for amount in amounts), Decimal('0.00')),
+    )
+
+
+def save_breakdown(invoice_id, amounts):
+    """Replace the invoice's InvoiceCostBreakdown rows with `amounts` summed per product."""
+    totals = defaultdict(lambda: [Decimal('0'), Decimal('0.00'), Decimal('0.00')])
+    for amount in amounts:
+        total = totals[amount['product_id']]
+        total[0] += amount['quantity']
+        total[1] += amount['cost']
+        total[2] += amount['revenue']
+    with db_transaction.atomic():
+        InvoiceCostBreakdown.objects.filter(invoice_id=invoice_id).delete()
+        InvoiceCostBreakdown.objects.bulk_create([
+            InvoiceCostBreakdown(invoice_id=invoice_id, product_id=product_id,
+                                 quantity=int(quantity), cost=cost, revenue=revenue)
+            for product_id, (quantity, cost, revenue) in totals.items()
+        ])
+
+
+def _breakdown_from_lines(invoice_id, lines, accounts):
+    """
+    Per-product amounts of an itemized invoice, matched from its line
+    descriptions to its items by product name. Amounts of a name shared by
+    several products are split by quantity.
+    """
+    inventory_account, cogs_account, sales_revenue_account = accounts
+    cost_by_name, revenue_by_name = defaultdict(Decimal), defaultdict(Decimal)
+    for line in lines:
+        description = line.description
+        if line.account_id == cogs_account and description.startswith("Cost of goods sold for "):
+            cost_by_name[description[len("Cost of goods sold for "):]] += line.debit_amount
+        elif line.account_id == sales_revenue_account and description.startswith("Service Sales revenue for "):
+            name = description[len("Service Sales revenue for "):].removesuffix(f", invoice_id {invoice_id}")
+            revenue_by_name[name] += line.credit_amount
+        elif line.account_id == sales_revenue_account and description.startswith("Sales revenue for "):
+            revenue_by_name[description[len("Sales revenue for "):]] += line.credit_amount
+
+    products_by_name = defaultdict(dict)
+    for product_id, name, product_type, quantity in InvoiceItem.objects.filter(invoice_id=invoice_id).values_list(
+        'product_id', 'product__product_name', 'product__product_type', 'quantity'
+    ):
+        quantities = products_by_name[name]
+        quantities[product_id] = quantities.get(product_id, 0) + (quantity if product_type == 'product' else 0)
+
+    amounts = []
+    for name, quantities in products_by_name.items():
+        cost, revenue = cost_by_name.pop(name, Decimal('0.00')), revenue_by_name.pop(name, Decimal('0.00'))
+        total_quantity = sum(quantities.values())
+        remaining_cost, remaining_revenue = cost, revenue
+        for index, (product_id, quantity) in enumerate(quantities.items()):
+            if index == len(quantities) - 1:
+                share_cost, share_revenue = remaining_cost, remaining_revenue
+            else:
+                share = Decimal(quantity) / total_quantity if total_quantity else Decimal(1) / len(quantities)
+                share_cost, share_revenue = _round(cost * share), _round(revenue * share)
+            remaining_cost -= share_cost
+            remaining_revenue -= share_revenue
+            amounts.append({
+                'product_id': product_id, 'product_name': name, 'quantity': Decimal(quantity),
+                'cost': share_cost, 'revenue': share_revenue, 'service': False,
+            })
+    # names left over belong to no current item (e.g. renamed products); such invoices are not compacted
+    return amounts, not cost_by_name and not revenue_by_name
+
+
+def compact(invoice_id, transaction, dry_run=False):
+    """
+    Replace (deactivate) the active itemized inventory, COGS and revenue
+    lines of an invoice's sale transaction with one line per account, and save its
+    breakdown if it has none. Returns (lines before, lines after), or None
+    when the lines cannot be matched to the invoice's items exactly; the
+    invoice is then left as it is.
+    """
+    accounts = registry.account_ids(registry.INVENTORY, registry.COST_OF_GOODS_SOLD, registry.SALES_INCOME)
+    inventory_account, cogs_account, sales_revenue_account = accounts
+    lines = list(TransactionLine.objects.filter(
+        transaction=transaction, invoice_id=invoice_id, is_active=True, account_id__in=accounts
+    ))
+    if len(lines) <= len(accounts):
+        return len(lines), len(lines)
+
+    cost = sum((line.debit_amount - line.credit_amount for line in lines if line.account_id == cogs_account), Decimal('0.00'))
+    inventory_credit = sum((line.credit_amount - line.debit_amount for line in lines if line.account_id == inventory_account), Decimal('0.00'))
+    revenue = sum((line.credit_amount - line.debit_amount for line in lines if line.account_id == sales_revenue_account), Decimal('0.00'))
+    if cost != inventory_credit or cost < 0 or revenue < 0:
+        return None
+
+    breakdown = InvoiceCostBreakdown.objects.filter(invoice_id=invoice_id)
+    amounts = None
+    if breakdown.exists():
+        rows = list(breakdown.values_list('cost', 'revenue'))
+        matched = sum(row[0] for row in rows) == cost and sum(row[1] for row in rows) == revenue
+    else:
+        amounts, matched = _breakdown_from_lines(invoice_id, lines, accounts)
+        matched = matched and sum(a['cost'] for a in amounts) == cost and sum(a['revenue'] for a in amounts) == revenue
+    if not matched:
+        return None
+
+    new_lines = [
+        TransactionLine(transaction=transaction, account_id=line.account, description=line.description,
+                        debit_amount=line.debit, credit_amount=line.credit, invoice_id=invoice_id)
+        for line in aggregated_lines(invoice_id, cost, revenue)
+        if line.debit or line.credit
+    ]
+    if not dry_run:
+        with db_transaction.atomic():
+            # the old lines are retired, not deleted, so they stay on record and the integrity
+            # check sees them change; the per-account totals, hence the balances, do not move
+            snapshots.deactivate_lines(TransactionLine.objects.filter(id__in=[line.id for line in lines]))
+            TransactionLine.objects.bulk_create(new_lines)
+            snapshots.record_lines(TransactionLine.objects.filter(
+                transaction=transaction, invoice_id=invoice_id, is_active=True, account_id__in=accounts
+            ))
+            if amounts is not None:
+                save_breakdown(invoice_id, amounts)
+    return len(lines), len(new_lines)
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from inventory import stock
+
+
+class Command(BaseCommand):
+    help = "Rebuild the StockMovement ledger from bills, invoices, losses and current stock."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--product', action='append', type=int, dest='products',
+            help="Only rebuild the given product id (may be repeated).",
+        )
+
+    def handle(self, *args, **options):
+        written = stock.rebuild(options['products'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} stock movement rows."))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from inventory import invoice_ledger
+from inventory.models import InvoiceTransactionMapping
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrite the per-product inventory, COGS and revenue lines of posted invoices as one line per "
+        "account, keeping the per-product amounts in InvoiceCostBreakdown."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--invoice', action='append', type=int, dest='invoices',
+            help="Only compact the given invoice id (may be repeated).",
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Report what would change without writing.",
+        )
+
+    def handle(self, *args, **options):
+        mappings = InvoiceTransactionMapping.objects.filter(
+            is_payment_transaction=False, is_active=True, transaction__is_active=True
+        ).select_related('transaction').order_by('invoice_id')
+        if options['invoices']:
+            mappings = mappings.filter(invoice_id__in=options['invoices'])
+
+        compacted, before, after, skipped = 0, 0, 0, []
+        for mapping in mappings.iterator():
+            result = invoice_ledger.compact(int(mapping.invoice_id), mapping.transaction, dry_run=options['dry_run'])
+            if result is None:
+                skipped.append(int(mapping.invoice_id))
+                continue
+            if result[0] != result[1]:
+                compacted += 1
+                before += result[0]
+                after += result[1]
+
+        verb = "Would compact" if options['dry_run'] else "Compacted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {compacted} invoices: {before} lines to {after}."))
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f"Skipped {len(skipped)} invoices whose lines do not match their items: "
+                f"{', '.join(map(str, skipped))}"
+            ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from inventory import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product full-text search index (SQLite FTS5) from the product table."
+
+    def handle(self, *args, **options):
+        if not search.uses_fts():
+            self.stdout.write(self.style.WARNING("The database has no FTS5 index; product search uses substring matching."))
+            return
+        indexed = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} products."))
@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from authentication.models import NewUser
+from inventory import reorder
+
+
+class Command(BaseCommand):
+    help = "Email a digest of the products that need reordering. Meant to run daily from cron."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--to', action='append', dest='recipients',
+            help="Recipient address (may be repeated). Defaults to the active admin users.",
+        )
+        parser.add_argument(
+            '--window-days', type=int, default=reorder.VELOCITY_WINDOW_DAYS,
+            help="Trailing days of invoices used for the sales velocity.",
+        )
+        parser.add_argument(
+            '--cover-days', type=int,
+            help="Also include products with fewer days of cover than this.",
+        )
+        parser.add_argument(
+            '--always', action='store_true',
+            help="Send the digest even when no product is at risk.",
+        )
+
+    def handle(self, *args, **options):
+        products = reorder.at_risk(window_days=options['window_days'], cover_days=options['cover_days'])
+        if not products and not options['always']:
+            self.stdout.write(self.style.SUCCESS("No products need reordering; no digest sent."))
+            return
+
+        recipients = options['recipients'] or list(
+            NewUser.objects.filter(user_type='admin', is_active=True).values_list('email', flat=True)
+        )
+        if not recipients:
+            self.stdout.write(self.style.WARNING("No recipients for the reorder digest."))
+            return
+
+        lines = [
+            f"Products needing reorder as of {timezone.localdate():%Y-%m-%d} "
+            f"(sales velocity over the last {options['window_days']} days):",
+            "",
+        ]
+        for product in products:
+            cover = f"{product['days_of_cover']} days" if product['days_of_cover'] is not None else "no recent sales"
+            lines.append(
+                f"- {product['product_name']} ({product['sku'] or 'no SKU'}): stock {product['stock_quantity']}, "
+                f"reorder level {product['reorder_level']}, cover {cover}, shortfall {product['shortfall']}"
+            )
+
+        EmailMessage(
+            subject=f"Reorder digest: {len(products)} products at risk",
+            body="\n".join(lines),
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=recipients,
+        ).send()
+        self.stdout.write(self.style.SUCCESS(f"Sent reorder digest for {len(products)} products to {len(recipients)} recipients."))
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.2 on 2026-10-18 03:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0038_billtransactionmapping_is_payment_transaction_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('quantity', models.IntegerField()),
+                ('source_type', models.CharField(choices=[('opening', 'Opening Stock'), ('bill', 'Bill'), ('invoice', 'Invoice'), ('loss', 'Loss'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('source_id', models.IntegerField(blank=True, null=True)),
+                ('unit_cost', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('running_quantity', models.IntegerField(default=0)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='inventory.product')),
+            ],
+            options={
+                'ordering': ['product', 'date', 'id'],
+                'indexes': [models.Index(fields=['product', 'date', 'id'], name='inventory_s_product_4571d4_idx'), models.Index(fields=['date'], name='inventory_s_date_b6e0f6_idx'), models.Index(fields=['source_type', 'source_id'], name='inventory_s_source__18ec1c_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.2 on 2026-10-18 03:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0039_stockmovement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CostLayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_type', models.CharField(choices=[('opening', 'Opening Stock'), ('bill', 'Bill'), ('invoice', 'Invoice'), ('loss', 'Loss'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('source_id', models.IntegerField(blank=True, null=True)),
+                ('received_date', models.DateField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('remaining_quantity', models.PositiveIntegerField()),
+                ('unit_cost', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_layers', to='inventory.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CostConsumption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_type', models.CharField(choices=[('opening', 'Opening Stock'), ('bill', 'Bill'), ('invoice', 'Invoice'), ('loss', 'Loss'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('source_id', models.IntegerField(blank=True, null=True)),
+                ('quantity', models.PositiveIntegerField()),
+                ('unit_cost', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_consumptions', to='inventory.product')),
+                ('layer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumptions', to='inventory.costlayer')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='costlayer',
+            index=models.Index(condition=models.Q(('remaining_quantity__gt', 0)), fields=['product', 'received_date', 'id'], name='inventory_costlayer_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='costlayer',
+            index=models.Index(fields=['source_type', 'source_id'], name='inventory_c_source__bf4f5c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='costconsumption',
+            index=models.Index(fields=['source_type', 'source_id', 'product'], name='inventory_c_source__57fccf_idx'),
+        ),
+    ]
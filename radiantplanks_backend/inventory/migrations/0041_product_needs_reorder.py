@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 03:42
+
+from django.db import migrations, models
+from django.db.models import F, Q, ExpressionWrapper, BooleanField
+
+
+def flag_products(apps, schema_editor):
+    Product = apps.get_model('inventory', 'Product')
+    Product.objects.update(needs_reorder=ExpressionWrapper(
+        Q(product_type='product', reorder_level__gt=0, stock_quantity__lte=F('reorder_level')),
+        output_field=BooleanField(),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0040_cost_layers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='needs_reorder',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+        migrations.RunPython(flag_products, migrations.RunPython.noop),
+    ]
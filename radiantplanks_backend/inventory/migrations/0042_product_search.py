@@ -0,0 +1,76 @@
+from django.db import migrations
+
+
+INDEXED_COLUMNS = "product_name, sku, barcode, purchase_description, tags, category_name"
+
+NEW_ROW = (
+    "new.id, new.product_name, new.sku, new.barcode, new.purchase_description, new.tags, "
+    "(SELECT name FROM inventory_category WHERE id = new.category_id_id)"
+)
+
+CREATE_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE inventory_product_fts USING fts5(
+        {INDEXED_COLUMNS}, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+    # bm25 weights in column order: name, sku, barcode, description, tags, category
+    "INSERT INTO inventory_product_fts(inventory_product_fts, rank) VALUES ('rank', 'bm25(10.0, 8.0, 8.0, 1.0, 2.0, 3.0)')",
+    f"""
+    CREATE TRIGGER inventory_product_fts_insert AFTER INSERT ON inventory_product BEGIN
+        INSERT INTO inventory_product_fts(rowid, {INDEXED_COLUMNS}) VALUES ({NEW_ROW});
+    END
+    """,
+    f"""
+    CREATE TRIGGER inventory_product_fts_update
+    AFTER UPDATE OF product_name, sku, barcode, purchase_description, tags, category_id_id ON inventory_product BEGIN
+        DELETE FROM inventory_product_fts WHERE rowid = old.id;
+        INSERT INTO inventory_product_fts(rowid, {INDEXED_COLUMNS}) VALUES ({NEW_ROW});
+    END
+    """,
+    """
+    CREATE TRIGGER inventory_product_fts_delete AFTER DELETE ON inventory_product BEGIN
+        DELETE FROM inventory_product_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER inventory_category_fts_rename AFTER UPDATE OF name ON inventory_category BEGIN
+        UPDATE inventory_product_fts SET category_name = new.name
+        WHERE rowid IN (SELECT id FROM inventory_product WHERE category_id_id = new.id);
+    END
+    """,
+    f"""
+    INSERT INTO inventory_product_fts(rowid, {INDEXED_COLUMNS})
+    SELECT p.id, p.product_name, p.sku, p.barcode, p.purchase_description, p.tags, c.name
+    FROM inventory_product p LEFT JOIN inventory_category c ON c.id = p.category_id_id
+    """,
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS inventory_category_fts_rename",
+    "DROP TRIGGER IF EXISTS inventory_product_fts_delete",
+    "DROP TRIGGER IF EXISTS inventory_product_fts_update",
+    "DROP TRIGGER IF EXISTS inventory_product_fts_insert",
+    "DROP TABLE IF EXISTS inventory_product_fts",
+]
+
+
+def run_on_sqlite(statements):
+    def operation(apps, schema_editor):
+        # FTS5 is SQLite only; other databases use the substring fallback in inventory.search
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0041_product_needs_reorder'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_sqlite(CREATE_SQL), run_on_sqlite(DROP_SQL)),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 03:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0004_rename_last_login_city_auditlog_activity_city_and_more'),
+        ('inventory', '0042_product_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['barcode'], name='inventory_product_barcode_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 03:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0004_rename_last_login_city_auditlog_activity_city_and_more'),
+        ('inventory', '0043_product_barcode_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updated_date'], name='inventory_product_updated_idx'),
+        ),
+    ]
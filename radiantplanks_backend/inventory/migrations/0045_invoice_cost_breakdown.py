@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 04:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0044_product_updated_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceCostBreakdown',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(default=0)),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_breakdown', to='inventory.invoice')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invoice_costs', to='inventory.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('invoice', 'product'), name='inventory_invoicecost_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.1.2 on 2026-10-18 04:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# inventory.numbering.FORMATS at the time of this migration
+FORMATS = {
+    'invoice': 'INV-{year}-{number:05d}',
+    'estimate': 'EST-{year}-{number:05d}',
+}
+
+
+def number_documents(apps, schema_editor):
+    """Number existing invoices and estimates by year, in creation order, and start their sequences after them."""
+    DocumentSequence = apps.get_model('inventory', 'DocumentSequence')
+    for model_name, field, date_field in (('Invoice', 'invoice_number', 'created_date'), ('Estimate', 'estimate_number', 'date')):
+        model = apps.get_model('inventory', model_name)
+        document_type = model_name.lower()
+        counts = {}
+        documents = []
+        for document in model.objects.order_by('id').only('id', date_field):
+            year = getattr(document, date_field).year
+            counts[year] = counts.get(year, 0) + 1
+            setattr(document, field, FORMATS[document_type].format(year=year, number=counts[year]))
+            documents.append(document)
+        model.objects.bulk_update(documents, [field], batch_size=500)
+        DocumentSequence.objects.bulk_create([
+            DocumentSequence(document_type=document_type, year=year, next_number=count + 1)
+            for year, count in counts.items()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0004_rename_last_login_city_auditlog_activity_city_and_more'),
+        ('inventory', '0045_invoice_cost_breakdown'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estimate',
+            name='estimate_number',
+            field=models.CharField(blank=True, max_length=50, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='invoice_number',
+            field=models.CharField(blank=True, max_length=50, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name='DocumentSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_type', models.CharField(max_length=20)),
+                ('year', models.IntegerField()),
+                ('next_number', models.IntegerField(default=1)),
+                ('block_size', models.IntegerField(default=1)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('document_type', 'year'), name='inventory_documentsequence_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DocumentNumberReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_type', models.CharField(max_length=20)),
+                ('year', models.IntegerField()),
+                ('number', models.IntegerField()),
+                ('document_number', models.CharField(max_length=50, unique=True)),
+                ('status', models.CharField(choices=[('reserved', 'Reserved'), ('released', 'Released'), ('used', 'Used')], default='reserved', max_length=10)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('reserved_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='document_number_reservations', to='authentication.newuser')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['document_type', 'year', 'status', 'number'], name='inventory_docnumber_free_idx')],
+            },
+        ),
+        migrations.RunPython(number_documents, migrations.RunPython.noop),
+    ]
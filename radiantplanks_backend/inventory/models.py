@@ -49,6 +49,8 @@ class Product(models.Model):
     # Stock Details
     stock_quantity = models.PositiveIntegerField(default=0, null=True, blank=True)
     reorder_level = models.PositiveIntegerField(default=0, null=True, blank=True)
+    # At or below reorder_level; kept in step with stock by save() and inventory.reorder.refresh
+    needs_reorder = models.BooleanField(default=False, db_index=True, editable=False)
     batch_lot_number = models.CharField(max_length=100, null=True, blank=True)
     as_on_date = models.DateField(default=now, blank=True, null=True)
     tile_length = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)  # For tile dimensions
@@ -74,6 +76,25 @@ class Product(models.Model):
     updated_date = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # scan lookups (inventory.scan); sku is already unique
+            models.Index(fields=['barcode'], name='inventory_product_barcode_idx'),
+            # catalog validator (inventory.catalog)
+            models.Index(fields=['updated_date'], name='inventory_product_updated_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.needs_reorder = bool(
+            self.product_type == 'product'
+            and self.reorder_level
+            and (self.stock_quantity or 0) <= self.reorder_level
+        )
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'stock_quantity', 'reorder_level', 'product_type'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'needs_reorder'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.item_name
     
@@ -117,7 +138,7 @@ class Invoice(models.Model):
     bill_date = models.DateTimeField(default=timezone.now)  # Redundant, could be removed
     due_date = models.DateTimeField(default=timezone.now)  # Due date
     payment_date = models.DateField(null=True, blank=True)  # Payment date
-    # invoice_number = models.CharField(max_length=50, unique=True)  # Invoice num
+    invoice_number = models.CharField(max_length=50, unique=True, null=True, blank=True)  # from inventory.numbering
     message_on_invoice = models.TextField(null=True, blank=True)  # Message on invoice
     message_on_statement = models.TextField(null=True, blank=True)  # Message on statement
     sum_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.0)
@@ -161,8 +182,31 @@ class InvoiceItem(models.Model):
         return f"Item {self.id} - Invoice {self.invoice_id} - Product {self.product_id}"
     
 
+class InvoiceCostBreakdown(models.Model):
+    """
+    Quantity, cost and revenue of one product on an invoice. The invoice's
+    ledger entry may carry a single inventory, COGS and revenue line
+    (inventory.invoice_ledger); these rows are its per-product drill-down
+    and add up to those lines.
+    """
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='cost_breakdown')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='invoice_costs')
+    quantity = models.IntegerField(default=0)
+    cost = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    revenue = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['invoice', 'product'], name='inventory_invoicecost_unique'),
+        ]
+
+    def __str__(self):
+        return f"Invoice {self.invoice_id} - Product {self.product_id}: cost {self.cost}, revenue {self.revenue}"
+
+
 class Estimate(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="estimate_customer")
+    estimate_number = models.CharField(max_length=50, unique=True, null=True, blank=True)  # from inventory.numbering
     date = models.DateTimeField(default=timezone.now)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     created_by = models.ForeignKey(NewUser, on_delete=models.CASCADE, related_name="estimate_created_by")
@@ -287,4 +331,140 @@ class LostProduct(models.Model):
 
 
     def __str__(self):
-        return f"Lost Product: {self.product.product_name} - Quantity: {self.quantity_lost} - Loss: {self.total_loss}"
\ No newline at end of file
+        return f"Lost Product: {self.product.product_name} - Quantity: {self.quantity_lost} - Loss: {self.total_loss}"
+
+class StockMovement(models.Model):
+    """
+    One change of a product's stock. `quantity` is the signed change (negative
+    when stock goes out) and `running_quantity` the product's stock after this
+    movement in (date, id) order. Written through inventory.stock.
+    """
+    SOURCE_TYPE_CHOICES = [
+        ('opening', 'Opening Stock'),
+        ('bill', 'Bill'),
+        ('invoice', 'Invoice'),
+        ('loss', 'Loss'),
+        ('adjustment', 'Adjustment'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_movements')
+    date = models.DateField()
+    quantity = models.IntegerField()
+    source_type = models.CharField(max_length=20, choices=SOURCE_TYPE_CHOICES)
+    source_id = models.IntegerField(null=True, blank=True)
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    running_quantity = models.IntegerField(default=0)
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['product', 'date', 'id']
+        indexes = [
+            models.Index(fields=['product', 'date', 'id']),
+            models.Index(fields=['date']),
+            models.Index(fields=['source_type', 'source_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.product.product_name} - {self.date} - {self.quantity}"
+
+
+class CostLayer(models.Model):
+    """
+    Stock received at one unit cost. `remaining_quantity` is the part still
+    on hand; invoices and losses consume open layers oldest first. Written
+    through inventory.costing.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='cost_layers')
+    source_type = models.CharField(max_length=20, choices=StockMovement.SOURCE_TYPE_CHOICES)
+    source_id = models.IntegerField(null=True, blank=True)
+    received_date = models.DateField()
+    quantity = models.PositiveIntegerField()
+    remaining_quantity = models.PositiveIntegerField()
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2)
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['product', 'received_date', 'id'],
+                condition=models.Q(remaining_quantity__gt=0),
+                name='inventory_costlayer_open_idx',
+            ),
+            models.Index(fields=['source_type', 'source_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.product.product_name} - {self.remaining_quantity}/{self.quantity} @ {self.unit_cost}"
+
+
+class CostConsumption(models.Model):
+    """
+    Quantity an invoice or loss took from one cost layer and the unit cost it
+    was charged at. Released back into the layer when the document returns
+    stock.
+    """
+    layer = models.ForeignKey(CostLayer, on_delete=models.CASCADE, related_name='consumptions')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='cost_consumptions')
+    source_type = models.CharField(max_length=20, choices=StockMovement.SOURCE_TYPE_CHOICES)
+    source_id = models.IntegerField(null=True, blank=True)
+    quantity = models.PositiveIntegerField()
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2)
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['source_type', 'source_id', 'product']),
+        ]
+
+    def __str__(self):
+        return f"{self.source_type} {self.source_id} - {self.quantity} @ {self.unit_cost}"
+
+
+class DocumentSequence(models.Model):
+    """
+    Next number of a document type (invoice, bill, estimate) in a year.
+    Allocated by inventory.numbering; `block_size` above 1 lets each worker
+    take that many numbers at once.
+    """
+    document_type = models.CharField(max_length=20)
+    year = models.IntegerField()
+    next_number = models.IntegerField(default=1)
+    block_size = models.IntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['document_type', 'year'], name='inventory_documentsequence_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.document_type} {self.year} - next {self.next_number}"
+
+
+class DocumentNumberReservation(models.Model):
+    """
+    A number shown to a user before the document is saved. Released and
+    expired reservations are handed out again by inventory.numbering.
+    """
+    STATUS_CHOICES = (
+        ("reserved", "Reserved"),
+        ("released", "Released"),
+        ("used", "Used"),
+    )
+    document_type = models.CharField(max_length=20)
+    year = models.IntegerField()
+    number = models.IntegerField()
+    document_number = models.CharField(max_length=50, unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="reserved")
+    reserved_by = models.ForeignKey(NewUser, on_delete=models.SET_NULL, null=True, blank=True, related_name="document_number_reservations")
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['document_type', 'year', 'status', 'number'], name='inventory_docnumber_free_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.document_number} - {self.status}"
@@ -0,0 +1,197 @@
+"""
+Document numbers.
+
+Invoices, bills and estimates are numbered per document type and year,
+e.g. INV-2026-00042 (see FORMATS; the year is the year the number is
+issued). The next number of each sequence is kept in a DocumentSequence
+row.
+
+allocate() is called inside the transaction that saves the document. It
+advances the sequence row with one UPDATE, which keeps the row locked (the
+database, on SQLite) until that transaction ends, so concurrent creations
+get distinct numbers and a rolled-back creation gives its number back: the
+numbers have no gaps. No aggregate over the document table is needed.
+
+With DocumentSequence.block_size above 1, a worker advances the row by a
+whole block and hands the rest of it out from memory once its transaction
+has committed, so the row is locked once per block instead of once per
+document. Numbers of a block that a worker does not use are lost when it
+exits, so leave block_size at 1 for sequences that must stay gap-free.
+
+When the sequence row stays locked by other transactions past the
+database's lock timeout, allocation raises SequenceBusy; the creation views
+answer 503 so the client retries.
+
+reserve() takes a number in advance, recorded as a DocumentNumberReservation
+for settings.DOCUMENT_NUMBER_RESERVATION_TTL seconds, so the UI can show it
+before the document is saved. The creation views pass it to use(), which
+marks it used; release() gives it back. Released and expired reservations
+are handed out again, lowest number first, before a sequence is advanced.
+"""
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, transaction as db_transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import DocumentSequence, DocumentNumberReservation
+
+
+FORMATS = {
+    'invoice': 'INV-{year}-{number:05d}',
+    'bill': 'BILL-{year}-{number:05d}',
+    'estimate': 'EST-{year}-{number:05d}',
+}
+DOCUMENT_TYPES = tuple(FORMATS)
+
+# free reservations tried per allocation before advancing the sequence
+RECLAIM_ATTEMPTS = 5
+
+# (document_type, year) -> [[next, end), ...] numbers of committed blocks not handed out yet
+_blocks = {}
+_blocks_lock = threading.Lock()
+
+
+class SequenceBusy(Exception):
+    """The sequence row could not be locked in time; the request can be retried."""
+
+
+def format_number(document_type, year, number):
+    return FORMATS[document_type].format(year=year, number=number)
+
+
+def _year(year):
+    return year or timezone.localdate().year
+
+
+def _sequence(document_type, year):
+    """(id, block_size) of the sequence row, created on first use."""
+    row = DocumentSequence.objects.filter(document_type=document_type, year=year).values_list('id', 'block_size').first()
+    if row is None:
+        try:
+            with db_transaction.atomic():
+                sequence = DocumentSequence.objects.create(document_type=document_type, year=year)
+            row = (sequence.id, sequence.block_size)
+        except IntegrityError:
+            row = DocumentSequence.objects.filter(document_type=document_type, year=year).values_list('id', 'block_size').get()
+    return row
+
+
+def _advance(sequence_id, count):
+    """First of `count` numbers taken from the sequence row, in the current transaction."""
+    try:
+        with db_transaction.atomic():
+            DocumentSequence.objects.filter(id=sequence_id).update(
+                next_number=F('next_number') + count, updated_at=timezone.now()
+            )
+            return DocumentSequence.objects.values_list('next_number', flat=True).get(id=sequence_id) - count
+    except OperationalError as e:
+        # lock wait timeouts and deadlocks; anything else is a real error
+        if 'lock' not in str(e).lower():
+            raise
+        raise SequenceBusy("Document numbers are busy; please retry.") from e
+
+
+def _from_block(key):
+    with _blocks_lock:
+        ranges = _blocks.get(key)
+        if not ranges:
+            return None
+        number = ranges[0][0]
+        ranges[0][0] += 1
+        if ranges[0][0] >= ranges[0][1]:
+            ranges.pop(0)
+        return number
+
+
+def _keep_block(key, start, end):
+    with _blocks_lock:
+        _blocks.setdefault(key, []).append([start, end])
+
+
+def _next_number(document_type, year):
+    key = (document_type, year)
+    number = _from_block(key)
+    if number is not None:
+        return number
+    sequence_id, block_size = _sequence(document_type, year)
+    number = _advance(sequence_id, max(block_size, 1))
+    if block_size > 1:
+        # only a committed block may be shared; a rolled-back one was never taken
+        db_transaction.on_commit(lambda: _keep_block(key, number + 1, number + block_size))
+    return number
+
+
+def _reclaim(document_type, year, **changes):
+    """The lowest released or expired reservation, updated with `changes`; None if there is none."""
+    free = Q(status='released') | Q(status='reserved', expires_at__lte=timezone.now())
+    candidates = DocumentNumberReservation.objects.filter(free, document_type=document_type, year=year)
+    for reservation_id in candidates.order_by('number').values_list('id', flat=True)[:RECLAIM_ATTEMPTS]:
+        # conditional update: another worker may take the same reservation first
+        if DocumentNumberReservation.objects.filter(free, id=reservation_id).update(updated_at=timezone.now(), **changes):
+            return DocumentNumberReservation.objects.get(id=reservation_id)
+    return None
+
+
+def allocate(document_type, year=None):
+    """The number for a document being saved in the current transaction."""
+    year = _year(year)
+    with db_transaction.atomic():
+        reservation = _reclaim(document_type, year, status='used')
+        if reservation is not None:
+            return reservation.document_number
+        return format_number(document_type, year, _next_number(document_type, year))
+
+
+def reserve(document_type, user, year=None):
+    """Reserve a number for `user` before the document is saved. Returns the DocumentNumberReservation."""
+    year = _year(year)
+    expires_at = timezone.now() + timedelta(seconds=settings.DOCUMENT_NUMBER_RESERVATION_TTL)
+    with db_transaction.atomic():
+        reservation = _reclaim(document_type, year, status='reserved', reserved_by=user, expires_at=expires_at)
+        if reservation is not None:
+            return reservation
+        number = _next_number(document_type, year)
+        return DocumentNumberReservation.objects.create(
+            document_type=document_type, year=year, number=number,
+            document_number=format_number(document_type, year, number),
+            reserved_by=user, expires_at=expires_at,
+        )
+
+
+def use(document_type, document_number, user):
+    """
+    Mark `user`'s reservation of `document_number` used. False when it is
+    not reserved by them (never reserved, released or handed out again).
+    """
+    return bool(DocumentNumberReservation.objects.filter(
+        document_type=document_type, document_number=document_number, status='reserved', reserved_by=user
+    ).update(status='used', updated_at=timezone.now()))
+
+
+def release(document_type, document_number, user):
+    """Give back `user`'s reservation of `document_number`. False when they do not hold it."""
+    return bool(DocumentNumberReservation.objects.filter(
+        document_type=document_type, document_number=document_number, status='reserved', reserved_by=user
+    ).update(status='released', updated_at=timezone.now()))
+
+
+def take(document_type, user, reserved_number=None, year=None):
+    """The reserved number when `user` still holds it, else a newly allocated one."""
+    if reserved_number and use(document_type, reserved_number, user):
+        return reserved_number
+    return allocate(document_type, year)
+
+
+def peek(document_type, year=None):
+    """The number the next allocation would most likely get; nothing is reserved."""
+    year = _year(year)
+    free = Q(status='released') | Q(status='reserved', expires_at__lte=timezone.now())
+    number = DocumentNumberReservation.objects.filter(free, document_type=document_type, year=year).order_by(
+        'number'
+    ).values_list('number', flat=True).first()
+    if number is None:
+        number = DocumentSequence.objects.filter(document_type=document_type, year=year).values_list(
+            'next_number', flat=True
+        ).first() or 1
+    return format_number(document_type, year, number)
@@ -0,0 +1,83 @@
+"""
+Low-stock and reorder alerts.
+
+Product.needs_reorder flags stocked products whose stock is at or below a
+non-zero reorder_level. Product.save() sets it and refresh() recomputes it
+in SQL after the F() stock updates of inventory.stock.adjust, so the flag
+follows every stock movement and the at-risk list is an indexed lookup.
+
+Days of cover divide the current stock by the product's sales velocity:
+the quantity invoiced over a trailing window, per day. The velocity of all
+listed products comes from one grouped query over InvoiceItem.
+"""
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from django.db.models import F, Q, Sum, Value, ExpressionWrapper, BooleanField, IntegerField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Product
+
+
+VELOCITY_WINDOW_DAYS = 30
+
+NEEDS_REORDER = ExpressionWrapper(
+    Q(product_type='product', reorder_level__gt=0, stock_quantity__lte=F('reorder_level')),
+    output_field=BooleanField(),
+)
+
+
+def refresh(product_ids=None):
+    """Recompute needs_reorder for the given products (all by default) with one UPDATE."""
+    products = Product.objects.all()
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+    return products.update(needs_reorder=NEEDS_REORDER)
+
+
+def _round(value):
+    return Decimal(value).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def at_risk(window_days=VELOCITY_WINDOW_DAYS, cover_days=None, as_of=None):
+    """
+    Active stocked products that need reordering, plus (with `cover_days`)
+    those whose stock will last fewer than `cover_days` days at the trailing
+    sales velocity. One dict per product, fewest days of cover first.
+    """
+    as_of = as_of or timezone.localdate()
+    since = as_of - timedelta(days=window_days)
+    sold = Coalesce(
+        Sum('invoiceitem__quantity', filter=Q(
+            invoiceitem__invoice__is_active=True,
+            invoiceitem__invoice__bill_date__date__gt=since,
+            invoiceitem__invoice__bill_date__date__lte=as_of,
+        )),
+        Value(0), output_field=IntegerField(),
+    )
+    condition = Q(needs_reorder=True)
+    if cover_days:
+        # stock / (sold / window_days) < cover_days, kept in integers
+        condition |= Q(sold__gt=0, stock_window__lt=F('sold') * cover_days)
+    products = Product.objects.filter(product_type='product', is_active=True).annotate(
+        sold=sold,
+        stock_window=ExpressionWrapper(Coalesce(F('stock_quantity'), 0) * window_days, output_field=IntegerField()),
+    ).filter(condition).values('id', 'product_name', 'sku', 'stock_quantity', 'reorder_level', 'needs_reorder', 'sold')
+
+    rows = []
+    for product in products:
+        stock_quantity = product['stock_quantity'] or 0
+        velocity = Decimal(product['sold']) / window_days
+        rows.append({
+            'product_id': product['id'],
+            'product_name': product['product_name'],
+            'sku': product['sku'],
+            'stock_quantity': stock_quantity,
+            'reorder_level': product['reorder_level'],
+            'needs_reorder': product['needs_reorder'],
+            'sold_in_window': product['sold'],
+            'daily_velocity': _round(velocity),
+            'days_of_cover': _round(stock_quantity / velocity) if velocity else None,
+            'shortfall': max((product['reorder_level'] or 0) - stock_quantity, 0),
+        })
+    rows.sort(key=lambda row: (row['days_of_cover'] is None, row['days_of_cover'] or 0, row['product_name']))
+    return rows
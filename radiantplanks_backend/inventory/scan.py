@@ -0,0 +1,93 @@
+"""
+Barcode / SKU scan lookups.
+
+Scanned codes resolve to a product and its current stock. A code is tried
+as a barcode first, then as a SKU. An in-process LRU of MAX_ENTRIES codes
+remembers which product (and which of its columns) a code resolved to, but
+never the product's data: every lookup reads the rows of the cached ids by
+primary key, so stock and edits made by other workers show at once, and a
+miss is one query on the indexed barcode and (unique) SKU columns for all
+the codes missed in a batch.
+
+A cached entry is used only while the row still carries the code in the
+same column. One matched by SKU is also checked against the barcode index
+in the same query, since a barcode added later takes precedence. Entries
+that fail either check are resolved again like a miss.
+"""
+import threading
+from collections import OrderedDict
+from django.db.models import Q
+from .models import Product
+
+
+MAX_ENTRIES = 4096
+
+FIELDS = [
+    'id', 'product_name', 'sku', 'barcode', 'product_type', 'stock_quantity',
+    'reorder_level', 'tile_area', 'no_of_tiles',
+]
+
+_lock = threading.Lock()
+# code -> (product id, 'barcode' or 'sku')
+_entries = OrderedDict()
+
+
+def _fetch(codes):
+    """{code: (product dict, matched column)} for the codes found, with one indexed query."""
+    products = Product.objects.filter(Q(barcode__in=codes) | Q(sku__in=codes), is_active=True).order_by('id').values(*FIELDS)
+    by_barcode, by_sku = {}, {}
+    for product in products:
+        by_barcode.setdefault(product['barcode'], product)
+        by_sku.setdefault(product['sku'], product)
+    found = {}
+    for code in codes:
+        if code in by_barcode:
+            found[code] = (by_barcode[code], 'barcode')
+        elif code in by_sku:
+            found[code] = (by_sku[code], 'sku')
+    return found
+
+
+def _cached(cached):
+    """{code: product dict} for the cached entries that still hold, read by primary key."""
+    sku_codes = [code for code, (_, column) in cached.items() if column == 'sku']
+    products = Product.objects.filter(
+        Q(id__in={product_id for product_id, _ in cached.values()}) | Q(barcode__in=sku_codes), is_active=True
+    ).order_by('id').values(*FIELDS)
+    by_id, barcodes = {}, set()
+    for product in products:
+        by_id[product['id']] = product
+        barcodes.add(product['barcode'])
+    results = {}
+    for code, (product_id, column) in cached.items():
+        product = by_id.get(product_id)
+        if product is not None and product[column] == code and not (column == 'sku' and code in barcodes):
+            results[code] = product
+    return results
+
+
+def lookup(codes):
+    """Resolve scanned codes; returns {code: product dict or None} in the order given."""
+    codes = [str(code).strip() for code in codes]
+    with _lock:
+        cached = {}
+        for code in dict.fromkeys(codes):
+            if code in _entries:
+                _entries.move_to_end(code)
+                cached[code] = _entries[code]
+    results = _cached(cached) if cached else {}
+    missing = [code for code in dict.fromkeys(codes) if code and code not in results]
+    if missing:
+        found = _fetch(missing)
+        with _lock:
+            for code in missing:
+                if code in found:
+                    product, column = found[code]
+                    _entries[code] = (product['id'], column)
+                    _entries.move_to_end(code)
+                else:
+                    _entries.pop(code, None)
+            while len(_entries) > MAX_ENTRIES:
+                _entries.popitem(last=False)
+        results.update({code: product for code, (product, _) in found.items()})
+    return {code: results.get(code) for code in codes}
@@ -0,0 +1,107 @@
+"""
+Product search.
+
+On SQLite, products are indexed in the FTS5 table inventory_product_fts:
+name, SKU, barcode, purchase description, tags and category name. The
+rowid of each entry is the product id. Triggers created by migration 0042
+keep the index in step with inserts, deletes, edits of the indexed columns
+and category renames. Stock and price updates do not touch it.
+`rebuild_product_search` repopulates it from scratch.
+
+Every word of a query is matched as a prefix, so typeahead works from the
+first characters typed. Results are ranked by the table's `rank` (bm25 with
+the name weighted highest, configured by the migration). Ranking touches
+every match, so a query is ranked among its first CANDIDATE_LIMIT matches
+only: exact for specific queries, and bounded in time for one- or
+two-letter prefixes that match most of the catalog. On other databases
+search falls back to case-insensitive substring matching, ordered by name.
+"""
+import re
+from django.db import connection
+from django.db.models import Q
+from .models import Product
+
+
+FTS_TABLE = 'inventory_product_fts'
+
+CANDIDATE_LIMIT = 1000
+
+REBUILD_SQL = [
+    f"DELETE FROM {FTS_TABLE}",
+    f"""
+    INSERT INTO {FTS_TABLE}(rowid, product_name, sku, barcode, purchase_description, tags, category_name)
+    SELECT p.id, p.product_name, p.sku, p.barcode, p.purchase_description, p.tags, c.name
+    FROM inventory_product p LEFT JOIN inventory_category c ON c.id = p.category_id_id
+    """,
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')",
+]
+
+FIELDS = ['product_name', 'sku', 'barcode', 'purchase_description', 'tags', 'category_id__name']
+
+
+def uses_fts():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(query):
+    """FTS5 query matching every word of `query` as a prefix; None when it has no words."""
+    words = re.findall(r'\w+', query or '')
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _ranked_ids(expression, product_type, limit):
+    sql = f"""
+        SELECT p.id
+        FROM (SELECT rowid, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s LIMIT %s) f
+        JOIN inventory_product p ON p.id = f.rowid
+        WHERE p.is_active = 1
+    """
+    params = [expression, CANDIDATE_LIMIT]
+    if product_type:
+        sql += " AND p.product_type = %s"
+        params.append(product_type)
+    sql += " ORDER BY f.rank LIMIT %s"
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _fallback_ids(query, product_type, limit):
+    products = Product.objects.filter(is_active=True)
+    if product_type:
+        products = products.filter(product_type=product_type)
+    for word in re.findall(r'\w+', query):
+        condition = Q()
+        for field in FIELDS:
+            condition |= Q(**{f'{field}__icontains': word})
+        products = products.filter(condition)
+    return list(products.order_by('product_name').values_list('id', flat=True)[:limit])
+
+
+def search(query, product_type=None, limit=20):
+    """Active products matching `query`, best match first, as dicts."""
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    ids = _ranked_ids(expression, product_type, limit) if uses_fts() else _fallback_ids(query, product_type, limit)
+    rows = {
+        row['id']: row
+        for row in Product.objects.filter(id__in=ids).values(
+            'id', 'product_name', 'sku', 'barcode', 'product_type', 'stock_quantity',
+            'purchase_price', 'tile_area', 'category_id__name',
+        )
+    }
+    return [rows[product_id] for product_id in ids if product_id in rows]
+
+
+def rebuild():
+    """Repopulate the search index from the product table. Returns the number of indexed products."""
+    if not uses_fts():
+        return 0
+    with connection.cursor() as cursor:
+        for statement in REBUILD_SQL:
+            cursor.execute(statement)
+    return Product.objects.count()
@@ -0,0 +1,343 @@
+"""
+Stock movement ledger.
+
+Every change of Product.stock_quantity made by the invoice, bill, loss and
+product flows is also recorded as a StockMovement. `running_quantity` holds
+the product's stock after each movement in (date, id) order, so the stock of
+any product on any day is one indexed lookup. A back-dated movement shifts
+the running quantity of the product's later movements.
+
+Invoices change stock through adjust()/reserve(), which lock the product
+rows and refuse to take any product below zero.
+
+History reports and drill-downs read the movements with range scans on
+(product, date) instead of recomputing stock from the source documents.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from datetime import date as date_type, datetime
+from django.db import transaction as db_transaction
+from django.db.models import F, Q, Case, When, Value, OuterRef, Subquery, IntegerField
+from django.utils import timezone
+from .models import Product, StockMovement, InvoiceItem, BillItems, LostProduct
+from . import costing, reorder
+
+
+def movement_date(value=None):
+    """Normalize a document date (date, datetime or ISO string) to the movement date; today when empty."""
+    if not value:
+        return timezone.localdate()
+    if isinstance(value, datetime):
+        return timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+    if isinstance(value, date_type):
+        return value
+    parsed = StockMovement._meta.get_field('created_date').to_python(value)
+    return movement_date(parsed)
+
+
+def _per_product(values, key='product_id'):
+    """CASE expression giving each product id in `values` its value (0 for other rows)."""
+    return Case(
+        *[When(**{key: product_id}, then=Value(value)) for product_id, value in values.items()],
+        default=Value(0), output_field=IntegerField(),
+    )
+
+
+def record(product, quantity, source_type, source_id=None, date=None, unit_cost=None):
+    """
+    Record a signed stock change of `product` (an instance or id). Zero
+    changes are skipped. Returns the created StockMovement or None.
+    """
+    product_id = getattr(product, 'pk', product)
+    movements = record_many({product_id: quantity}, source_type, source_id, date, {product_id: unit_cost})
+    return movements[0] if movements else None
+
+
+class InvalidStockChange(ValueError):
+    """Raised for a stock change that cannot be applied: a fractional quantity or an unknown product."""
+
+
+def whole_quantity(product_id, quantity):
+    """`quantity` as an int. Stock is counted in whole tiles, so fractions raise InvalidStockChange."""
+    try:
+        value = Decimal(str(quantity))
+    except ArithmeticError:
+        raise InvalidStockChange(f"Invalid quantity {quantity!r} for product {product_id}.")
+    if not value.is_finite() or value != value.to_integral_value():
+        raise InvalidStockChange(
+            f"Quantity {quantity} for product {product_id} is not a whole number of tiles."
+        )
+    return int(value)
+
+
+def _whole_changes(changes):
+    changes = {product_id: whole_quantity(product_id, quantity) for product_id, quantity in changes.items()}
+    return {product_id: quantity for product_id, quantity in changes.items() if quantity}
+
+
+def record_many(changes, source_type, source_id=None, date=None, unit_costs=None):
+    """
+    Record signed stock changes {product_id: quantity} of one document dated
+    `date`, with three statements whatever the number of products: one
+    read of the running quantities before the date, one shift of the later
+    movements and one bulk insert. Returns the created movements. Raises
+    InvalidStockChange for fractional quantities.
+    """
+    changes = _whole_changes(changes)
+    if not changes:
+        return []
+    unit_costs = unit_costs or {}
+    day = movement_date(date)
+    with db_transaction.atomic():
+        previous = dict(Product.objects.filter(id__in=changes).annotate(previous=Subquery(
+            StockMovement.objects.filter(product=OuterRef('pk'), date__lte=day)
+            .order_by('-date', '-id').values('running_quantity')[:1]
+        )).values_list('id', 'previous'))
+        StockMovement.objects.filter(product_id__in=changes, date__gt=day).update(
+            running_quantity=F('running_quantity') + _per_product(changes)
+        )
+        return StockMovement.objects.bulk_create([
+            StockMovement(
+                product_id=product_id,
+                date=day,
+                quantity=quantity,
+                source_type=source_type,
+                source_id=source_id,
+                unit_cost=unit_costs.get(product_id),
+                running_quantity=(previous.get(product_id) or 0) + quantity,
+            )
+            for product_id, quantity in sorted(changes.items())
+        ])
+
+
+def record_openings(openings):
+    """
+    Record the opening stock of products that have no movements yet, with
+    one bulk insert. `openings` holds (product, quantity, date, unit_cost)
+    tuples; zero quantities are skipped. Returns the created movements.
+    """
+    movements = [
+        StockMovement(
+            product_id=getattr(product, 'pk', product),
+            date=movement_date(date),
+            quantity=quantity,
+            source_type='opening',
+            source_id=getattr(product, 'pk', product),
+            unit_cost=unit_cost,
+            running_quantity=quantity,
+        )
+        for product, quantity, date, unit_cost in openings
+        if quantity
+    ]
+    return StockMovement.objects.bulk_create(movements, batch_size=1000)
+
+
+class InsufficientStock(ValueError):
+    """Raised by adjust() with every line whose product lacks stock, as dicts in `shortages`."""
+    def __init__(self, shortages):
+        self.shortages = shortages
+        names = ", ".join(shortage['product_name'] for shortage in shortages)
+        super().__init__(f"Insufficient stock for product {names}.")
+
+
+def adjust(changes, source_type, source_id=None, date=None, receipts=None):
+    """
+    Apply signed stock changes {product_id: quantity} for one document and
+    record their movements. The product rows are locked in id order, so
+    concurrent documents touching the same products queue instead of
+    deadlocking. Every decrement is checked against the locked stock before
+    anything is written, and all changes are applied by one F() update
+    guarded per decrement, so stock never goes below zero even on databases
+    without row locks. Decrements
+    consume cost layers and increments release them (inventory.costing).
+    Increments of products listed in `receipts`, (product_id, quantity,
+    unit_cost) tuples of newly received stock such as bill lines, become new
+    cost layers at their unit costs instead.
+    Raises InsufficientStock listing all short lines, or InvalidStockChange
+    for a fractional quantity or an unknown product; nothing is changed
+    then.
+    """
+    receipts = [
+        (int(product_id), whole_quantity(product_id, quantity), unit_cost)
+        for product_id, quantity, unit_cost in receipts or []
+    ]
+    received = {product_id for product_id, _, _ in receipts}
+    changes = _whole_changes(changes)
+    if not changes:
+        return
+    with db_transaction.atomic():
+        locked = Product.objects.select_for_update().filter(id__in=changes).order_by('id')
+        products = {product.id: product for product in locked.only('id', 'product_name', 'stock_quantity', 'purchase_price')}
+        unknown = sorted(set(changes) - set(products))
+        if unknown:
+            raise InvalidStockChange(f"Product {', '.join(map(str, unknown))} does not exist.")
+
+        def shortage(product):
+            return {
+                'product_id': product.id,
+                'product_name': product.product_name,
+                'requested': -changes[product.id],
+                'available': product.stock_quantity or 0,
+            }
+
+        shortages = [
+            shortage(product) for product in products.values()
+            if (product.stock_quantity or 0) + changes[product.id] < 0
+        ]
+        if shortages:
+            raise InsufficientStock(shortages)
+
+        # one UPDATE for all products; each decrement only matches while the stock covers it
+        guard = Q()
+        for product_id, quantity in changes.items():
+            guard |= Q(id=product_id, stock_quantity__gte=-quantity) if quantity < 0 else Q(id=product_id)
+        updated = Product.objects.filter(guard).update(
+            stock_quantity=F('stock_quantity') + _per_product(changes, key='id'), updated_date=timezone.now()
+        )
+        if updated != len(changes):
+            for product in products.values():
+                product.refresh_from_db(fields=['stock_quantity'])
+            raise InsufficientStock([
+                shortage(product) for product in products.values()
+                if (product.stock_quantity or 0) + changes[product.id] < 0
+            ])
+        reorder.refresh(list(changes))
+
+        costing.consume({product_id: -quantity for product_id, quantity in changes.items() if quantity < 0},
+                        source_type, source_id, date)
+        costing.release({product_id: quantity for product_id, quantity in changes.items()
+                         if quantity > 0 and product_id not in received}, source_type, source_id, date)
+        costing.receive_many([(product_id, quantity, unit_cost, source_id, date)
+                              for product_id, quantity, unit_cost in receipts], source_type)
+        unit_costs = costing.document_unit_costs(source_type, source_id)
+        unit_costs.update(_average_unit_costs(receipts))
+        record_many(changes, source_type, source_id, date, {
+            product_id: Decimal(unit_costs.get(product_id, products[product_id].purchase_price)).quantize(Decimal('0.01'))
+            for product_id in changes
+        })
+        costing.revalue(list(changes))
+
+
+def _average_unit_costs(receipts):
+    """{product_id: quantity-weighted unit cost} of (product_id, quantity, unit_cost) receipts."""
+    totals = defaultdict(lambda: [0, Decimal('0')])
+    for product_id, quantity, unit_cost in receipts:
+        totals[product_id][0] += quantity
+        totals[product_id][1] += quantity * Decimal(str(unit_cost or 0))
+    return {product_id: cost / quantity for product_id, (quantity, cost) in totals.items() if quantity}
+
+
+def reserve(quantities, source_type, source_id=None, date=None):
+    """Take {product_id: quantity} out of stock for a document; see adjust()."""
+    adjust({product_id: -quantity for product_id, quantity in quantities.items()}, source_type, source_id, date)
+
+
+def _after(day, movement_id):
+    """Movements ordered after position (day, movement_id)."""
+    return Q(date__gt=day) | Q(date=day, id__gt=movement_id)
+
+
+def redate(source_type, source_id, date):
+    """Move the movements of one source document to a new date, keeping running quantities in step."""
+    day = movement_date(date)
+    with db_transaction.atomic():
+        moved = StockMovement.objects.filter(source_type=source_type, source_id=source_id).exclude(date=day)
+        for movement in moved.order_by('id'):
+            siblings = StockMovement.objects.filter(product_id=movement.product_id)
+            siblings.filter(_after(movement.date, movement.id)).update(
+                running_quantity=F('running_quantity') - movement.quantity
+            )
+            siblings.filter(_after(day, movement.id)).update(
+                running_quantity=F('running_quantity') + movement.quantity
+            )
+            previous = siblings.filter(
+                Q(date__lt=day) | Q(date=day, id__lt=movement.id)
+            ).exclude(id=movement.id).order_by('-date', '-id').values_list('running_quantity', flat=True).first()
+            StockMovement.objects.filter(id=movement.id).update(
+                date=day, running_quantity=(previous or 0) + movement.quantity
+            )
+
+
+def quantities_as_of(day, products=None):
+    """{product_id: stock at the end of `day`} for a Product queryset (all stocked products by default). One query."""
+    if products is None:
+        products = Product.objects.filter(product_type='product')
+    latest = StockMovement.objects.filter(
+        product=OuterRef('pk'), date__lte=day
+    ).order_by('-date', '-id').values('running_quantity')[:1]
+    return {
+        product_id: quantity or 0
+        for product_id, quantity in products.annotate(quantity_as_of=Subquery(latest)).values_list('id', 'quantity_as_of')
+    }
+
+
+def movements(start_date=None, end_date=None, product=None):
+    """Movements in a date range (optionally for one product), oldest first, with their product joined."""
+    queryset = StockMovement.objects.select_related('product')
+    if product is not None:
+        queryset = queryset.filter(product=product)
+    if start_date:
+        queryset = queryset.filter(date__gte=start_date)
+    if end_date:
+        queryset = queryset.filter(date__lte=end_date)
+    return queryset.order_by('date', 'id')
+
+
+def _document_movements(products):
+    """Unsaved movements per product id rebuilt from bills, invoices and losses."""
+    rows = defaultdict(list)
+    bill_items = BillItems.objects.filter(product__in=products).values_list(
+        'product_id', 'bill__bill_date', 'quantity', 'bill_id', 'unit_price'
+    )
+    for product_id, day, quantity, bill_id, unit_price in bill_items.iterator():
+        rows[product_id].append(('bill', movement_date(day), quantity, bill_id, unit_price))
+    invoice_items = InvoiceItem.objects.filter(product__in=products).values_list(
+        'product_id', 'invoice__bill_date', 'quantity', 'invoice_id'
+    )
+    for product_id, day, quantity, invoice_id in invoice_items.iterator():
+        rows[product_id].append(('invoice', movement_date(day), -quantity, invoice_id, None))
+    losses = LostProduct.objects.filter(product__in=products).values_list(
+        'product_id', 'loss_date', 'quantity_lost', 'id', 'unit_cost'
+    )
+    for product_id, day, quantity, loss_id, unit_cost in losses.iterator():
+        rows[product_id].append(('loss', movement_date(day), -quantity, loss_id, unit_cost))
+    return rows
+
+
+def rebuild(product_ids=None):
+    """
+    Replace the movements of stocked products with ones rebuilt from their
+    bills, invoices and losses. Whatever the documents do not explain of the
+    current stock_quantity (initial stock, manual edits) becomes an opening
+    movement before the first document. Returns the number of rows written.
+    """
+    products = Product.objects.filter(product_type='product')
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+    documents = _document_movements(products)
+
+    new_rows = []
+    for product_id, stock_quantity, created_date in products.values_list('id', 'stock_quantity', 'created_date'):
+        product_rows = sorted(documents.get(product_id, []), key=lambda row: row[1])
+        opening = (stock_quantity or 0) - sum(row[2] for row in product_rows)
+        if opening:
+            first_day = min([movement_date(created_date)] + [row[1] for row in product_rows])
+            product_rows.insert(0, ('opening', first_day, opening, None, None))
+
+        running_quantity = 0
+        for source_type, day, quantity, source_id, unit_cost in product_rows:
+            running_quantity += quantity
+            new_rows.append(StockMovement(
+                product_id=product_id,
+                date=day,
+                quantity=quantity,
+                source_type=source_type,
+                source_id=source_id,
+                unit_cost=unit_cost,
+                running_quantity=running_quantity,
+            ))
+
+    with db_transaction.atomic():
+        StockMovement.objects.filter(product__in=products).delete()
+        StockMovement.objects.bulk_create(new_rows, batch_size=1000)
+    return len(new_rows)
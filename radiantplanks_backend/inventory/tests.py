@@ -1,3 +1,349 @@
-from django.test import TestCase
+import io
+import threading
+from unittest import mock
+from datetime import date, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import connections, OperationalError
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+from accounts.models import Account, TransactionLine, IdempotencyRecord
+from accounts import integrity, snapshots
+from authentication.models import NewUser
+from customers.models import Customer, Vendor
+from radiantplanks_backend.idempotency import idempotent
+from .models import Product, StockMovement, InvoiceCostBreakdown, Invoice, Bill, CostLayer
+from . import numbering, stock, views
 
-# Create your tests here.
+
+def invoice_payload(customer, *lines):
+    total = sum(quantity * 5 for _, quantity in lines)
+    return {
+        'customer_id': customer.customer_id,
+        'sum_amount': str(total), 'total_amount': str(total),
+        'is_taxed': False, 'tax_percentage': '0', 'tax_amount': '0',
+        'bill_date': '2024-01-03', 'due_date': '2024-02-01',
+        'items': [
+            {'product_id': product.id, 'quantity': quantity, 'unit_price': 5, 'unit_type': 'box'}
+            for product, quantity in lines
+        ],
+    }
+
+
+class StockFixtureMixin:
+    def setUp(self):
+        Account.create_default_accounts()
+        self.user = NewUser(email='sales@example.com', username='sales', user_type='admin')
+        self.user.set_password('x')
+        self.user.save()
+        self.token = self.user.generate_jwt(settings.SECRET_KEY)
+        self.customer = Customer.objects.create(first_name='a', last_name='b', business_name='Cust', email='c@example.com')
+
+    def client_for_user(self):
+        return APIClient(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def stocked_product(self, name, quantity):
+        product = Product.objects.create(product_name=name, stock_quantity=0, purchase_price=Decimal('2.00'), created_by=self.user)
+        stock.adjust({product.id: quantity}, 'opening', product.id)
+        return product
+
+
+class StockReservationTests(StockFixtureMixin, TestCase):
+    def test_reports_every_short_line(self):
+        tile = self.stocked_product('Tile', 5)
+        grout = self.stocked_product('Grout', 1)
+        response = self.client_for_user().post(
+            '/inventory/invoice/create/', invoice_payload(self.customer, (tile, 6), (grout, 2)), format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            sorted((row['product_name'], row['requested'], row['available']) for row in response.data['insufficient_stock']),
+            [('Grout', 2, 1), ('Tile', 6, 5)],
+        )
+        self.assertEqual(Product.objects.get(id=tile.id).stock_quantity, 5)
+        self.assertEqual(Product.objects.get(id=grout.id).stock_quantity, 1)
+
+    def test_guard_keeps_stock_non_negative(self):
+        tile = self.stocked_product('Tile', 3)
+        with self.assertRaises(stock.InsufficientStock):
+            stock.reserve({tile.id: 4}, 'invoice', 1)
+        stock.reserve({tile.id: 3}, 'invoice', 1)
+        self.assertEqual(Product.objects.get(id=tile.id).stock_quantity, 0)
+
+    def test_fractional_quantities_and_unknown_products_are_rejected(self):
+        tile = self.stocked_product('Tile', 5)
+        with self.assertRaises(stock.InvalidStockChange):
+            stock.reserve({tile.id: 0.5}, 'invoice', 1)
+        with self.assertRaises(stock.InvalidStockChange):
+            stock.adjust({tile.id + 1000: 1}, 'adjustment', 1)
+        payload = invoice_payload(self.customer, (tile, 2))
+        payload['items'][0]['quantity'] = 2.5
+        payload['sum_amount'] = payload['total_amount'] = '12.50'
+        response = self.client_for_user().post('/inventory/invoice/create/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('not a whole number', response.data['detail'])
+        self.assertEqual(Product.objects.get(id=tile.id).stock_quantity, 5)
+        self.assertFalse(Invoice.objects.exists())
+
+
+class BillReceiptTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.vendor = Vendor.objects.create(first_name='a', last_name='b', business_name='Vend', email='v@example.com',
+                                            phone='1', mobile_number='1')
+
+    def test_bill_lines_become_layers_at_their_prices(self):
+        tile = self.stocked_product('Tile', 10)
+        response = self.client_for_user().post('/inventory/bill/create/', {
+            'vendor_id': self.vendor.vendor_id, 'bill_date': '2024-01-02', 'due_date': '2024-02-01', 'total_amount': '50',
+            'items': [
+                {'product_id': tile.id, 'quantity': 10, 'unit_price': 3, 'unit_type': 'box'},
+                {'product_id': tile.id, 'quantity': 5, 'unit_price': 4, 'unit_type': 'box'},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        bill_id = response.data['bill_id']
+        self.assertEqual(Product.objects.get(id=tile.id).stock_quantity, 25)
+        self.assertEqual(
+            sorted(CostLayer.objects.filter(source_type='bill', source_id=bill_id).values_list('quantity', 'unit_cost')),
+            [(5, Decimal('4.00')), (10, Decimal('3.00'))],
+        )
+        movement = StockMovement.objects.get(source_type='bill', source_id=bill_id)
+        self.assertEqual((movement.quantity, movement.unit_cost), (15, Decimal('3.33')))
+
+    def test_total_must_match_the_lines(self):
+        tile = self.stocked_product('Tile', 10)
+        response = self.client_for_user().post('/inventory/bill/create/', {
+            'vendor_id': self.vendor.vendor_id, 'bill_date': '2024-01-02', 'due_date': '2024-02-01', 'total_amount': '49',
+            'items': [{'product_id': tile.id, 'quantity': 10, 'unit_price': 5, 'unit_type': 'box'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((response.data['total_amount'], response.data['expected_total']), (Decimal('49.00'), Decimal('50.00')))
+        self.assertEqual(Product.objects.get(id=tile.id).stock_quantity, 10)
+        self.assertFalse(Bill.objects.exists())
+
+
+class InvoiceTotalTests(StockFixtureMixin, TestCase):
+    def test_total_must_match_items_and_tax(self):
+        tile = self.stocked_product('Tile', 10)
+        client = self.client_for_user()
+        payload = dict(invoice_payload(self.customer, (tile, 3)), is_taxed=True, tax_percentage='10', tax_amount='1.5')
+        response = client.post('/inventory/invoice/create/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((response.data['total_amount'], response.data['expected_total']), (Decimal('15.00'), Decimal('16.50')))
+        self.assertEqual(Product.objects.get(id=tile.id).stock_quantity, 10)
+        self.assertFalse(Invoice.objects.exists())
+
+        response = client.post('/inventory/invoice/create/', dict(payload, total_amount='16.50'), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data['invoice_number'].endswith('-00001'))
+
+
+class ScanLookupTests(StockFixtureMixin, TestCase):
+    def test_cached_scan_follows_changes_from_other_workers(self):
+        tile = self.stocked_product('Tile', 5)
+        Product.objects.filter(id=tile.id).update(barcode='0042')
+        client = self.client_for_user()
+        self.assertEqual(client.get('/inventory/scan/?code=0042').data['stock_quantity'], 5)
+        # queryset updates notify nobody, as with a sale or an edit posted by another process
+        Product.objects.filter(id=tile.id).update(stock_quantity=3)
+        response = client.post('/inventory/scan/', {'codes': ['0042', 'missing']}, format='json')
+        self.assertEqual(response.data['results']['0042']['stock_quantity'], 3)
+        self.assertEqual(response.data['not_found'], ['missing'])
+        Product.objects.filter(id=tile.id).update(barcode='0043')
+        self.assertEqual(client.get('/inventory/scan/?code=0042').status_code, 404)
+
+
+class InvoiceLedgerTests(StockFixtureMixin, TestCase):
+    def test_compaction_keeps_balances_and_breakdown(self):
+        tile = self.stocked_product('Tile', 10)
+        grout = self.stocked_product('Grout', 10)
+        with override_settings(INVOICE_POSTING_MODE='itemized'):
+            response = self.client_for_user().post(
+                '/inventory/invoice/create/', invoice_payload(self.customer, (tile, 2), (grout, 3)), format='json'
+            )
+        invoice_id = response.data['invoice_id']
+        InvoiceCostBreakdown.objects.filter(invoice_id=invoice_id).delete()
+        balances = dict(Account.objects.values_list('id', 'balance'))
+        snapshot_balances = snapshots.net_balances()
+        integrity.verify(full=True)
+
+        call_command('compact_invoice_ledger', stdout=io.StringIO())
+
+        lines = TransactionLine.objects.filter(invoice_id=invoice_id, is_active=True)
+        self.assertEqual(lines.count(), 4)
+        # the itemized lines are kept, retired
+        self.assertEqual(TransactionLine.objects.filter(invoice_id=invoice_id, is_active=False).count(), 6)
+        report = integrity.verify()
+        self.assertEqual((report['mode'], report['unbalanced_transactions'], report['drifted_accounts']), ('incremental', [], []))
+        self.assertEqual(dict(Account.objects.values_list('id', 'balance')), balances)
+        self.assertEqual(snapshots.net_balances(), snapshot_balances)
+        breakdown = InvoiceCostBreakdown.objects.filter(invoice_id=invoice_id).order_by('product_id')
+        self.assertEqual([(row.quantity, row.cost, row.revenue) for row in breakdown],
+                         [(2, Decimal('4.00'), Decimal('10.00')), (3, Decimal('6.00'), Decimal('15.00'))])
+
+
+    def test_update_posts_only_the_difference(self):
+        tile = self.stocked_product('Tile', 10)
+        client = self.client_for_user()
+        invoice_id = client.post('/inventory/invoice/create/', invoice_payload(self.customer, (tile, 2)), format='json').data['invoice_id']
+        lines = TransactionLine.objects.filter(invoice_id=invoice_id)
+
+        client.put(f'/inventory/invoice/update/{invoice_id}/', invoice_payload(self.customer, (tile, 2)), format='json')
+        self.assertEqual(lines.count(), 4)
+
+        response = client.put(f'/inventory/invoice/update/{invoice_id}/', invoice_payload(self.customer, (tile, 3)), format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(lines.count(), 8)
+        self.assertFalse(lines.filter(is_active=False).exists())
+        self.assertEqual(Account.objects.get(code='COGS-001').balance, Decimal('6.00'))
+        self.assertEqual(Account.objects.get(code='AR-001').balance, Decimal('15.00'))
+
+
+
+class IdempotencyKeyTests(StockFixtureMixin, TestCase):
+    def test_retry_replays_the_first_response(self):
+        tile = self.stocked_product('Tile', 10)
+        client = self.client_for_user()
+        first = client.post('/inventory/invoice/create/', invoice_payload(self.customer, (tile, 2)),
+                            format='json', HTTP_IDEMPOTENCY_KEY='retry-1')
+        retry = client.post('/inventory/invoice/create/', invoice_payload(self.customer, (tile, 2)),
+                            format='json', HTTP_IDEMPOTENCY_KEY='retry-1')
+        self.assertEqual(retry.status_code, first.status_code)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Product.objects.get(id=tile.id).stock_quantity, 8)
+
+        other = client.post('/inventory/invoice/create/', invoice_payload(self.customer, (tile, 3)),
+                            format='json', HTTP_IDEMPOTENCY_KEY='retry-1')
+        self.assertEqual(other.status_code, 422)
+
+    def test_expired_pending_claim_is_taken_over(self):
+        tile = self.stocked_product('Tile', 10)
+        # left behind by a worker that died before storing its response
+        IdempotencyRecord.objects.create(key=f'{self.user.pk}:retry-2', request_hash='x',
+                                         expires_at=timezone.now() - timedelta(seconds=1))
+        response = self.client_for_user().post('/inventory/invoice/create/', invoice_payload(self.customer, (tile, 2)),
+                                               format='json', HTTP_IDEMPOTENCY_KEY='retry-2')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(IdempotencyRecord.objects.get(key=f'{self.user.pk}:retry-2').status_code, 201)
+
+    def test_failed_request_is_not_replayed(self):
+        tile = self.stocked_product('Tile', 10)
+        client = self.client_for_user()
+        invoice_id = client.post('/inventory/invoice/create/', invoice_payload(self.customer, (tile, 2)),
+                                 format='json').data['invoice_id']
+        payment = {
+            'customer_id': self.customer.customer_id, 'payment_amount': '10', 'payment_date': '2024-01-05',
+            'credit_account_id': Account.objects.get(code='CASH-001').id,
+            'invoices': [{'invoice_id': invoice_id, 'allocated_amount': '10'}],
+        }
+        post_transaction = views.posting.post_transaction
+        attempts = []
+
+        def locked_once(*args, **kwargs):
+            # the first attempt loses a lock wait; the retry must run the view again
+            attempts.append(args)
+            if len(attempts) == 1:
+                raise OperationalError('database is locked')
+            return post_transaction(*args, **kwargs)
+
+        with mock.patch.object(views.posting, 'post_transaction', side_effect=locked_once):
+            failed = client.patch('/inventory/invoice/makepaid/', payment, format='json', HTTP_IDEMPOTENCY_KEY='pay-1')
+            self.assertEqual(failed.status_code, 500)
+            self.assertFalse(IdempotencyRecord.objects.exists())
+            retry = client.patch('/inventory/invoice/makepaid/', payment, format='json', HTTP_IDEMPOTENCY_KEY='pay-1')
+        self.assertEqual(retry.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', retry)
+        self.assertEqual(Invoice.objects.get(id=invoice_id).payment_status, 'paid')
+
+    def test_replay_renders_the_same_content(self):
+        class QuoteView(APIView):
+            @idempotent
+            def post(self, request):
+                return Response({'total': Decimal('12.50'), 'valid_until': date(2024, 2, 1)}, status=status.HTTP_201_CREATED)
+
+        def post():
+            request = APIRequestFactory().post('/quote/', {}, format='json', HTTP_IDEMPOTENCY_KEY='quote-1')
+            force_authenticate(request, user=self.user)
+            return QuoteView.as_view()(request).render()
+
+        first, replay = post(), post()
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual((replay.status_code, replay['Content-Type'], replay.content),
+                         (first.status_code, first['Content-Type'], first.content))
+
+
+
+class DocumentNumberTests(StockFixtureMixin, TestCase):
+    def test_reserved_and_released_numbers_leave_no_gaps(self):
+        tile = self.stocked_product('Tile', 10)
+        client = self.client_for_user()
+        first = client.post('/inventory/numbers/invoice/reserve/').data['document_number']
+        second = client.post('/inventory/numbers/invoice/reserve/').data['document_number']
+        self.assertNotEqual(first, second)
+
+        payload = dict(invoice_payload(self.customer, (tile, 1)), invoice_number=second)
+        self.assertEqual(client.post('/inventory/invoice/create/', payload, format='json').data['invoice_number'], second)
+        self.assertEqual(client.post('/inventory/numbers/invoice/release/', {'document_number': first}, format='json').status_code, 200)
+        response = client.post('/inventory/invoice/create/', invoice_payload(self.customer, (tile, 1)), format='json')
+        self.assertEqual(response.data['invoice_number'], first)
+        self.assertEqual(sorted(Invoice.objects.values_list('invoice_number', flat=True)), sorted([first, second]))
+
+    def test_locked_sequence_asks_the_client_to_retry(self):
+        tile = self.stocked_product('Tile', 10)
+        client = self.client_for_user()
+        sequences = numbering.DocumentSequence.objects
+        filter_sequences = sequences.filter
+
+        def locked_row(*args, **kwargs):
+            # the UPDATE of the sequence row waits on another transaction's lock until it times out
+            if 'id' in kwargs:
+                raise OperationalError('database is locked')
+            return filter_sequences(*args, **kwargs)
+
+        with mock.patch.object(sequences, 'filter', side_effect=locked_row):
+            response = client.post('/inventory/invoice/create/', invoice_payload(self.customer, (tile, 1)), format='json')
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '1'))
+        self.assertEqual(Product.objects.get(id=tile.id).stock_quantity, 10)
+        self.assertEqual(client.post('/inventory/invoice/create/', invoice_payload(self.customer, (tile, 1)), format='json').status_code, 201)
+
+
+class ConcurrentInvoiceTests(StockFixtureMixin, TransactionTestCase):
+    # writers queue on the database lock (see DATABASES), so every request gets a real answer
+    workers = 5
+    quantity = 3
+
+    def test_parallel_invoices_never_oversell(self):
+        tile = self.stocked_product('Tile', 10)
+        barrier = threading.Barrier(self.workers)
+        outcomes = []
+
+        def create_invoice():
+            client = self.client_for_user()
+            try:
+                barrier.wait()
+                response = client.post(
+                    '/inventory/invoice/create/', invoice_payload(self.customer, (tile, self.quantity)), format='json'
+                )
+                outcomes.append((response.status_code, 'insufficient_stock' in response.data))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=create_invoice) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 10 tiles cover three invoices of 3; the other two are refused for lack of stock
+        self.assertEqual(sorted(outcomes), [(201, False)] * 3 + [(400, True)] * 2)
+        self.assertEqual(Product.objects.get(id=tile.id).stock_quantity, 1)
+        self.assertEqual(Invoice.objects.count(), 3)
+        last = StockMovement.objects.filter(product=tile).order_by('-date', '-id').first()
+        self.assertEqual(last.running_quantity, 1)
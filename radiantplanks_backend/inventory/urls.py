@@ -4,6 +4,7 @@ from .views import (CategoryListCreateView,
                     CategoryUpdateView,
                     CategoryDeleteView, 
                     ProductCreateView, 
+                    BulkProductCreateView,
                     ProductListView,
                     InventoryStockView,
                     ProductRetrieveView,
@@ -16,6 +17,8 @@ from .views import (CategoryListCreateView,
                     ListCustomerInvoicesView,
                     RetrieveInvoiceView,
                     GetLatestInvoiceId,
+                    DocumentNumberReserveView,
+                    DocumentNumberReleaseView,
                     SendInvoiceView,
                     DownloadInvoiceView,
                     DownloadPackingSlipView,
@@ -36,6 +39,11 @@ from .views import (CategoryListCreateView,
                     TestEmailView,
                     InventoryHistoryReportView,
                     InventoryHistoryXLSXReportView,
+                    StockAsOfView,
+                    StockMovementListView,
+                    ReorderAlertView,
+                    ProductSearchView,
+                    ScanLookupView,
                     DetailedInventoryReportView,
                     DetailedInventoryReportExcelExportView,
                     DetailedSalesReportView,
@@ -57,12 +65,17 @@ urlpatterns = [
     
     path('products/', ProductListView.as_view(), name='product-list'),
     path('products/create/', ProductCreateView.as_view(), name='product-create'),
+    path('products/bulkcreate/', BulkProductCreateView.as_view(), name='product-create-bulk'),
     path('products/stock/', InventoryStockView.as_view(), name='product-stock'),
+    path('products/search/', ProductSearchView.as_view(), name='product-search'),
+    path('scan/', ScanLookupView.as_view(), name='scan-lookup'),
     path('products/retrive/<int:product_id>/', ProductRetrieveView.as_view(), name='product-retrive'),
     path('products/update/<int:product_id>/', ProductUpdateView.as_view(), name='product-update'),
     path('products/delete/<int:product_id>/', ProductDeleteView.as_view(), name='product-delete'),
 
     path('invoice/getid/', GetLatestInvoiceId.as_view(), name='invoice-get'),
+    path('numbers/<str:document_type>/reserve/', DocumentNumberReserveView.as_view(), name='document-number-reserve'),
+    path('numbers/<str:document_type>/release/', DocumentNumberReleaseView.as_view(), name='document-number-release'),
     path('invoice/create/', CreateInvoiceView.as_view(), name='invoice-create'),
     path('invoice/update/<int:invoice_id>/', UpdateInvoiceView.as_view(), name='invoice-update'),
     path('invoice/finalize/', FinalizeInvoiceView.as_view(), name='invoice-finalize'),
@@ -92,6 +105,9 @@ urlpatterns = [
     path('test/email-server/', TestEmailView.as_view(), name='test-email-server'),
     path('inventory-history-report/', InventoryHistoryReportView.as_view(), name='inventory-history-report'),
     path('inventory-history-report/xlsx/', InventoryHistoryXLSXReportView.as_view(), name='inventory-history-report-xlsx'),
+    path('stock-as-of/', StockAsOfView.as_view(), name='stock-as-of'),
+    path('stock-movements/', StockMovementListView.as_view(), name='stock-movements'),
+    path('reorder-alerts/', ReorderAlertView.as_view(), name='reorder-alerts'),
     path('detailed-inventory-report/', DetailedInventoryReportView.as_view(), name='detailed-inventory-report'),
     path('detailed-inventory-report/xlsx/', DetailedInventoryReportExcelExportView.as_view(), name='detailed-inventory-report-xlsx'),
     path('detailed-sales-report/', DetailedSalesReportView.as_view(), name='detailed-sales-report'),
@@ -0,0 +1,124 @@
+"""
+Inventory valuation.
+
+The value of each stocked product (stock_quantity x purchase_price) is
+computed by the database, and the total by one aggregate, so a report
+costs one query for the rows and one for the total whatever the size of
+the catalog. The XLSX export follows accounts.exports: rows are read with
+`.iterator()`, ordered by category, and written by xlsxwriter in
+constant_memory mode into a temporary file. A subtotal row is added after
+each category.
+"""
+import tempfile
+from decimal import Decimal
+import xlsxwriter
+from django.db.models import F, Sum, Value, ExpressionWrapper, DecimalField, IntegerField, CharField
+from django.db.models.functions import Coalesce
+from .models import Product
+
+
+CHUNK_SIZE = 2000
+
+UNCATEGORIZED = 'Uncategorized'
+
+STOCK_VALUE = ExpressionWrapper(
+    Coalesce(F('stock_quantity'), Value(0), output_field=IntegerField())
+    * Coalesce(F('purchase_price'), Value(Decimal('0')), output_field=DecimalField(max_digits=10, decimal_places=2)),
+    output_field=DecimalField(max_digits=15, decimal_places=2),
+)
+
+# (header, value path, column width)
+COLUMNS = [
+    ('Category', 'category', 20),
+    ('Product Name', 'product_name', 35),
+    ('UPC', 'sku', 18),
+    ('Item Code', 'barcode', 18),
+    ('Stock Quantity', 'stock_quantity', 14),
+    ('Purchase Price', 'purchase_price', 15),
+    ('Stock Value', 'stock_value', 15),
+    ('Reorder Level', 'reorder_level', 13),
+    ('Batch/Lot Number', 'batch_lot_number', 18),
+    ('As On Date', 'as_on_date', 12),
+    ('Specifications', 'specifications', 25),
+    ('Description', 'purchase_description', 40),
+    ('Tags', 'tags', 20),
+    ('Images', 'images', 30),
+]
+HEADERS = [header for header, _, _ in COLUMNS]
+NAME_COLUMN = HEADERS.index('Product Name')
+VALUE_COLUMN = HEADERS.index('Stock Value')
+DATE_COLUMN = HEADERS.index('As On Date')
+AMOUNT_COLUMNS = (HEADERS.index('Purchase Price'), VALUE_COLUMN)
+
+
+def valued_products():
+    """Active stocked products annotated with their category name and stock value."""
+    return Product.objects.filter(product_type='product', is_active=True).annotate(
+        category=Coalesce(F('category_id__name'), Value(UNCATEGORIZED), output_field=CharField()),
+        stock_value=STOCK_VALUE,
+    )
+
+
+def total_value():
+    """Total stock value of all active stocked products, in one aggregate."""
+    total = Product.objects.filter(product_type='product', is_active=True).aggregate(total=Sum(STOCK_VALUE))['total']
+    return Decimal(total or 0).quantize(Decimal('0.01'))
+
+
+def product_rows(chunk_size=CHUNK_SIZE):
+    """Yield one tuple per product in COLUMNS order, by category then name."""
+    products = valued_products().order_by('category', 'product_name', 'id')
+    yield from products.values_list(*(path for _, path, _ in COLUMNS)).iterator(chunk_size=chunk_size)
+
+
+def write_xlsx(rows, total, sheet_name='Inventory Report'):
+    """
+    Write `rows` (ordered by category) with a subtotal after each category
+    and `total` at the end to a new XLSX file. Returns it as an open
+    temporary file positioned at the start.
+    """
+    output = tempfile.TemporaryFile(suffix='.xlsx')
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'tmpdir': tempfile.gettempdir()})
+    worksheet = workbook.add_worksheet(sheet_name)
+    header_format = workbook.add_format({'bold': True, 'bg_color': '#D9E1F2', 'border': 1})
+    date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+    amount_format = workbook.add_format({'num_format': '#,##0.00'})
+    subtotal_format = workbook.add_format({'bold': True})
+    subtotal_amount_format = workbook.add_format({'bold': True, 'num_format': '#,##0.00', 'top': 1})
+
+    for col_num, (header, _, width) in enumerate(COLUMNS):
+        worksheet.set_column(col_num, col_num, width)
+        worksheet.write(0, col_num, header, header_format)
+
+    row_num = 0
+
+    def write_summary(label, value):
+        nonlocal row_num
+        row_num += 1
+        worksheet.write(row_num, NAME_COLUMN, label, subtotal_format)
+        worksheet.write_number(row_num, VALUE_COLUMN, float(value), subtotal_amount_format)
+
+    category, subtotal = None, Decimal('0')
+    for row in rows:
+        if row[0] != category:
+            if category is not None:
+                write_summary(f'Subtotal {category}', subtotal)
+            category, subtotal = row[0], Decimal('0')
+        subtotal += row[VALUE_COLUMN] or 0
+        row_num += 1
+        for col_num, value in enumerate(row):
+            if value is None:
+                continue
+            if col_num == DATE_COLUMN:
+                worksheet.write_datetime(row_num, col_num, value, date_format)
+            elif col_num in AMOUNT_COLUMNS:
+                worksheet.write_number(row_num, col_num, float(value), amount_format)
+            else:
+                worksheet.write(row_num, col_num, value)
+    if category is not None:
+        write_summary(f'Subtotal {category}', subtotal)
+    write_summary('Total Inventory Value', total)
+
+    workbook.close()
+    output.seek(0)
+    return output
@@ -1,5 +1,7 @@
 from rest_framework import generics, exceptions
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.pagination import CursorPagination
+from rest_framework.parsers import MultiPartParser
 from django.db import transaction
 from .models import (Invoice, InvoiceItem, Product, Estimate, 
                      EstimateItem, ProductAccountMapping, Bill, 
@@ -9,19 +11,26 @@ from .serializers import CategorySerializer, ProductSerializer
 from rest_framework.views import APIView
 from django.core.mail import EmailMessage
 from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from .models import Category
 from authentication.models import NewUser
 from django.http import FileResponse
+from django.shortcuts import get_object_or_404
 from accounts.models import Account
+from accounts import posting, registry
+from radiantplanks_backend.idempotency import idempotent
+from . import stock, history, costing, reorder, search, scan, catalog, imports, valuation, invoice_ledger, numbering
 import posixpath
 import pandas as pd
 from django.core.files.storage import FileSystemStorage
 import traceback
+from collections import defaultdict
 from django.conf import settings
-from django.db.models import Sum, Q
+from django.db.models import Sum, Q, F
 import os
 import json
 import jwt
@@ -41,9 +50,9 @@ from django.template.loader import render_to_string
 import math
 import uuid
 import time
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 from django.db import transaction as db_transaction
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from django.urls import reverse
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
@@ -90,159 +99,81 @@ def add_inventory_transaction(product_name, quantity, unit_cost, inventory_accou
     try:
         total_cost = Decimal(quantity) * Decimal(unit_cost)
 
-        with db_transaction.atomic():
-            # Create a transaction record
-            transaction = Transaction.objects.create(
-                reference_number=f"INV-{uuid.uuid4().hex[:6].upper()}-{inventory_account.id}",
-                transaction_type='journal',
-                date=date.today(),
-                description=f"Added inventory for {product_name}",
-                created_by=created_by,
-            )
-
-            # Create transaction lines
-            # Debit: Inventory account (increase inventory)
-            TransactionLine.objects.create(
-                transaction=transaction,
-                account=inventory_account,
-                description=f"Inventory addition for {product_name}",
-                debit_amount=total_cost,
-                credit_amount=0,
-            )
-
-            # Credit: Assume it's an owner's equity or cash account (to offset the inventory addition)
-            owner_equity_account = Account.objects.filter(code='OWN-001').first()
-            if not owner_equity_account:
-                log.app.error("No owner account for equity found")
-                raise ValueError("Owner equity account does not exist.")
-            
-            TransactionLine.objects.create(
-                transaction=transaction,
-                account=owner_equity_account,
-                description=f"Fund allocation for inventory addition of {product_name}",
-                debit_amount=0,
-                credit_amount=total_cost,
-            )
-
-            # Update inventory account balance
-            inventory_account.balance += Decimal(total_cost)
-            owner_equity_account.balance -= Decimal(total_cost)
-            inventory_account.save()
-            owner_equity_account.save()
-            log.app.info("Inventory Transaction Success")
-            return True
+        # Credit: Assume it's an owner's equity or cash account (to offset the inventory addition)
+        try:
+            owner_equity_account = registry.account_id(registry.OWNER_EQUITY)
+        except Account.DoesNotExist:
+            log.app.error("No owner account for equity found")
+            raise ValueError("Owner equity account does not exist.")
+
+        posting.post_transaction(
+            [
+                # Debit: Inventory account (increase inventory)
+                posting.Line(inventory_account, debit=total_cost,
+                             description=f"Inventory addition for {product_name}"),
+                posting.Line(owner_equity_account, credit=total_cost,
+                             description=f"Fund allocation for inventory addition of {product_name}"),
+            ],
+            reference_number=f"INV-{uuid.uuid4().hex[:6].upper()}-{inventory_account.id}",
+            transaction_type='journal',
+            date=date.today(),
+            description=f"Added inventory for {product_name}",
+            created_by=created_by,
+        )
+        log.app.info("Inventory Transaction Success")
+        return True
     except Exception as e:
         log.trace.trace(f"Error occures {traceback.format_exc()}")
         return False
-    
+
+
+def invoice_lines(customer, invoice_id, amounts, total_amount, tax_amount):
+    """
+    Ledger lines for an invoice: inventory/COGS/revenue for the item
+    `amounts` (inventory.invoice_ledger), tax payable and the receivable.
+    Returns (lines, inventory cost).
+    """
+    receivable_account, tax_amount_account = registry.account_ids(registry.RECEIVABLE, registry.TAX_PAYABLE)
+
+    lines = invoice_ledger.sales_lines(invoice_id, amounts)
+    inv_total_cost = sum((amount['cost'] for amount in amounts), Decimal('0.00'))
+    if tax_amount > 0:
+        # Log tax revenue (credit tax account)
+        lines.append(posting.Line(tax_amount_account, credit=tax_amount, invoice_id=invoice_id,
+                                  description=f"Tax Payable for invoice to {customer.business_name}"))
+    # Increase accounts receivable (debit accounts receivable)
+    lines.append(posting.Line(receivable_account, debit=total_amount, invoice_id=invoice_id,
+                              description=f"Account receivable for invoice to {customer.business_name}"))
+    return lines, inv_total_cost
+
+
+def receivable_total(transaction_lines):
+    """Net amount of the active receivable lines among `transaction_lines`."""
+    return transaction_lines.filter(account_id=registry.account_id(registry.RECEIVABLE), is_active=True).aggregate(
+        total=Sum(F('debit_amount') - F('credit_amount'))
+    )['total'] or Decimal('0.00')
+
 
 def create_invoice_transaction(customer, invoice_id, products, total_amount, service_products, tax_amount, user):
     """
     Adjust inventory, create account receivable, and log transactions for cost of goods sold and sales revenue.
     """
     try:
-        # Fetch accounts
-        inventory_account = Account.objects.get(code='INV-001', is_active=True)  # Inventory account
-        receivable_account = Account.objects.get(code='AR-001')  # Accounts Receivable account
-        cogs_account = Account.objects.get(code='COGS-001')  # Cost of Goods Sold account
-        sales_revenue_account = Account.objects.get(code='INC-001')  # Sales Revenue account
-        tax_amount_account = Account.objects.get(code='AP-002')
-        untaxed_amount = total_amount - tax_amount
+        amounts = invoice_ledger.item_amounts(products, service_products)
+        lines, inv_total_cost = invoice_lines(customer, invoice_id, amounts, total_amount, tax_amount)
         # Create a new transaction
         with db_transaction.atomic():
-            transaction = Transaction.objects.create(
+            transaction = posting.post_transaction(
+                lines,
                 reference_number=f"INV-{uuid.uuid4().hex[:6].upper()}",
                 transaction_type='income',
                 date=datetime.now(),
                 description=f"Invoice for customer {customer.business_name}, invoice-code {invoice_id}",
                 created_by=user
             )
-            
-            inv_total_cost = 0
-
-            # Adjust inventory and log revenue and COGS
-            if products:
-                for product in products:
-                    product_name = product.get("product_name")
-                    quantity = Decimal(product.get("quantity"))
-                    unit_cost = Decimal(product.get("unit_cost"))  # Unit cost for inventory valuation
-                    unit_price = Decimal(product.get("unit_price"))  # Selling price per unit
-                    total_cost = quantity * unit_cost
-                    total_revenue = quantity * unit_price
-                    inv_total_cost += total_cost
-
-                    # Reduce inventory (credit inventory account)
-                    TransactionLine.objects.create(
-                        transaction=transaction,
-                        account=inventory_account,
-                        description=f"Inventory adjustment for {product_name}",
-                        debit_amount=0,
-                        credit_amount=total_cost,
-                        invoice_id=invoice_id,
-                    )
 
-                    # Log cost of goods sold (debit COGS)
-                    TransactionLine.objects.create(
-                        transaction=transaction,
-                        account=cogs_account,
-                        description=f"Cost of goods sold for {product_name}",
-                        debit_amount=total_cost,
-                        credit_amount=0,
-                        invoice_id=invoice_id,
-                    )
+            invoice_ledger.save_breakdown(invoice_id, amounts)
 
-                    # Log sales revenue (credit revenue account)
-                    TransactionLine.objects.create(
-                        transaction=transaction,
-                        account=sales_revenue_account,
-                        description=f"Sales revenue for {product_name}",
-                        debit_amount=0,
-                        credit_amount=total_revenue,
-                        invoice_id=invoice_id,
-                    )
-            if service_products:
-                for service_product in service_products:
-                    service_product_name = service_product.get("product_name")
-                    total_cost = Decimal(service_product.get("unit_price"))
-                    # inv_total_cost += total_cost
-                    TransactionLine.objects.create(
-                        transaction=transaction,
-                        account=sales_revenue_account,
-                        description=f"Service Sales revenue for {service_product_name}, invoice_id {invoice_id}",
-                        debit_amount=0,
-                        credit_amount=total_cost,
-                        invoice_id=invoice_id,
-                    )
-
-            if tax_amount>0:
-                # Log tax revenue (credit tax account)
-                tax_amount_account.balance += Decimal(tax_amount)
-                TransactionLine.objects.create(
-                    transaction=transaction,
-                    account=Account.objects.get(code='AP-002'),
-                    description=f"Tax Payable for invoice to {customer.business_name}",
-                    debit_amount=0,
-                    credit_amount=tax_amount,
-                    invoice_id=invoice_id,
-                )
-                tax_amount_account.save()
-
-            # Increase accounts receivable (debit accounts receivable)
-            TransactionLine.objects.create(
-                transaction=transaction,
-                account=receivable_account,
-                description=f"Account receivable for invoice to {customer.business_name}",
-                debit_amount=total_amount,
-                credit_amount=0,
-                invoice_id=invoice_id,
-            )
-
-            # Update account balances
-            inventory_account.balance -= Decimal(inv_total_cost)
-            receivable_account.balance += Decimal(total_amount)
-            cogs_account.balance += Decimal(inv_total_cost)
-            sales_revenue_account.balance += Decimal(untaxed_amount)
-            
             CustomerPaymentDetails.objects.create(
                 customer=customer,
                 transaction=transaction,
@@ -251,7 +182,7 @@ def create_invoice_transaction(customer, invoice_id, products, total_amount, ser
                 bank_name="",
                 cheque_number="",
                 payment_date=datetime.now(),
-                payment_amount=total_cost,
+                payment_amount=inv_total_cost,
             )
             InvoiceTransactionMapping.objects.create(
                 transaction=transaction,
@@ -259,10 +190,6 @@ def create_invoice_transaction(customer, invoice_id, products, total_amount, ser
                 is_payment_transaction=False,
                 is_active=True
             )
-            inventory_account.save()
-            receivable_account.save()
-            cogs_account.save()
-            sales_revenue_account.save()
 
             # Log receivable tracking
             receivable, created = ReceivableTracking.objects.get_or_create(customer=customer)
@@ -279,184 +206,30 @@ def create_invoice_transaction(customer, invoice_id, products, total_amount, ser
 
 def update_invoice_transaction(customer, invoice_id, new_products, new_service_products, new_total_amount, new_tax_amount, user):
     """
-    Reverse the original invoice transaction and create a new transaction with updated data.
-    Adjusts inventory, account balances, and logs new transactions.
+    Post the difference between the invoice's current lines and the updated
+    ones on the same transaction, one adjusting line per changed account.
     """
     try:
         # Fetch the original transaction linked to the invoice
         mapping = InvoiceTransactionMapping.objects.get(invoice_id=invoice_id, is_payment_transaction=False, is_active=True)
         original_transaction = Transaction.objects.get(id=mapping.transaction.id, is_active=True)
-        all_transaction_lines = TransactionLine.objects.filter(transaction=mapping.transaction.id, is_active=True).all()
-        original_receivable_amount = TransactionLine.objects.filter(transaction=mapping.transaction.id, account__code='AR-001', is_active=True).first().debit_amount
-        # Fetch relevant accounts
+        all_transaction_lines = TransactionLine.objects.filter(transaction=original_transaction)
+        original_receivable_amount = receivable_total(all_transaction_lines)
 
         with db_transaction.atomic():
-            # Calculate original amounts from transaction lines
-            # Create reversing transaction lines and adjust accounts
-            for line in all_transaction_lines:
-                account = line.account
-                if account.account_type in ['inventory', 'accounts_receivable', "cash", "bank", "fixed_assets", "other_current_assets"]:
-                    # Reverse inventory account logic
-                    if line.debit_amount > 0:
-                        account.balance -= Decimal(line.debit_amount)
-                    if line.credit_amount > 0:
-                        account.balance += Decimal(line.credit_amount)
-                #Expense
-                elif account.account_type in ['cost_of_goods_sold', 'operating_expenses', 'payroll_expenses', 'marketing_expenses', 'administrative_expenses', 'other_expenses']:
-                    # Reverse expense account logic (COGS)
-                    if line.debit_amount > 0:
-                        account.balance -= Decimal(line.debit_amount)
-                    if line.credit_amount > 0:
-                        account.balance += Decimal(line.credit_amount)
-                #Income
-                elif account.account_type in ['sales_income', 'service_income','other_income']:
-                    # Reverse revenue account logic
-                    if line.debit_amount > 0:
-                        account.balance += Decimal(line.debit_amount)
-                    if line.credit_amount > 0:
-                        account.balance -= Decimal(line.credit_amount)
-                #Liabilities
-                elif account.account_type in ['accounts_payable', 'tax_payable', 'credit_card', 'current_liabilities', 'long_term_liabilities']:
-                    # Reverse tax account logic
-                    if line.debit_amount > 0:
-                        account.balance += Decimal(line.debit_amount)
-                    if line.credit_amount > 0:
-                        account.balance -= Decimal(line.credit_amount)
-                #Equity
-                elif account.account_type in ['owner_equity', 'retained_earnings']:
-                    # Reverse tax account logic
-                    if line.debit_amount > 0:
-                        account.balance += Decimal(line.debit_amount)
-                    if line.credit_amount > 0:
-                        account.balance -= Decimal(line.credit_amount)
-                else:
-                    # Reverse tax account logic
-                    if line.debit_amount > 0:
-                        account.balance += Decimal(line.debit_amount)
-                    if line.credit_amount > 0:
-                        account.balance -= Decimal(line.credit_amount)
-                account.save()
-                line.is_active = False
-                line.save()
-
-            inventory_account = Account.objects.get(code='INV-001')
-            receivable_account = Account.objects.get(code='AR-001')
-            cogs_account = Account.objects.get(code='COGS-001')
-            sales_revenue_account = Account.objects.get(code='INC-001')
-            tax_account = Account.objects.get(code='AP-002')
-
-            # Update ReceivableTracking
+            amounts = invoice_ledger.item_amounts(new_products, new_service_products)
+            lines, inv_total_cost = invoice_lines(customer, invoice_id, amounts, new_total_amount, new_tax_amount)
+            adjustments = posting.post_adjustment(original_transaction, all_transaction_lines, lines,
+                                                  description=f"Adjustment for updated invoice {invoice_id}",
+                                                  invoice_id=invoice_id)
+            invoice_ledger.save_breakdown(invoice_id, amounts)
+
+            # Update ReceivableTracking with the difference
             receivable, _ = ReceivableTracking.objects.get_or_create(customer=customer)
-            receivable.receivable_amount -= original_receivable_amount
+            receivable.receivable_amount += Decimal(new_total_amount) - original_receivable_amount
             receivable.save()
-            receivable, _ = ReceivableTracking.objects.get_or_create(customer=customer)
 
-            
-            inv_total_cost = Decimal('0.00')
-            new_untaxed_amount = new_total_amount - new_tax_amount
-
-            # Process new products (goods)
-            for product in new_products:
-                product_name = product.get("product_name")
-                quantity = Decimal(product.get("quantity"))
-                unit_cost = Decimal(product.get("unit_cost"))
-                unit_price = Decimal(product.get("unit_price"))
-                total_cost = quantity * unit_cost
-                total_revenue = quantity * unit_price
-                inv_total_cost += total_cost
-
-                # Adjust inventory (credit)
-                TransactionLine.objects.create(
-                    transaction=original_transaction,
-                    account=inventory_account,
-                    description=f"Inventory adjustment for {product_name}",
-                    debit_amount=0,
-                    credit_amount=total_cost,
-                    invoice_id=invoice_id,
-                )
-
-                # Debit COGS
-                TransactionLine.objects.create(
-                    transaction=original_transaction,
-                    account=cogs_account,
-                    description=f"Cost of goods sold for {product_name}",
-                    debit_amount=total_cost,
-                    credit_amount=0,
-                    invoice_id=invoice_id,
-                )
-
-                # Credit Sales Revenue
-                TransactionLine.objects.create(
-                    transaction=original_transaction,
-                    account=sales_revenue_account,
-                    description=f"Sales revenue for {product_name}",
-                    debit_amount=0,
-                    credit_amount=total_revenue,
-                    invoice_id=invoice_id,
-                )
-
-            # Process new service products
-            for service in new_service_products:
-                service_name = service.get("product_name")
-                total_revenue = Decimal(service.get("unit_price"))
-
-                TransactionLine.objects.create(
-                    transaction=original_transaction,
-                    account=sales_revenue_account,
-                    description=f"Service Sales revenue for {service_name}",
-                    debit_amount=0,
-                    credit_amount=total_revenue,
-                    invoice_id=invoice_id,
-                )
-
-            # Handle tax
-            if new_tax_amount > 0:
-                TransactionLine.objects.create(
-                    transaction=original_transaction,
-                    account=tax_account,
-                    description=f"Tax Payable for invoice to {customer.business_name}",
-                    debit_amount=0,
-                    credit_amount=new_tax_amount,
-                    invoice_id=invoice_id,
-                )
-                tax_account.balance += Decimal(new_tax_amount)
-
-            # Update accounts receivable
-            TransactionLine.objects.create(
-                transaction=original_transaction,
-                account=receivable_account,
-                description=f"Account receivable for updated invoice to {customer.business_name}",
-                debit_amount=new_total_amount,
-                credit_amount=0,
-                invoice_id=invoice_id,
-            )
-
-            # Update account balances with new transaction amounts
-            inventory_account.balance -= inv_total_cost
-            cogs_account.balance += inv_total_cost
-            sales_revenue_account.balance += new_untaxed_amount
-            receivable_account.balance += Decimal(new_total_amount)
-
-            # Save updated account balances
-            inventory_account.save()
-            cogs_account.save()
-            sales_revenue_account.save()
-            receivable_account.save()
-            tax_account.save()
-
-            # Update ReceivableTracking with new amount
-            receivable.receivable_amount += Decimal(new_total_amount)
-            receivable.save()
-
-
-            # Log customer payment details for the new transaction
-            update_customer_payment = CustomerPaymentDetails.objects.filter(
-                customer=customer,
-                transaction=original_transaction,
-            ).first()
-            update_customer_payment.payment_amount = new_total_amount
-
-        log.app.info("Invoice updated successfully")
+        log.app.info(f"Invoice {invoice_id} updated with {len(adjustments)} adjusting lines")
         return True
 
     except Exception as e:
@@ -466,8 +239,7 @@ def update_invoice_transaction(customer, invoice_id, new_products, new_service_p
 
 def delete_invoice_transaction(invoice_id, user):
     """
-    Marks all transactions and related transaction lines for an invoice as inactive,
-    and reverses account balance adjustments based on account type.
+    Reverse every transaction posted for an invoice and mark it and its mapping inactive.
     """
     try:
         # Fetch the invoice transactions
@@ -480,67 +252,19 @@ def delete_invoice_transaction(invoice_id, user):
         with db_transaction.atomic():
             for mapping in invoice_transactions:
                 transaction = mapping.transaction
-                # Mark transaction as inactive
-                transaction.is_active = False
-                transaction.save()
-
-                # Reverse account balances for related transaction lines
-                for line in TransactionLine.objects.filter(transaction=transaction, is_active=True):
-                    account = line.account
-                    #Assets
-                    if account.account_type in ['inventory', 'accounts_receivable', "cash", "bank", "fixed_assets", "other_current_assets"]:
-                        # Reverse inventory account logic
-                        if line.debit_amount > 0:
-                            account.balance -= Decimal(line.debit_amount)
-                        if line.credit_amount > 0:
-                            account.balance += Decimal(line.credit_amount)
-                    #Expense
-                    elif account.account_type in ['cost_of_goods_sold', 'operating_expenses', 'payroll_expenses', 'marketing_expenses', 'administrative_expenses', 'other_expenses']:
-                        # Reverse expense account logic (COGS)
-                        if line.debit_amount > 0:
-                            account.balance -= Decimal(line.debit_amount)
-                        if line.credit_amount > 0:
-                            account.balance += Decimal(line.credit_amount)
-                    #Income
-                    elif account.account_type in ['sales_income', 'service_income','other_income']:
-                        # Reverse revenue account logic
-                        if line.debit_amount > 0:
-                            account.balance += Decimal(line.debit_amount)
-                        if line.credit_amount > 0:
-                            account.balance -= Decimal(line.credit_amount)
-                    #Liabilities
-                    elif account.account_type in ['accounts_payable', 'tax_payable', 'credit_card', 'current_liabilities', 'long_term_liabilities']:
-                        # Reverse tax account logic
-                        if line.debit_amount > 0:
-                            account.balance += Decimal(line.debit_amount)
-                        if line.credit_amount > 0:
-                            account.balance -= Decimal(line.credit_amount)
-                    #Equity
-                    elif account.account_type in ['owner_equity', 'retained_earnings']:
-                        # Reverse tax account logic
-                        if line.debit_amount > 0:
-                            account.balance += Decimal(line.debit_amount)
-                        if line.credit_amount > 0:
-                            account.balance -= Decimal(line.credit_amount)
-                    else:
-                        # Reverse tax account logic
-                        if line.debit_amount > 0:
-                            account.balance += Decimal(line.debit_amount)
-                        if line.credit_amount > 0:
-                            account.balance -= Decimal(line.credit_amount)
-
-                    # Save updated account balance
-                    account.save()
+                receivable_amount = receivable_total(TransactionLine.objects.filter(transaction=transaction))
+                posting.reverse_transaction(transaction)
 
                 # Mark the mapping as inactive
                 mapping.is_active = False
                 mapping.save()
 
-            # Update receivable tracking
-            receivable_tracking = ReceivableTracking.objects.filter(customer=transaction.customer).first()
-            if receivable_tracking:
-                receivable_tracking.receivable_amount -= Decimal(transaction.amount)
-                receivable_tracking.save()
+                # Update receivable tracking
+                payment_details = CustomerPaymentDetails.objects.filter(transaction=transaction).first()
+                receivable_tracking = ReceivableTracking.objects.filter(customer=payment_details.customer).first() if payment_details else None
+                if receivable_tracking:
+                    receivable_tracking.receivable_amount -= receivable_amount
+                    receivable_tracking.save()
 
         log.app.info(f"Invoice {invoice_id} deleted successfully.")
         return True
@@ -550,94 +274,73 @@ def delete_invoice_transaction(invoice_id, user):
         return False
 
 
+def bill_total(products, services):
+    """The total a bill with these product and service dicts must have: its debit lines, rounded per line."""
+    total = sum((invoice_ledger.round_amount(Decimal(product.get("quantity")) * Decimal(product.get("unit_price")))
+                 for product in products), Decimal('0.00'))
+    return total + sum((invoice_ledger.round_amount(service.get("unit_price")) for service in services), Decimal('0.00'))
+
+
 def create_bill_transaction(bill_id, vendor, products, services, total_amount, user):
     """
     Adjust inventory and create accounts payable for the bill.
     If paid, do not increase accounts payable and reduce bank balance.
     """
     try:
-        inventory_account = Account.objects.get(code='INV-001')  # Inventory account
-        payable_account = Account.objects.get(code='AP-001')  # Accounts Payable account
-        cogs_account = Account.objects.get(code='COGS-001')
-        # Create a new transaction
-        transaction = Transaction.objects.create(
-            reference_number=f"BILL-{uuid.uuid4().hex[:6].upper()}",
-            transaction_type='journal',
-            date=datetime.now(),
-            description=f"Bill for vendor {vendor.business_name}, bill ID {bill_id}",
-            created_by=user
+        inventory_account, payable_account, cogs_account = registry.account_ids(
+            registry.INVENTORY, registry.PAYABLE, registry.COST_OF_GOODS_SOLD
         )
 
-        inv_total_cost = 0
-        services_total_cost = 0
-
+        lines = []
         # Adjust inventory and handle accounts payable
         for product in products:
             product_name = product.get("product_name")
             quantity = Decimal(product.get("quantity"))
             unit_cost = Decimal(product.get("unit_price"))
-            temp_total_cost = quantity * unit_cost
-            inv_total_cost += temp_total_cost
-
             # Add inventory (debit inventory account)
-            TransactionLine.objects.create(
-                transaction=transaction,
-                account=inventory_account,
-                description=f"Inventory addition for {product_name}",
-                debit_amount=temp_total_cost,
-                credit_amount=0,
-                bill_id=bill_id,
-            )
+            lines.append(posting.Line(inventory_account, debit=quantity * unit_cost, bill_id=bill_id,
+                                      description=f"Inventory addition for {product_name}"))
 
         for service in services:
             service_name = service.get("service_name")
-            temp_total_cost = Decimal(service.get("unit_price"))
-            
-            TransactionLine.objects.create(
-                transaction=transaction,
-                account=cogs_account,
-                description=f"Service addition for {service_name}",
-                debit_amount=temp_total_cost,
-                bill_id=bill_id,
-                credit_amount=0)
-            services_total_cost += temp_total_cost
-            
+            lines.append(posting.Line(cogs_account, debit=Decimal(service.get("unit_price")), bill_id=bill_id,
+                                      description=f"Service addition for {service_name}"))
+
         # Add payable (credit accounts payable account)
-        TransactionLine.objects.create(
-            transaction=transaction,
-            account=payable_account,
-            description=f"Accounts payable for bill to {vendor.business_name}",
-            debit_amount=0,
-            credit_amount=total_amount,
-            bill_id=bill_id,
-        )
+        lines.append(posting.Line(payable_account, credit=total_amount, bill_id=bill_id,
+                                  description=f"Accounts payable for bill to {vendor.business_name}"))
 
-        # Update payable tracking
-        payable, created = PayableTracking.objects.get_or_create(vendor=vendor)
-        payable.payable_amount += Decimal(total_amount)
-        payable.save()
-        # Update account balances
-        VendorPaymentDetails.objects.create(
-            vendor=vendor,
-            transaction=transaction,
-            payment_method="inventory",
-            transaction_reference_id="",
-            bank_name="",
-            cheque_number="",
-            payment_date=datetime.now(),
-            payment_amount=total_amount,
-        )
-        inventory_account.balance += Decimal(inv_total_cost)
-        cogs_account.balance += Decimal(services_total_cost)
-        payable_account.balance += Decimal(total_amount)
-        BillTransactionMapping.objects.create(
-            transaction=transaction,
-            bill_id=bill_id,
-            is_payment_transaction=False,
-            is_active=True
-        )
-        inventory_account.save()
-        payable_account.save()
+        with db_transaction.atomic():
+            # Create a new transaction
+            transaction = posting.post_transaction(
+                lines,
+                reference_number=f"BILL-{uuid.uuid4().hex[:6].upper()}",
+                transaction_type='journal',
+                date=datetime.now(),
+                description=f"Bill for vendor {vendor.business_name}, bill ID {bill_id}",
+                created_by=user
+            )
+
+            # Update payable tracking
+            payable, created = PayableTracking.objects.get_or_create(vendor=vendor)
+            payable.payable_amount += Decimal(total_amount)
+            payable.save()
+            VendorPaymentDetails.objects.create(
+                vendor=vendor,
+                transaction=transaction,
+                payment_method="inventory",
+                transaction_reference_id="",
+                bank_name="",
+                cheque_number="",
+                payment_date=datetime.now(),
+                payment_amount=total_amount,
+            )
+            BillTransactionMapping.objects.create(
+                transaction=transaction,
+                bill_id=bill_id,
+                is_payment_transaction=False,
+                is_active=True
+            )
 
         log.app.info("Bill Transaction completed")
         return True
@@ -648,11 +351,10 @@ def create_bill_transaction(bill_id, vendor, products, services, total_amount, u
 
 def delete_bill_transaction(bill_id, user):
     """
-    Marks all transactions and related transaction lines for an invoice as inactive,
-    and reverses account balance adjustments based on account type.
+    Reverse every transaction posted for a bill and mark it and its mapping inactive.
     """
     try:
-        # Fetch the invoice transactions
+        # Fetch the bill transactions
         bill_transactions = BillTransactionMapping.objects.filter(bill_id=bill_id, is_payment_transaction=False, is_active=True)
 
         if not bill_transactions.exists():
@@ -662,69 +364,21 @@ def delete_bill_transaction(bill_id, user):
         with db_transaction.atomic():
             for mapping in bill_transactions:
                 transaction = mapping.transaction
-                # Mark transaction as inactive
-                transaction.is_active = False
-                transaction.updated_by = user
-                transaction.updated_date = datetime.now()
-                transaction.save()
-
-                # Reverse account balances for related transaction lines
-                for line in TransactionLine.objects.filter(transaction=transaction, is_active=True):
-                    account = line.account
-                    #Assets
-                    if account.account_type in ['inventory', 'accounts_receivable', "cash", "bank", "fixed_assets", "other_current_assets"]:
-                        # Reverse inventory account logic
-                        if line.debit_amount > 0:
-                            account.balance -= Decimal(line.debit_amount)
-                        if line.credit_amount > 0:
-                            account.balance += Decimal(line.credit_amount)
-                    #Expense
-                    elif account.account_type in ['cost_of_goods_sold', 'operating_expenses', 'payroll_expenses', 'marketing_expenses', 'administrative_expenses', 'other_expenses']:
-                        # Reverse expense account logic (COGS)
-                        if line.debit_amount > 0:
-                            account.balance -= Decimal(line.debit_amount)
-                        if line.credit_amount > 0:
-                            account.balance += Decimal(line.credit_amount)
-                    #Income
-                    elif account.account_type in ['sales_income', 'service_income','other_income']:
-                        # Reverse revenue account logic
-                        if line.debit_amount > 0:
-                            account.balance += Decimal(line.debit_amount)
-                        if line.credit_amount > 0:
-                            account.balance -= Decimal(line.credit_amount)
-                    #Liabilities
-                    elif account.account_type in ['accounts_payable', 'tax_payable', 'credit_card', 'current_liabilities', 'long_term_liabilities']:
-                        # Reverse tax account logic
-                        if line.debit_amount > 0:
-                            account.balance += Decimal(line.debit_amount)
-                        if line.credit_amount > 0:
-                            account.balance -= Decimal(line.credit_amount)
-                    #Equity
-                    elif account.account_type in ['owner_equity', 'retained_earnings']:
-                        # Reverse tax account logic
-                        if line.debit_amount > 0:
-                            account.balance += Decimal(line.debit_amount)
-                        if line.credit_amount > 0:
-                            account.balance -= Decimal(line.credit_amount)
-                    else:
-                        # Reverse tax account logic
-                        if line.debit_amount > 0:
-                            account.balance += Decimal(line.debit_amount)
-                        if line.credit_amount > 0:
-                            account.balance -= Decimal(line.credit_amount)
-
-                    # Save updated account balance
-                    account.save()
+                payable_amount = TransactionLine.objects.filter(
+                    transaction=transaction, account_id=registry.account_id(registry.PAYABLE), is_active=True
+                ).aggregate(total=Sum('credit_amount'))['total'] or Decimal('0.00')
+                posting.reverse_transaction(transaction)
 
                 # Mark the mapping as inactive
                 mapping.is_active = False
                 mapping.save()
 
-            # Update receivable tracking
-            receivable_tracking = PayableTracking.objects.filter(customer=transaction.customer).first()
-            if receivable_tracking:
-                receivable_tracking.payable_amount -= Decimal(transaction.amount)
-                receivable_tracking.save()
+                # Update payable tracking
+                payment_details = VendorPaymentDetails.objects.filter(transaction=transaction).first()
+                payable_tracking = PayableTracking.objects.filter(vendor=payment_details.vendor).first() if payment_details else None
+                if payable_tracking:
+                    payable_tracking.payable_amount -= payable_amount
+                    payable_tracking.save()
 
         log.app.info(f"Invoice {bill_id} deleted successfully.")
         return True
@@ -903,7 +557,55 @@ class CategoryDeleteView(APIView):
         return Response({"detail": "Category deleted successfully."}, status=status.HTTP_204_NO_CONTENT)
 
 
-class ProductListView(APIView):
+class CatalogCursorPagination(CursorPagination):
+    page_size = 100
+    page_size_query_param = 'limit'
+    max_page_size = 500
+    ordering = 'id'
+
+
+class CatalogMixin:
+    """
+    Catalog listing shared by the product and stock lists. `fields` selects
+    a subset of the columns. Passing `limit` or `cursor` returns keyset pages
+    ({"next", "previous", "results"}); otherwise the whole list is returned.
+    Responses carry an ETag and Last-Modified, and a matching
+    If-None-Match / If-Modified-Since is answered with 304.
+    """
+    catalog_fields = catalog.PRODUCT_FIELDS
+
+    def catalog_response(self, request, products):
+        try:
+            names = catalog.parse_fields(request.GET.get('fields'), self.catalog_fields)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        seed, last_modified = catalog.validator()
+        etag = f'"{catalog.etag(seed, request.get_full_path())}"'
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        not_modified = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if not_modified is not None:
+            return not_modified
+
+        rows = catalog.rows(products, names, self.catalog_fields)
+        if 'limit' in request.GET or 'cursor' in request.GET:
+            paginator = CatalogCursorPagination()
+            page = paginator.paginate_queryset(rows, request, view=self)
+            response = paginator.get_paginated_response(
+                [catalog.present(row, names, self.catalog_fields) for row in page]
+            )
+        else:
+            response = Response(
+                [catalog.present(row, names, self.catalog_fields) for row in rows.order_by('id')],
+                status=status.HTTP_200_OK,
+            )
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
+
+
+class ProductListView(CatalogMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get_user_from_token(self, request):
@@ -921,25 +623,7 @@ class ProductListView(APIView):
         if not user:
             return Response({"detail": "Invalid or expired token."}, status=status.HTTP_401_UNAUTHORIZED)
 
-        products = Product.objects.filter(is_active=True)
-        products_data = [
-            {
-                "id": product.id,
-                "product_image": product.images,
-                "product_type": product.product_type,
-                "product_name": product.product_name,
-                "product_description": product.purchase_description,
-                "category": product.category_id.name if product.category_id else None,
-                "sku": product.sku,
-                "product_barcode": product.barcode,
-                "product_length": product.tile_length,
-                "product_area": product.tile_area,
-                "product_width": product.tile_width,
-                "stock_quantity": product.stock_quantity,
-            }
-            for product in products
-        ]
-        return Response(products_data, status=status.HTTP_200_OK)
+        return self.catalog_response(request, Product.objects.filter(is_active=True))
 
 
 # Product Views
@@ -1092,6 +776,8 @@ class ProductCreateView(APIView):
                                                       unit_cost = purchase_price, 
                                                       inventory_account = inventory_account, 
                                                       created_by = user)
+            stock.record(product, stock_quantity, 'opening', product.id, as_on_date, purchase_price)
+            costing.receive(product, stock_quantity, purchase_price, 'opening', product.id, as_on_date)
 
         log.audit.success(f"Product added to inventory successfully | {product_name} | {user}")
         audit_log_entry = audit_log(user=request.user,
@@ -1110,7 +796,66 @@ class ProductCreateView(APIView):
         }, status=status.HTTP_201_CREATED)
 
 
-class InventoryStockView(APIView):
+class BulkProductCreateView(APIView):
+    """
+    Import products from a CSV or Excel sheet (`file`), one row per product
+    with the ProductCreateView fields as columns (`category` by name).
+    Stocked products are mapped to the `inventory_account` given with the
+    upload, and their opening stock is posted as one journal. Invalid rows
+    are skipped and reported.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        file = request.FILES.get('file')
+        if not file:
+            return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            df = imports.read(file)
+        except Exception as e:
+            return Response({'error': f'Error reading file: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        missing_columns = imports.missing_columns(df)
+        if missing_columns:
+            return Response({'error': f'Missing required columns: {missing_columns}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows, errors = imports.validate(df)
+        inventory_account = None
+        if any(row['product_type'] == 'product' for row in rows):
+            inventory_account = Account.objects.filter(id=request.data.get('inventory_account') or None, is_active=True).first()
+            if inventory_account is None:
+                return Response({'error': 'Inventory account is required.', 'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        if not rows:
+            return Response({'error': 'No valid rows to import.', 'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            products, journal = imports.import_products(rows, inventory_account, request.user)
+        except Exception as e:
+            log.trace.trace(f"Error during bulk product import: {traceback.format_exc()}")
+            return Response({'error': f'Error during bulk import: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        audit_log(user=request.user,
+                  action="Bulk product import",
+                  ip_add=request.META.get('HTTP_X_FORWARDED_FOR'),
+                  model_name="Product",
+                  record_id=products[0].id,
+                  additional_details=f"{len(products)} products imported, ids {products[0].id} to {products[-1].id}")
+        log.audit.success(f"Bulk product import completed | {len(products)} products | {request.user}")
+        return Response({
+            'message': 'Bulk product import completed.',
+            'successful_creates': len(products),
+            'products': [
+                {'row': row['row'], 'id': product.id, 'product_name': product.product_name, 'sku': product.sku}
+                for row, product in zip(rows, products)
+            ],
+            'transaction_id': journal.id if journal else None,
+            'errors': errors,
+        }, status=status.HTTP_201_CREATED)
+
+
+class InventoryStockView(CatalogMixin, APIView):
+    catalog_fields = catalog.STOCK_FIELDS
     permission_classes = [IsAuthenticated]
 
     def get_user_from_token(self, request):
@@ -1128,27 +873,7 @@ class InventoryStockView(APIView):
         if not user:
             return Response({"detail": "Invalid or expired token."}, status=status.HTTP_401_UNAUTHORIZED)
 
-        products = Product.objects.filter(is_active=True, product_type="product")
-        products_data = [
-            {
-                "id": product.id,
-                "product_image": product.images,
-                "product_type": product.product_type,
-                "product_name": product.product_name,
-                "product_description": product.purchase_description,
-                "category": product.category_id.name if product.category_id else None,
-                "sku": product.sku,
-                "product_barcode": product.barcode,
-                "product_length": product.tile_length,
-                "product_width": product.tile_width,
-                "product_price": product.purchase_price,
-                "product_price_per_sqf": round((product.purchase_price/product.tile_area), 2),
-                "product_area": product.tile_area,
-                "stock_quantity": product.stock_quantity,
-            }
-            for product in products
-        ]
-        return Response(products_data, status=status.HTTP_200_OK)
+        return self.catalog_response(request, Product.objects.filter(is_active=True, product_type="product"))
 
 
 class ProductUpdateView(APIView):
@@ -1227,6 +952,7 @@ class ProductUpdateView(APIView):
         product.category_id = category_id
         # product.sell_description = data.get("sell_description", product.sell_description)
         product.purchase_description = data.get("purchase_description", product.purchase_description)
+        previous_stock_quantity = product.stock_quantity or 0
         product.stock_quantity = data.get("stock_quantity", product.stock_quantity)
         product.reorder_level = data.get("reorder_level", product.reorder_level)
         product.batch_lot_number = data.get("batch_lot_number", product.batch_lot_number)
@@ -1263,6 +989,13 @@ class ProductUpdateView(APIView):
         # Save updated product
         product.updated_by = user
         product.save()
+        if product.product_type == 'product':
+            adjustment = int(product.stock_quantity or 0) - previous_stock_quantity
+            stock.record(product, adjustment, 'adjustment', product.id)
+            if adjustment > 0:
+                costing.receive(product, adjustment, product.purchase_price, 'adjustment', product.id)
+            else:
+                costing.consume({product.id: -adjustment}, 'adjustment', product.id)
 
         audit_log_entry = audit_log(user=request.user,
                               action="Product Updated", 
@@ -1373,18 +1106,45 @@ class ProductDeleteView(APIView):
 class GetLatestInvoiceId(APIView):
     def get(self, request):
         """
-        API endpoint to retrieve the latest invoice ID
+        API endpoint to preview the next invoice number. Nothing is reserved;
+        use DocumentNumberReserveView to hold a number while the invoice is edited.
         """
         try:
-            latest_invoice_id = Invoice.objects.aggregate(max_id=Max('id'))['max_id']
-            new_invoice_id = (latest_invoice_id or 0) + 1  # Start with 1 if no invoices exist
+            return Response({'latest_invoice_id': numbering.peek('invoice')}, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
 
-            return Response({'latest_invoice_id': new_invoice_id}, status=status.HTTP_200_OK)
+class DocumentNumberReserveView(APIView):
+    def post(self, request, document_type):
+        """Reserve the next invoice, bill or estimate number for the current user."""
+        if document_type not in numbering.DOCUMENT_TYPES:
+            return Response({"detail": "Unknown document type."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            reservation = numbering.reserve(document_type, request.user)
+            return Response({"document_number": reservation.document_number, "expires_at": reservation.expires_at},
+                            status=status.HTTP_201_CREATED)
+        except numbering.SequenceBusy as e:
+            log.app.warning(f"{e} | Number reservation")
+            return Response({"detail": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
         except Exception as e:
-            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)      
+            log.trace.trace(f"Error reserving document number {traceback.format_exc()}")
+            return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class DocumentNumberReleaseView(APIView):
+    def post(self, request, document_type):
+        """Give back a number reserved by the current user whose document was not saved."""
+        document_number = request.data.get("document_number")
+        if document_type not in numbering.DOCUMENT_TYPES or not document_number:
+            return Response({"detail": "Document type and document_number are required."}, status=status.HTTP_400_BAD_REQUEST)
+        if not numbering.release(document_type, document_number, request.user):
+            return Response({"detail": "No reservation of this number is held by you."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"message": "Document number released."}, status=status.HTTP_200_OK)
 
 
 class CreateInvoiceView(APIView):
+    @idempotent
     def post(self, request):
         data = request.data
         customer_id = data.get("customer_id")
@@ -1432,6 +1192,71 @@ class CreateInvoiceView(APIView):
                     payment_status = payment_status.lower()
                 else:
                     payment_status = "unpaid"
+
+                # Process each item in the invoice; all products are loaded with one query
+                products = Product.objects.in_bulk({int(item_data['product_id']) for item_data in items})
+                transaction_products = []
+                service_products = []
+                invoice_items = []
+                reservations = defaultdict(int)
+                for item_data in items:
+                    product = products.get(int(item_data['product_id']))
+                    if product is None:
+                        raise Product.DoesNotExist("Product matching query does not exist.")
+                    quantity = float(item_data['quantity'])
+                    unit_price = float(item_data['unit_price'])
+                    unit_type = item_data['unit_type']  # Can be 'tile', 'box', or 'pallet'
+                    description = item_data.get("description","")
+
+                    # Convert quantity to tiles based on the unit type
+                    if unit_type == 'pallet':
+                        quantity_in_tiles = quantity * 55
+                    elif unit_type == 'box':
+                        quantity_in_tiles = quantity
+                    elif unit_type == 'sqf':
+                        quantity_in_tiles = math.ceil(float(quantity) / float(product.tile_area))  # Calculate approx tiles for sqf
+                    else:
+                        quantity_in_tiles = quantity  # Assume 'box' is the base unit
+
+                    # Stock is reserved for all lines at once after the loop
+                    if product.product_type == 'product':
+                        reservations[product.id] += quantity_in_tiles
+                        transaction_products.append({'quantity': quantity_in_tiles, 
+                                                    "product_id": product.id,
+                                                    "product_name": product.product_name,
+                                                    "unit_price": unit_price,
+                                                    "unit_cost": product.purchase_price})
+                        line_total = round((unit_price * quantity_in_tiles),2)
+                    elif product.product_type == 'service':
+                        line_total = round(unit_price,2)
+                        service_products.append({'product_id': product.id,
+                                                    'product_name': product.product_name,
+                                                    'unit_price': line_total})
+
+                    # Invoice items are inserted together once the invoice exists
+                    invoice_items.append(InvoiceItem(
+                        product=product,
+                        description=description,
+                        quantity=quantity_in_tiles,
+                        amount=line_total,
+                        unit_price=unit_price,
+                        created_by=request.user
+                    ))
+                    
+                    # Accumulate total amount
+                    # total_amount += line_total
+
+                # The receivable is posted at total_amount and revenue per item, so they must agree
+                # before a number is allocated or stock is reserved
+                expected_total = invoice_ledger.expected_total(transaction_products, service_products, tax_amount)
+                if invoice_ledger.round_amount(total_amount) != expected_total:
+                    return Response({
+                        "detail": f"Total amount {invoice_ledger.round_amount(total_amount)} does not match "
+                                  f"the items plus tax ({expected_total}).",
+                        "total_amount": invoice_ledger.round_amount(total_amount),
+                        "expected_total": expected_total,
+                    }, status=status.HTTP_400_BAD_REQUEST)
+
                 attachments = request.FILES.get("attachments")
 
                 if attachments:
@@ -1443,9 +1268,13 @@ class CreateInvoiceView(APIView):
                 else:
                     attachments_url = ""
 
+                # the number reserved when the form was opened, if still held
+                invoice_number = numbering.take('invoice', request.user, data.get("invoice_number"))
+
                 # Create temporary invoice
                 invoice = Invoice.objects.create(
                     customer=customer,
+                    invoice_number=invoice_number,
                     customer_email = customer_email,
                     customer_email_cc = customer_email_cc,
                     customer_email_bcc = customer_email_bcc,
@@ -1481,57 +1310,22 @@ class CreateInvoiceView(APIView):
                     is_active=True  # Mark as temporary
                 )
 
-                # Process each item in the invoice
-                transaction_products = []
-                service_products = []
-                for item_data in items:
-                    product = Product.objects.get(id=item_data['product_id'])
-                    quantity = float(item_data['quantity'])
-                    unit_price = float(item_data['unit_price'])
-                    unit_type = item_data['unit_type']  # Can be 'tile', 'box', or 'pallet'
-                    description = item_data.get("description","")
-
-                    # Convert quantity to tiles based on the unit type
-                    if unit_type == 'pallet':
-                        quantity_in_tiles = quantity * 55
-                    elif unit_type == 'box':
-                        quantity_in_tiles = quantity
-                    elif unit_type == 'sqf':
-                        quantity_in_tiles = math.ceil(float(quantity) / float(product.tile_area))  # Calculate approx tiles for sqf
-                    else:
-                        quantity_in_tiles = quantity  # Assume 'box' is the base unit
-
-                    # Check if enough stock is available
-                    if product.product_type == 'product':
-                        if product.stock_quantity < quantity_in_tiles:
-                            return Response({"detail": f"Insufficient stock for product {product.product_name}."}, status=status.HTTP_400_BAD_REQUEST)
+                for invoice_item in invoice_items:
+                    invoice_item.invoice = invoice
+                InvoiceItem.objects.bulk_create(invoice_items)
 
-                    # Deduct stock and calculate the line total
-                        product.stock_quantity -= quantity_in_tiles
-                        transaction_products.append({'quantity': quantity_in_tiles, 
-                                                    "product_name": product.product_name,
-                                                    "unit_price": unit_price,
-                                                    "unit_cost": product.purchase_price})
-                        product.save()
-                        line_total = round((unit_price * quantity_in_tiles),2)
-                    elif product.product_type == 'service':
-                        line_total = round(unit_price,2)
-                        service_products.append({'product_name': product.product_name,
-                                                    'unit_price': line_total})
-
-                    # Create invoice item
-                    InvoiceItem.objects.create(
-                        invoice=invoice,
-                        product=product,
-                        description=description,
-                        quantity=quantity_in_tiles,
-                        amount=line_total,
-                        unit_price=unit_price,
-                        created_by=request.user
-                    )
-                    
-                    # Accumulate total amount
-                    # total_amount += line_total
+                try:
+                    stock.reserve(reservations, 'invoice', invoice.id, invoice.bill_date)
+                except stock.InsufficientStock as e:
+                    transaction.set_rollback(True)
+                    return Response({"detail": str(e), "insufficient_stock": e.shortages}, status=status.HTTP_400_BAD_REQUEST)
+                except stock.InvalidStockChange as e:
+                    transaction.set_rollback(True)
+                    return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+                # COGS at the cost of the layers the invoice consumed
+                unit_costs = costing.document_unit_costs('invoice', invoice.id)
+                for line in transaction_products:
+                    line["unit_cost"] = unit_costs.get(line["product_id"], line["unit_cost"])
 
                 # Update the invoice's total amount after processing all items
                 # invoice.total_amount = total_amount
@@ -1543,7 +1337,8 @@ class CreateInvoiceView(APIView):
                                     user=request.user)
                 if not invoice_transactions:
                     log.app.error("Invoice Creation Failed | Error in creating transaction | ")
-                    return Response("Invoice Creation Failed due to errors in transactions", status=status.HTTP_400_BAD_REQUEST)
+                    transaction.set_rollback(True)
+                    return Response("Invoice Creation Failed due to errors in transactions", status=status.HTTP_500_INTERNAL_SERVER_ERROR)
                 invoice.save()
             audit_log_entry = audit_log(user=request.user,
                               action="Invoice created", 
@@ -1551,8 +1346,11 @@ class CreateInvoiceView(APIView):
                               model_name="Invoice", 
                               record_id=invoice.id)
             log.audit.success(f"Invoice created successfully | {invoice.id} | {request.user}")
-            return Response({"invoice_id": invoice.id, "message": "Invoice created successfully."}, status=status.HTTP_201_CREATED)
+            return Response({"invoice_id": invoice.id, "invoice_number": invoice.invoice_number, "message": "Invoice created successfully."}, status=status.HTTP_201_CREATED)
 
+        except numbering.SequenceBusy as e:
+            log.app.warning(f"{e} | Invoice creation")
+            return Response({"detail": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
         except Exception as e:
             log.trace.trace(f"Error occured while creating Invoice {traceback.format_exc()}")
             return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -1574,7 +1372,7 @@ class ListInvoicesView(APIView):
             return Response({"detail": "Invalid or expired token."}, status=status.HTTP_401_UNAUTHORIZED)
 
         invoices = Invoice.objects.filter(is_active=True).values(
-            "id", "customer__business_name", "customer__customer_id",  "customer_email", "customer__mobile_number", "total_amount", "unpaid_amount", "bill_date", "due_date", "payment_date", "payment_status"
+            "id", "invoice_number", "customer__business_name", "customer__customer_id",  "customer_email", "customer__mobile_number", "total_amount", "unpaid_amount", "bill_date", "due_date", "payment_date", "payment_status"
         ).order_by("-bill_date")
         invoice_list = list(invoices)  # Convert queryset to list of dicts
         return Response(invoice_list, status=status.HTTP_200_OK)
@@ -1599,7 +1397,7 @@ class ListCustomerInvoicesView(APIView):
             customer=customer_id, 
             payment_status__in=["unpaid","partially_paid"],
             is_active=True).values(
-            "id", "customer__business_name", "customer__customer_id",  
+            "id", "invoice_number", "customer__business_name", "customer__customer_id",  
             "customer_email", "customer__mobile_number", 
             "total_amount", "unpaid_amount", "bill_date", "paid_amount", "payment_date", 
             "due_date", "payment_status"
@@ -1628,6 +1426,7 @@ class RetrieveInvoiceView(APIView):
 
             invoice_data = {
                 "id": invoice.id,
+                "invoice_number": invoice.invoice_number,
                 "customer": invoice.customer.business_name,
                 "customer_id": invoice.customer.customer_id,
                 "customer_email": invoice.customer_email,
@@ -1759,6 +1558,7 @@ class UpdateInvoiceView(APIView):
                 invoice.tags = data.get("tags", invoice.tags)
                 invoice.terms = data.get("terms", invoice.terms)
                 invoice.bill_date = data.get("bill_date", invoice.bill_date)
+                stock.redate('invoice', invoice.id, invoice.bill_date)
                 invoice.due_date = data.get("due_date", invoice.due_date)
                 invoice.payment_date = data.get("payment_date", invoice.payment_date)
                 invoice.sum_amount = Decimal(data.get("sum_amount", invoice.sum_amount))
@@ -1775,6 +1575,7 @@ class UpdateInvoiceView(APIView):
 
                 updated_items = []
                 new_services = []
+                stock_changes = defaultdict(int)
                 # Process updated items
                 for item_data in items:
                     product_id = item_data['product_id']
@@ -1807,10 +1608,7 @@ class UpdateInvoiceView(APIView):
                                                       "quantity": quantity_in_tiles, 
                                                       "unit_price": unit_price,
                                                       "unit_cost": product.purchase_price})
-                                if product.stock_quantity < extra_needed:
-                                    return Response({"detail": f"Insufficient stock for product {product.product_name}."},
-                                                    status=status.HTTP_400_BAD_REQUEST)
-                                product.stock_quantity -= extra_needed
+                                stock_changes[product_id] -= extra_needed
                             elif quantity_in_tiles < original_quantity:
                                 # Less quantity requested; return the extra amount to inventory
                                 extra_returned = original_quantity - quantity_in_tiles
@@ -1819,14 +1617,13 @@ class UpdateInvoiceView(APIView):
                                                       "quantity": quantity_in_tiles, 
                                                       "unit_price": unit_price,
                                                       "unit_cost": product.purchase_price})
-                                product.stock_quantity += extra_returned
+                                stock_changes[product_id] += extra_returned
                             elif quantity_in_tiles == original_quantity:
                                 updated_items.append({"product_id": product_id, 
                                                       "product_name":product.product_name,
                                                       "quantity": quantity_in_tiles, 
                                                       "unit_price": unit_price,
                                                       "unit_cost": product.purchase_price})
-                            product.save()
                             # Update existing invoice item
                             invoice_item = InvoiceItem.objects.get(invoice=invoice, product=product)
                             invoice_item.quantity = quantity_in_tiles
@@ -1838,16 +1635,12 @@ class UpdateInvoiceView(APIView):
                             del original_product_map[product_id]
                         else:
                             # New product in the updated invoice; deduct its quantity
-                            if product.stock_quantity < quantity_in_tiles:
-                                return Response({"detail": f"Insufficient stock for new product {product.product_name}."},
-                                                status=status.HTTP_400_BAD_REQUEST)
-                            product.stock_quantity -= quantity_in_tiles
+                            stock_changes[product_id] -= quantity_in_tiles
                             updated_items.append({"product_id": product.id, 
                                                   "product_name": product.product_name,
                                                   "quantity": quantity_in_tiles, 
                                                   "unit_price": unit_price,
                                                   "unit_cost":product.purchase_price})
-                            product.save()
                             # Add new invoice item
                             InvoiceItem.objects.create(
                                 invoice=invoice,
@@ -1867,13 +1660,14 @@ class UpdateInvoiceView(APIView):
                             invoice_item.amount = round((new_quantity * unit_price),2)
                             invoice_item.save()
                             
-                            new_services.append({"product_name": product.product_name, "unit_price": unit_price})
+                            new_services.append({"product_id": product.id, "product_name": product.product_name, "unit_price": unit_price})
                             # Remove from the original_product_map after processing
                             del original_product_map[product_id]
                         else:
                            # Add new invoice item
-                            new_services.append({'product_name': product.product_name,
-                                                    'unit_price': unit_price})
+                            new_services.append({'product_id': product.id,
+                                                 'product_name': product.product_name,
+                                                 'unit_price': unit_price})
                             InvoiceItem.objects.create(
                                 invoice=invoice,
                                 product=product,
@@ -1887,12 +1681,25 @@ class UpdateInvoiceView(APIView):
                 # Handle products removed from the updated items
                 for removed_product_id, removed_quantity in original_product_map.items():
                     product = Product.objects.get(id=removed_product_id)
-                    product.stock_quantity += removed_quantity
-                    product.save()
+                    if product.product_type == 'product':
+                        stock_changes[product.id] += removed_quantity
 
                     # Remove the invoice item
                     InvoiceItem.objects.get(invoice=invoice, product=product).delete()
 
+                try:
+                    stock.adjust(stock_changes, 'invoice', invoice.id, invoice.bill_date)
+                except stock.InsufficientStock as e:
+                    transaction.set_rollback(True)
+                    return Response({"detail": str(e), "insufficient_stock": e.shortages}, status=status.HTTP_400_BAD_REQUEST)
+                except stock.InvalidStockChange as e:
+                    transaction.set_rollback(True)
+                    return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+                # COGS at the cost of the layers the invoice holds after the change
+                unit_costs = costing.document_unit_costs('invoice', invoice.id)
+                for line in updated_items:
+                    line["unit_cost"] = unit_costs.get(line["product_id"], line["unit_cost"])
+
                 # Update invoice details                
                 # invoice.sum_amount = sum(float(item['quantity']) * float(item['unit_price']) for item in updated_items)
                 # invoice.total_amount = Decimal(invoice.sum_amount) + Decimal(invoice.tax_amount)
@@ -1906,6 +1713,7 @@ class UpdateInvoiceView(APIView):
                                                             new_tax_amount=new_tax_amount,
                                                             user=request.user)
                 if not update_invoice:
+                    transaction.set_rollback(True)
                     return Response({"detail": "Failed to update invoice transactions."}, status=status.HTTP_400_BAD_REQUEST)
                 invoice.save()
 
@@ -1950,18 +1758,21 @@ class FinalizeInvoiceView(APIView):
             tax_amount = invoice.tax_amount
             transaction_products = []
             service_products = []  
+            unit_costs = costing.document_unit_costs('invoice', invoice.id)
             for item in invoice_items:
                 product = Product.objects.get(id=item.product.id)
                 quantity = float(item.quantity)
                 unit_price = float(item.unit_price)
                 if product.product_type == "product":
                     transaction_products.append({'quantity': quantity, 
+                                                "product_id": product.id,
                                                 "product_name": product.product_name,
                                                 "unit_price": unit_price,
-                                                "unit_cost": product.purchase_price})
+                                                "unit_cost": unit_costs.get(product.id, product.purchase_price)})
                 elif product.product_type == 'service':
                     line_total = unit_price
-                    service_products.append({'product_name': product.product_name,
+                    service_products.append({'product_id': product.id,
+                                                'product_name': product.product_name,
                                                 'unit_price': line_total})
             invoice_transactions = create_invoice_transaction(customer=customer, invoice_id=invoice.id, 
                                 products=transaction_products, 
@@ -1986,6 +1797,7 @@ class InvoicePaidView(APIView):
         except (jwt.ExpiredSignatureError, jwt.DecodeError, NewUser.DoesNotExist):
             return None
 
+    @idempotent
     def patch(self, request):
         """
         Mark one or more invoices as fully or partially paid, handle tracking, 
@@ -1998,8 +1810,10 @@ class InvoicePaidView(APIView):
 
             # Get the request data
             invoices_data = request.data.get("invoices", [])  # List of invoice IDs and amounts
-            payment_amount = Decimal(request.data.get("payment_amount"))
-            payment_amount = round(payment_amount, 2)
+            try:
+                payment_amount = round(Decimal(request.data.get("payment_amount")), 2)
+            except (InvalidOperation, TypeError):
+                return Response({"detail": "Invalid payment amount."}, status=status.HTTP_400_BAD_REQUEST)
             # payment_details = request.data.get("payment_details", {}) # JSON with method, transaction ID, etc.
             customer_id = request.data.get("customer_id")
             credit_account_id = request.data.get("credit_account_id")  # Bank/Cash account ID
@@ -2017,7 +1831,7 @@ class InvoicePaidView(APIView):
                 customer=customer,
                 defaults={'receivable_amount': Decimal("0.00"), 'advance_payment': Decimal("0.00")}
             )
-            accounts_recievable = Account.objects.get(code='AR-001')
+            accounts_recievable = registry.account_id(registry.RECEIVABLE)
             credit_account = Account.objects.get(id=credit_account_id, is_active=True)
 
             if use_advanced_payment:
@@ -2046,6 +1860,7 @@ class InvoicePaidView(APIView):
 
                     # Calculate payment for the invoice
                     if invoice.unpaid_amount == 0:
+                        db_transaction.set_rollback(True)
                         return Response({"Details":"Invoice are already paid"}, status=status.HTTP_400_BAD_REQUEST)
                     payment_for_invoice = min(allocated_amount, invoice.unpaid_amount)
 
@@ -2057,6 +1872,7 @@ class InvoicePaidView(APIView):
                     # Add to total allocated
                     total_allocated += payment_for_invoice
                     if total_allocated > payment_amount:
+                        db_transaction.set_rollback(True)
                         return Response({"detail": "Payment amount is insufficient for allocation."}, status=status.HTTP_400_BAD_REQUEST)
 
                     invoice.save()
@@ -2070,14 +1886,33 @@ class InvoicePaidView(APIView):
 
                 # Update receivable tracking
                 receivable.receivable_amount -= Decimal(total_allocated)
-                accounts_recievable.balance -= Decimal(total_allocated)
 
                 # Handle overpayment
                 overpayment = Decimal(payment_amount) - Decimal(total_allocated)
                 if overpayment > 0:
                     receivable.advance_payment += Decimal(overpayment)
 
-                transaction = Transaction.objects.create(
+                # Credit receivable for each invoice paid
+                lines = [
+                    posting.Line(accounts_recievable, credit=line["debit_amount"],
+                                 description=line["description"], invoice_id=line.get("invoice_id"))
+                    for line in transactions_to_log
+                ]
+                if overpayment > 0:
+                    # Unallocated money is held as a credit on the customer's receivable
+                    lines.append(posting.Line(accounts_recievable, credit=overpayment,
+                                              description=f"Advance payment from customer {customer.business_name}"))
+                if use_advanced_payment:
+                    # The advance was already received; move it off the receivable credit instead of the bank
+                    lines.append(posting.Line(accounts_recievable, debit=payment_amount,
+                                              description=f"Advance payment applied for customer {customer.business_name}"))
+                else:
+                    # Log credit to bank/cash account
+                    lines.append(posting.Line(credit_account, debit=payment_amount,
+                                              description=f"Payment credited for customer {customer.business_name}"))
+
+                transaction = posting.post_transaction(
+                    lines,
                     reference_number=f"PAY-{uuid.uuid4().hex[:6].upper()}",
                     transaction_type="income",
                     date=invoice_payment_date,
@@ -2087,26 +1922,6 @@ class InvoicePaidView(APIView):
                     created_by=user,
                 )
 
-                # Log each transaction line
-                for line in transactions_to_log:
-                    TransactionLine.objects.create(
-                        transaction=transaction,
-                        account=Account.objects.get(code="AR-001"),
-                        description=line["description"],
-                        debit_amount=line['credit_amount'],
-                        credit_amount=line["debit_amount"],
-                        invoice_id=line.get("invoice_id"),
-                    )
-
-                # Log credit to bank/cash account
-                TransactionLine.objects.create(
-                    transaction=transaction,
-                    account=credit_account,
-                    description=f"Payment credited for customer {customer.business_name}",
-                    debit_amount=payment_amount,
-                    credit_amount=0,
-                )
-
                 # Save payment details in CustomerPaymentDetail
                 CustomerPaymentDetails.objects.create(
                     customer=customer,
@@ -2118,7 +1933,6 @@ class InvoicePaidView(APIView):
                     payment_date=datetime.now(),
                     payment_amount=payment_amount,
                 )
-                credit_account.balance += Decimal(payment_amount)
                 for line in transactions_to_log:
                     InvoiceTransactionMapping.objects.create(
                         transaction=transaction,
@@ -2129,9 +1943,6 @@ class InvoicePaidView(APIView):
 
                 receivable.save()
 
-                credit_account.save()
-                accounts_recievable.save()
-
             # Log and return response
             log.audit.success(f"Payments applied for customer {customer.business_name} | User: {user}")
             return Response({"detail": f"Payment processed successfully for customer {customer.business_name}."}, status=status.HTTP_200_OK)
@@ -2151,7 +1962,7 @@ class InvoicePaidView(APIView):
         except Exception as e:
             log.app.error(f"Error processing payment: {str(e)}")
             log.trace.trace(f"Error processing invoice payments {traceback.format_exc()}")
-            return Response({"detail": "Error processing payment."}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({"detail": "Error processing payment."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 class InvoiceDeleteView(APIView):
@@ -2848,6 +2659,7 @@ class CreateEstimateView(APIView):
                 # Create temporary invoice
                 estimate = Estimate.objects.create(
                     customer=customer,
+                    estimate_number=numbering.take('estimate', request.user, data.get("estimate_number")),
                     date=timezone.now(),
                     total_amount=total_amount,
                     created_by=request.user,
@@ -2896,8 +2708,11 @@ class CreateEstimateView(APIView):
                 estimate.total_amount = total_amount
                 estimate.save()
 
-            return Response({"estimate_id": estimate.id, "message": "estimate created successfully."}, status=status.HTTP_201_CREATED)
+            return Response({"estimate_id": estimate.id, "estimate_number": estimate.estimate_number, "message": "estimate created successfully."}, status=status.HTTP_201_CREATED)
 
+        except numbering.SequenceBusy as e:
+            log.app.warning(f"{e} | Estimate creation")
+            return Response({"detail": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
         except Exception as e:
             return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -2913,6 +2728,7 @@ class CreateBillView(APIView):
         except (jwt.ExpiredSignatureError, jwt.DecodeError, NewUser.DoesNotExist):
             return None
 
+    @idempotent
     def post(self, request):
         user = self.get_user_from_token(request)
         data = request.data
@@ -2929,7 +2745,6 @@ class CreateBillView(APIView):
                 vendor = Vendor.objects.get(vendor_id=vendor_id)
                 data = request.data
 
-                bill_number = data.get("bill_number")
                 mailing_address_street_1 = data.get("mailing_address_street_1","")
                 mailing_address_street_2 = data.get("mailing_address_street_2","")
                 mailing_address_city = data.get("mailing_address_city","")
@@ -2948,46 +2763,14 @@ class CreateBillView(APIView):
                     payment_status = payment_status.lower()
                 else:
                     payment_status = "unpaid"
-                attachments = request.FILES.get("attachments")
-
-                if attachments:
-                    extension = os.path.splitext(attachments.name)[1]  # Get the file extension
-                    short_unique_filename = generate_short_unique_filename(extension)
-                    fs = FileSystemStorage(location=os.path.join(settings.MEDIA_ROOT, 'bill_attachments'))
-                    logo_path = fs.save(short_unique_filename, attachments)
-                    attachments_url = posixpath.join('media/bill_attachments', logo_path)
-                else:
-                    attachments_url = ""
-
-                # Create temporary invoice
-                bill = Bill.objects.create(
-                    vendor=vendor,
-                    mailing_address_street_1 = mailing_address_street_1,
-                    mailing_address_street_2 = mailing_address_street_2,
-                    mailing_address_city = mailing_address_city,
-                    mailing_address_state = mailing_address_state,
-                    mailing_address_postal_code = mailing_address_postal_code,
-                    mailing_address_country = mailing_address_country,
-                    tags = tags,
-                    terms = terms,
-                    bill_number = bill_number,
-                    bill_date = bill_date, 
-                    due_date = due_date,
-                    memo = memo,
-                    payment_status = payment_status,
-                    total_amount=total_amount,
-                    paid_amount=0,
-                    unpaid_amount=total_amount,
-                    attachments=attachments_url,
-                    created_date=timezone.now(),
-                    created_by=request.user,
-                    is_active=True  # Mark as temporary
-                )
 
                 # Process each item in the invoice
                 inv_total_amount = 0
                 transaction_products = []
                 service_products = []
+                received_quantities = defaultdict(int)
+                bill_items = []
+                receipts = []
                 for item_data in items:
                     product = Product.objects.get(id=item_data['product_id'])
                     if product.product_type == "product":
@@ -3006,20 +2789,12 @@ class CreateBillView(APIView):
                         else:
                             quantity_in_tiles = quantity  # Assume 'box' is the base unit
 
-                        #calculating weighted average
-                        current_stock_value = Decimal(product.stock_quantity) * Decimal(product.purchase_price)
-                        new_stock_value = Decimal(quantity_in_tiles) * Decimal(unit_price)
-                        total_stock_value = current_stock_value + new_stock_value
-                        total_stock_quantity = Decimal(product.stock_quantity) + Decimal(quantity_in_tiles)
-                        weighted_average = round(total_stock_value / total_stock_quantity, 2)
-                        product.purchase_price = weighted_average
-
-                        # Deduct stock and calculate the line total
-                        product.stock_quantity += quantity_in_tiles
+                        # Stock is added below; the received quantity becomes a cost layer at the bill price
                         transaction_products.append({'quantity': quantity_in_tiles, 
                                                     "product_name": product.product_name,
                                                     "unit_price": unit_price})
-                        product.save()
+                        received_quantities[product.id] += quantity_in_tiles
+                        receipts.append((product.id, quantity_in_tiles, unit_price))
                         line_total = unit_price * quantity_in_tiles
                     elif product.product_type == 'service':
                         quantity = float(item_data['quantity'])
@@ -3030,26 +2805,86 @@ class CreateBillView(APIView):
                         service_products.append({'service_name': product.product_name,
                                                     'unit_price': unit_price})                        
 
-                    # Create invoice item
-                    BillItems.objects.create(
-                        bill=bill,
+                    # Bill items are inserted together once the bill exists
+                    bill_items.append(BillItems(
                         product=product,
                         quantity=quantity_in_tiles,  # Store as selected unit (pallets, boxes, sqf, etc.)
                         description=description,
                         unit_price=unit_price,
                         created_by=request.user
-                    )
+                    ))
                     
                     # Accumulate total amount
                     inv_total_amount += line_total
 
+                # Accounts payable is credited with total_amount and the lines are debited per item,
+                # so they must agree before a number is allocated or stock is received
+                expected_total = bill_total(transaction_products, service_products)
+                if invoice_ledger.round_amount(total_amount) != expected_total:
+                    return Response({
+                        "detail": f"Total amount {invoice_ledger.round_amount(total_amount)} does not match "
+                                  f"the items ({expected_total}).",
+                        "total_amount": invoice_ledger.round_amount(total_amount),
+                        "expected_total": expected_total,
+                    }, status=status.HTTP_400_BAD_REQUEST)
+
+                bill_number = data.get("bill_number")
+                if not bill_number:
+                    bill_number = numbering.allocate('bill')
+                else:
+                    # a number reserved from the bill sequence; a vendor's own bill number is kept as given
+                    numbering.use('bill', bill_number, request.user)
+                attachments = request.FILES.get("attachments")
+
+                if attachments:
+                    extension = os.path.splitext(attachments.name)[1]  # Get the file extension
+                    short_unique_filename = generate_short_unique_filename(extension)
+                    fs = FileSystemStorage(location=os.path.join(settings.MEDIA_ROOT, 'bill_attachments'))
+                    logo_path = fs.save(short_unique_filename, attachments)
+                    attachments_url = posixpath.join('media/bill_attachments', logo_path)
+                else:
+                    attachments_url = ""
+
+                # Create temporary invoice
+                bill = Bill.objects.create(
+                    vendor=vendor,
+                    mailing_address_street_1 = mailing_address_street_1,
+                    mailing_address_street_2 = mailing_address_street_2,
+                    mailing_address_city = mailing_address_city,
+                    mailing_address_state = mailing_address_state,
+                    mailing_address_postal_code = mailing_address_postal_code,
+                    mailing_address_country = mailing_address_country,
+                    tags = tags,
+                    terms = terms,
+                    bill_number = bill_number,
+                    bill_date = bill_date, 
+                    due_date = due_date,
+                    memo = memo,
+                    payment_status = payment_status,
+                    total_amount=total_amount,
+                    paid_amount=0,
+                    unpaid_amount=total_amount,
+                    attachments=attachments_url,
+                    created_date=timezone.now(),
+                    created_by=request.user,
+                    is_active=True  # Mark as temporary
+                )
+
+                for bill_item in bill_items:
+                    bill_item.bill = bill
+                BillItems.objects.bulk_create(bill_items)
+
+                # One locked update for all received products; purchase price becomes the average cost on hand
+                stock.adjust(received_quantities, 'bill', bill.id, bill.bill_date, receipts=receipts)
+
                 # Update the invoice's total amount after processing all items
                 # invoice.total_amount = total_amount
                 bill_payment = create_bill_transaction(bill_id=bill.id, vendor=vendor, products=transaction_products, services=service_products,
                                                        total_amount=total_amount, user=request.user)
                 if not bill_payment:
                     log.app.error("Bill Creation Failed | Error in creating transaction | ")
-                    return Response("Bill Creation Failed due to errors in transactions", status=status.HTTP_400_BAD_REQUEST)
+                    transaction.set_rollback(True)
+                    return Response("Bill Creation Failed due to errors in transactions", status=status.HTTP_500_INTERNAL_SERVER_ERROR)
                 bill.save()
 
             audit_log_entry = audit_log(user=request.user,
@@ -3060,9 +2895,15 @@ class CreateBillView(APIView):
             log.audit.success(f"Bill created successfully | {bill.id} | {user}")
             return Response({"bill_id":bill.id, "bill_number": bill.bill_number, "message": "Bill created successfully."}, status=status.HTTP_201_CREATED)
 
+        except (Vendor.DoesNotExist, Product.DoesNotExist, stock.InvalidStockChange) as e:
+            log.app.error(f"{e} | Bill creation")
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except numbering.SequenceBusy as e:
+            log.app.warning(f"{e} | Bill creation")
+            return Response({"detail": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
         except Exception as e:
             log.trace.trace(f"Error occured while creating bill, {traceback.format_exc()}")
-            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 class ListBillsView(APIView):
@@ -3229,6 +3070,7 @@ class BillPaidView(APIView):
         except (jwt.ExpiredSignatureError, jwt.DecodeError, NewUser.DoesNotExist):
             return None
 
+    @idempotent
     def patch(self, request):
         """
         Mark one or more bills as fully or partially paid, handle tracking, 
@@ -3241,8 +3083,10 @@ class BillPaidView(APIView):
 
             # Get the request data
             bills_data = request.data.get("bills", [])  # List of bill IDs and amounts
-            payment_amount = Decimal(request.data.get("payment_amount"))
-            payment_amount = round(payment_amount,2)
+            try:
+                payment_amount = round(Decimal(request.data.get("payment_amount")), 2)
+            except (InvalidOperation, TypeError):
+                return Response({"detail": "Invalid payment amount."}, status=status.HTTP_400_BAD_REQUEST)
             vendor_id = request.data.get("vendor_id")
             debit_account_id = request.data.get("debit_account_id")  # Bank/Cash account ID
             use_advanced_payment = request.data.get("use_advanced_payment", False)
@@ -3254,7 +3098,7 @@ class BillPaidView(APIView):
             vendor = Vendor.objects.get(vendor_id=vendor_id, is_active=True)
             payable, created = PayableTracking.objects.get_or_create(vendor=vendor,
                     defaults={'payable_amount': Decimal("0.00"), 'advance_payment': Decimal("0.00")})
-            accounts_payable = Account.objects.get(code='AP-001', is_active=True)
+            accounts_payable = registry.account_id(registry.PAYABLE)
             debit_account = Account.objects.get(id=debit_account_id, is_active=True)
 
             if use_advanced_payment:
@@ -3282,6 +3126,7 @@ class BillPaidView(APIView):
 
                     # Calculate payment for the bill
                     if bill.unpaid_amount == 0:
+                        db_transaction.set_rollback(True)
                         return Response({"Details": "Bill is already paid."}, status=status.HTTP_400_BAD_REQUEST)
                     payment_for_bill = min(allocated_amount, bill.unpaid_amount)
 
@@ -3294,6 +3139,7 @@ class BillPaidView(APIView):
                     # Add to total allocated
                     total_allocated += payment_for_bill
                     if total_allocated > payment_amount:
+                        db_transaction.set_rollback(True)
                         return Response({"detail": "Payment amount is insufficient for allocation."}, status=status.HTTP_400_BAD_REQUEST)
                     bill.save()
 
@@ -3308,14 +3154,33 @@ class BillPaidView(APIView):
 
                 # Update payable tracking
                 payable.payable_amount -= Decimal(total_allocated)
-                accounts_payable.balance -= Decimal(total_allocated)
 
                 # Handle overpayment
                 overpayment = Decimal(payment_amount) - Decimal(total_allocated)
                 if overpayment > 0:
                     payable.advance_payment += Decimal(overpayment)
 
-                transaction = Transaction.objects.create(
+                # Debit payable for each bill paid
+                lines = [
+                    posting.Line(accounts_payable, debit=line["credit_amount"],
+                                 description=line["description"], bill_id=line.get("bill_id"))
+                    for line in transactions_to_log
+                ]
+                if overpayment > 0:
+                    # Unallocated money is held as a debit on the vendor's payable
+                    lines.append(posting.Line(accounts_payable, debit=overpayment,
+                                              description=f"Advance payment to vendor {vendor.business_name}"))
+                if use_advanced_payment:
+                    # The advance was already paid out; move it off the payable debit instead of the bank
+                    lines.append(posting.Line(accounts_payable, credit=payment_amount,
+                                              description=f"Advance payment applied for vendor {vendor.business_name}"))
+                else:
+                    # Log debit from bank/cash account
+                    lines.append(posting.Line(debit_account, credit=payment_amount,
+                                              description=f"Payment debited for vendor {vendor.business_name}"))
+
+                transaction = posting.post_transaction(
+                    lines,
                     reference_number=f"PAY-{uuid.uuid4().hex[:6].upper()}",
                     transaction_type="expense",
                     date=bill_payment_date,
@@ -3325,26 +3190,6 @@ class BillPaidView(APIView):
                     created_by=user,
                 )
 
-                # Log each transaction line
-                for line in transactions_to_log:
-                    TransactionLine.objects.create(
-                        transaction=transaction,
-                        account=Account.objects.get(code="AP-001"),
-                        description=f"Payment for bill {bill.id}",
-                        debit_amount=line.get("credit_amount"),
-                        credit_amount=0,
-                        bill_id=line.get("bill_id"),
-                    )
-
-                # Log debit from bank/cash account
-                TransactionLine.objects.create(
-                    transaction=transaction,
-                    account=debit_account,
-                    description=f"Payment debited for vendor {vendor.business_name}",
-                    credit_amount=payment_amount,
-                    debit_amount=0,
-                )
-
                 # Save payment details in VendorPaymentDetail
                 VendorPaymentDetails.objects.create(
                     vendor=vendor,
@@ -3356,7 +3201,6 @@ class BillPaidView(APIView):
                     payment_date=datetime.now(),
                     payment_amount=payment_amount,
                 )
-                debit_account.balance -= Decimal(payment_amount)
                 payable.save()
 
                 for line in transactions_to_log:
@@ -3367,9 +3211,6 @@ class BillPaidView(APIView):
                         is_active=True
                     )
 
-                debit_account.save()
-                accounts_payable.save()
-
             # Log and return response
             log.audit.success(f"Payments applied for vendor {vendor.business_name} | User: {user}")
             return Response({"detail": f"Payment processed successfully for vendor {vendor.business_name}."}, status=status.HTTP_200_OK)
@@ -3389,7 +3230,7 @@ class BillPaidView(APIView):
         except Exception as e:
             log.app.error(f"Error processing payment: {str(e)}")
             log.trace.trace(f"Error processing bill payments {traceback.format_exc()}")
-            return Response({"detail": "Error processing payment."}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({"detail": "Error processing payment."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 class CreateLostProductView(APIView):
@@ -3413,19 +3254,15 @@ class CreateLostProductView(APIView):
             # Calculate total loss
             total_loss = quantity_lost * unit_cost
 
-            # Deduct lost quantity from product stock
             if product.stock_quantity < quantity_lost:
                 log.app.error(f"Insufficient stock for product {product.product_name}")
                 return Response({"detail": "Insufficient stock for product."}, status=status.HTTP_400_BAD_REQUEST)
-            product.stock_quantity -= quantity_lost
-            product.save()
 
             # Fetch relevant accounts
-            inventory_account = Account.objects.get(code='INV-001', is_active=True)
-            loss_account = Account.objects.get(code='MIS-001', is_active=True)
+            inventory_account, loss_account = registry.account_ids(registry.INVENTORY, registry.MISCELLANEOUS_LOSS)
 
             with transaction.atomic():
-                # Create a new transaction
+                # Create a new transaction; its lines are posted once the loss is costed
                 transaction_obj = Transaction.objects.create(
                     description=f"Loss of product {product.product_name}",
                     created_by=created_by,
@@ -3447,28 +3284,18 @@ class CreateLostProductView(APIView):
                     created_by=created_by,
                 )
 
-                # Create transaction lines
-                TransactionLine.objects.create(
-                    transaction=transaction_obj,
-                    account=loss_account,
-                    debit_amount=total_loss,
-                    credit_amount=0,
-                    description=f"Loss due to {reason} for product {product.product_name}",
-                )
+                # Deduct lost quantity from product stock and cost it from the consumed layers
+                stock.adjust({product.id: -quantity_lost}, 'loss', lost_product.id, lost_product.loss_date)
+                _, total_loss = costing.document_costs('loss', lost_product.id).get(product.id, (0, Decimal('0.00')))
+                unit_cost = (total_loss / quantity_lost).quantize(Decimal('0.01')) if quantity_lost else unit_cost
+                LostProduct.objects.filter(id=lost_product.id).update(unit_cost=unit_cost, total_loss=total_loss)
 
-                TransactionLine.objects.create(
-                    transaction=transaction_obj,
-                    account=inventory_account,
-                    debit_amount=0,
-                    credit_amount=total_loss,
-                    description=f"Inventory adjustment for lost product {product.product_name}",
-                )
-
-                # Update account balances
-                loss_account.balance += total_loss
-                inventory_account.balance -= total_loss
-                loss_account.save()
-                inventory_account.save()
+                posting.post_lines(transaction_obj, [
+                    posting.Line(loss_account, debit=total_loss,
+                                 description=f"Loss due to {reason} for product {product.product_name}"),
+                    posting.Line(inventory_account, credit=total_loss,
+                                 description=f"Inventory adjustment for lost product {product.product_name}"),
+                ])
 
             # Prepare response
             response_data = {
@@ -3576,57 +3403,36 @@ class UpdateLostProductView(APIView):
             invoice = Invoice.objects.get(id=invoice_id) if invoice_id else None
             transaction_obj = Transaction.objects.get(id=lost_product.transaction.id)
 
-            unit_cost = product.purchase_price
-
-            # Calculate new total loss
-            new_total_loss = quantity_lost * unit_cost
+            # The loss keeps its cost unless the quantity changes
+            unit_cost = lost_product.unit_cost
+            new_total_loss = lost_product.total_loss
 
             # Adjust inventory and financial transactions if quantity_lost or unit_cost changes
             if quantity_lost != lost_product.quantity_lost:
                 # Fetch relevant accounts
-                inventory_account = Account.objects.get(code='INV-001')
-                loss_account = Account.objects.get(code='MIS-001')
-
-                # Reverse the old transaction
-                old_total_loss = lost_product.total_loss
-                inventory_account.balance += old_total_loss
-                loss_account.balance -= old_total_loss
-                inventory_account.save()
-                loss_account.save()
-
-                # Deduct new lost quantity from product stock
-                product.stock_quantity += lost_product.quantity_lost  # Reverse old deduction
-                product.stock_quantity -= quantity_lost  # Apply new deduction
-                product.save()
-
-                # Create a new transaction for the updated loss
-                transaction_obj.description = f"Updated loss of product {product.product_name}"
-
-                old_transaction_lines = TransactionLine.objects.filter(transaction=transaction_obj, is_active=True).delete()
-
-                # Create transaction lines
-                TransactionLine.objects.create(
-                    transaction=transaction_obj,
-                    account=loss_account,
-                    debit_amount=new_total_loss,
-                    credit_amount=0,
-                    description=f"Updated loss due to {reason} for product {product.product_name}",
-                )
-
-                TransactionLine.objects.create(
-                    transaction=transaction_obj,
-                    account=inventory_account,
-                    debit_amount=0,
-                    credit_amount=new_total_loss,
-                    description=f"Updated inventory adjustment for lost product {product.product_name}",
-                )
-
-                # Update account balances
-                loss_account.balance += new_total_loss
-                inventory_account.balance -= new_total_loss
-                loss_account.save()
-                transaction_obj.save()
-                inventory_account.save()
+                inventory_account, loss_account = registry.account_ids(registry.INVENTORY, registry.MISCELLANEOUS_LOSS)
+
+                with transaction.atomic():
+                    # Reverse the old deduction and apply the new one, then re-cost the loss
+                    stock.adjust({product.id: lost_product.quantity_lost - quantity_lost}, 'loss', lost_product.id,
+                                 lost_product.loss_date)
+                    _, new_total_loss = costing.document_costs('loss', lost_product.id).get(product.id, (0, Decimal('0.00')))
+                    unit_cost = (new_total_loss / quantity_lost).quantize(Decimal('0.01')) if quantity_lost else unit_cost
+
+                    # Reverse the old lines and post the updated loss on the same transaction
+                    transaction_obj.description = f"Updated loss of product {product.product_name}"
+                    transaction_obj.save()
+
+                    old_transaction_lines = TransactionLine.objects.filter(transaction=transaction_obj)
+                    posting.reverse_lines(old_transaction_lines)
+                    old_transaction_lines.delete()
+
+                    posting.post_lines(transaction_obj, [
+                        posting.Line(loss_account, debit=new_total_loss,
+                                     description=f"Updated loss due to {reason} for product {product.product_name}"),
+                        posting.Line(inventory_account, credit=new_total_loss,
+                                     description=f"Updated inventory adjustment for lost product {product.product_name}"),
+                    ])
 
             # Update the LostProduct entry
             lost_product.product = product
@@ -3675,23 +3481,16 @@ class DeleteLostProductView(APIView):
             # Fetch the existing LostProduct entry
             lost_product = LostProduct.objects.get(id=id)
 
-            # Fetch relevant accounts
-            inventory_account = Account.objects.get(code='INV-001')
-            loss_account = Account.objects.get(code='MIS-001')
-
             transaction_details = Transaction.objects.filter(id=lost_product.transaction.id, is_active=True).first()
-            transaction_lines = TransactionLine.objects.filter(transaction=transaction_details, is_active=True) 
+            transaction_lines = TransactionLine.objects.filter(transaction=transaction_details)
             # Reverse the inventory and financial transactions
             with transaction.atomic():
-                # Reverse inventory deduction
-                lost_product.product.stock_quantity += lost_product.quantity_lost
-                lost_product.product.save()
+                # Reverse inventory deduction, returning the stock to the cost layers it came from
+                stock.adjust({lost_product.product_id: lost_product.quantity_lost}, 'loss', lost_product.id,
+                             lost_product.loss_date)
 
                 # Reverse account balances
-                inventory_account.balance += lost_product.total_loss
-                loss_account.balance -= lost_product.total_loss
-                inventory_account.save()
-                loss_account.save()
+                posting.reverse_lines(transaction_lines)
                 # Delete the LostProduct entry
                 lost_product.delete()
                 transaction_lines.delete()
@@ -3718,90 +3517,8 @@ class InventoryHistoryReportView(APIView):
         else:
             return Response({"error": "Please provide start_date and end_date parameters."})
         
-        # Fetching all relevant transactions
-        sales = InvoiceItem.objects.filter(invoice__bill_date__range=[start_date, end_date])
-        purchases = BillItems.objects.filter(bill__bill_date__range=[start_date, end_date])
-        losses = LostProduct.objects.filter(loss_date__range=[start_date, end_date])
-        
-        report_data = []
-        
-        # Calculating initial inventory
-        initial_inventory = {}
-        for product in Product.objects.filter(product_type="product"):
-            initial_stock = 0
-            # initial_stock = product.stock_quantity
-            # Adjust initial stock based on transactions before the start date
-            previous_purchases = BillItems.objects.filter(bill__bill_date__lt=start_date, product=product)
-            previous_sales = InvoiceItem.objects.filter(invoice__bill_date__lt=start_date, product=product)
-            previous_losses = LostProduct.objects.filter(loss_date__lt=start_date, product=product)
-            
-            for purchase in previous_purchases:
-                initial_stock += purchase.quantity
-            for sale in previous_sales:
-                initial_stock -= sale.quantity
-            for loss in previous_losses:
-                initial_stock -= loss.quantity_lost
-            
-            initial_inventory[product.product_name] = initial_stock
-        
-        # Processing transactions
-        for sale in sales:
-            transaction = {
-                'date': sale.invoice.bill_date.date(),
-                'type': 'Sale',
-                'product_name': sale.product.product_name,
-                'quantity': -sale.quantity,  # Negative for sales
-                'unit_price': sale.unit_price,
-            }
-            report_data.append(transaction)
-        
-        for purchase in purchases:
-            transaction = {
-                'date': purchase.bill.bill_date.date(),
-                'type': 'Purchase',
-                'product_name': purchase.product.product_name,
-                'quantity': purchase.quantity,  # Positive for purchases
-                'unit_price': purchase.unit_price,
-            }
-            report_data.append(transaction)
-        
-        for loss in losses:
-            transaction = {
-                'date': loss.loss_date,
-                'type': 'Loss',
-                'product_name': loss.product.product_name,
-                'quantity': -loss.quantity_lost,  # Negative for losses
-                'unit_price': loss.unit_cost,
-            }
-            report_data.append(transaction)
-        
-        # Sorting transactions by date
-        report_data.sort(key=lambda x: x['date'])
-        
-        # Calculating closing inventory
-        closing_inventory = {}
-        for product in Product.objects.filter(product_type="product"):
-            closing_stock = initial_inventory.get(product.product_name, 0)
-            # Adjust closing stock based on transactions within the period
-            period_purchases = BillItems.objects.filter(bill__bill_date__range=[start_date, end_date], product=product)
-            period_sales = InvoiceItem.objects.filter(invoice__bill_date__range=[start_date, end_date], product=product)
-            period_losses = LostProduct.objects.filter(loss_date__range=[start_date, end_date], product=product)
-            
-            for purchase in period_purchases:
-                closing_stock += purchase.quantity
-            for sale in period_sales:
-                closing_stock -= sale.quantity
-            for loss in period_losses:
-                closing_stock -= loss.quantity_lost
-            
-            closing_inventory[product.product_name] = closing_stock
-        
-        # Combining initial inventory, transactions, and closing inventory into the report
-        report = {
-            'initial_inventory': initial_inventory,
-            'transactions': report_data,
-            'closing_inventory': closing_inventory,
-        }
+        # Opening stock, transactions and closing stock from the shared history engine
+        report = history.inventory_history(start_date, end_date)
         
         return Response(report)
 
@@ -3818,82 +3535,10 @@ class InventoryHistoryXLSXReportView(APIView):
         else:
             return Response({"error": "Please provide start_date and end_date parameters."})
         
-        # Fetching all relevant transactions
-        sales = InvoiceItem.objects.filter(invoice__bill_date__range=[start_date, end_date])
-        purchases = BillItems.objects.filter(bill__bill_date__range=[start_date, end_date])
-        losses = LostProduct.objects.filter(loss_date__range=[start_date, end_date])
-        
-        report_data = []
-        
-        # Calculating initial inventory
-        initial_inventory = {}
-        for product in Product.objects.filter(product_type="product"):
-            initial_stock = 0
-            # Adjust initial stock based on transactions before the start date
-            previous_purchases = BillItems.objects.filter(bill__bill_date__lt=start_date, product=product)
-            previous_sales = InvoiceItem.objects.filter(invoice__bill_date__lt=start_date, product=product)
-            previous_losses = LostProduct.objects.filter(loss_date__lt=start_date, product=product)
-            
-            for purchase in previous_purchases:
-                initial_stock += purchase.quantity
-            for sale in previous_sales:
-                initial_stock -= sale.quantity
-            for loss in previous_losses:
-                initial_stock -= loss.quantity_lost
-            
-            initial_inventory[product.product_name] = initial_stock
-        
-        # Processing transactions
-        for sale in sales:
-            transaction = {
-                'date': sale.invoice.bill_date.date(),
-                'type': 'Sale',
-                'product_name': sale.product.product_name,
-                'quantity': -sale.quantity,  # Negative for sales
-                'unit_price': sale.unit_price,
-            }
-            report_data.append(transaction)
-        
-        for purchase in purchases:
-            transaction = {
-                'date': purchase.bill.bill_date.date(),
-                'type': 'Purchase',
-                'product_name': purchase.product.product_name,
-                'quantity': purchase.quantity,  # Positive for purchases
-                'unit_price': purchase.unit_price,
-            }
-            report_data.append(transaction)
-        
-        for loss in losses:
-            transaction = {
-                'date': loss.loss_date,
-                'type': 'Loss',
-                'product_name': loss.product.product_name,
-                'quantity': -loss.quantity_lost,  # Negative for losses
-                'unit_price': loss.unit_cost,
-            }
-            report_data.append(transaction)
-        
-        # Sorting transactions by date
-        report_data.sort(key=lambda x: x['date'])
-        
-        # Calculating closing inventory
-        closing_inventory = {}
-        for product in Product.objects.filter(product_type="product"):
-            closing_stock = initial_inventory.get(product.product_name, 0)
-            # Adjust closing stock based on transactions within the period
-            period_purchases = BillItems.objects.filter(bill__bill_date__range=[start_date, end_date], product=product)
-            period_sales = InvoiceItem.objects.filter(invoice__bill_date__range=[start_date, end_date], product=product)
-            period_losses = LostProduct.objects.filter(loss_date__range=[start_date, end_date], product=product)
-            
-            for purchase in period_purchases:
-                closing_stock += purchase.quantity
-            for sale in period_sales:
-                closing_stock -= sale.quantity
-            for loss in period_losses:
-                closing_stock -= loss.quantity_lost
-            
-            closing_inventory[product.product_name] = closing_stock
+        report = history.inventory_history(start_date, end_date)
+        initial_inventory = report['initial_inventory']
+        report_data = report['transactions']
+        closing_inventory = report['closing_inventory']
             
         # Create Excel file using pandas
         output = io.BytesIO()
@@ -3951,105 +3596,186 @@ class InventoryHistoryXLSXReportView(APIView):
         return response
 
 
-class DetailedInventoryReportView(APIView):
+class StockAsOfView(APIView):
+    """Stock of every stocked product at the end of a given day (`?date=YYYY-MM-DD`, today by default)."""
+    permission_classes = [IsAuthenticated]
+
     def get(self, request):
-        products = Product.objects.filter(product_type="product",is_active=True)
-        inventory_data = []
-        total_inventory_value = 0
-        
-        for product in products:
-            item = {
-                'product_name': product.product_name,
-                'sku': product.sku,
-                'barcode': product.barcode,
-                'stock_quantity': product.stock_quantity,
-                'stock_purchase_price': product.purchase_price,
-                'stock_value': round(Decimal(product.stock_quantity * product.purchase_price), 2),
-                'reorder_level': product.reorder_level,
-                'batch_lot_number': product.batch_lot_number,
-                'as_on_date': product.as_on_date,
-                'specifications': product.specifications,
-                'description': product.purchase_description,
-                'tags': product.tags,
-                'images': product.images,
-            }
-            inventory_data.append(item)
-            total_inventory_value += item['stock_value']
-        
-        return Response(inventory_data)
+        try:
+            as_of = request.GET.get('date')
+            try:
+                as_of = datetime.strptime(as_of, '%Y-%m-%d').date() if as_of else timezone.localdate()
+            except ValueError:
+                return Response({"error": "date must be in YYYY-MM-DD format."}, status=status.HTTP_400_BAD_REQUEST)
+
+            products = Product.objects.filter(product_type="product")
+            quantities = stock.quantities_as_of(as_of, products)
+            data = [{
+                'product_id': product_id,
+                'product_name': product_name,
+                'sku': sku,
+                'stock_quantity': quantities.get(product_id, 0),
+            } for product_id, product_name, sku in products.order_by('product_name').values_list('id', 'product_name', 'sku')]
+            return Response({'date': as_of, 'products': data}, status=status.HTTP_200_OK)
+        except Exception as e:
+            log.trace.trace(f"Error occurred while fetching stock as of date, {traceback.format_exc()}")
+            return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class StockMovementListView(APIView):
+    """Stock movements of one product in a date range, with the opening stock and the running quantity."""
+    permission_classes = [IsAuthenticated]
 
-class DetailedInventoryReportExcelExportView(APIView):
     def get(self, request):
+        product_id = request.GET.get('product_id')
+        if not product_id:
+            return Response({"error": "product_id is required as a query parameter."}, status=status.HTTP_400_BAD_REQUEST)
+        product = get_object_or_404(Product, id=product_id)
         try:
-            # Fetch active products of type "product"
-            products = Product.objects.filter(product_type="product", is_active=True)
-            
-            # Prepare inventory data
-            inventory_data = []
-            total_inventory_value = 0
-            
-            for product in products:
-                try:
-                    # Calculate stock value
-                    stock_value = round(Decimal(product.stock_quantity * product.purchase_price), 2)
-                    
-                    # Prepare item data
-                    item = {
-                        'Product Name': product.product_name,
-                        'UPC': product.sku,
-                        'Item Code': product.barcode,
-                        'Stock Quantity': product.stock_quantity,
-                        'Purchase Price': float(product.purchase_price),  # Convert Decimal to float for Excel
-                        'Stock Value': float(stock_value),  # Convert Decimal to float for Excel
-                        'Reorder Level': product.reorder_level,
-                        'Batch/Lot Number': product.batch_lot_number,
-                        'As On Date': product.as_on_date.strftime('%Y-%m-%d') if product.as_on_date else None,
-                        'Specifications': product.specifications,
-                        'Description': product.purchase_description,
-                        'Tags': product.tags,
-                        'Images': product.images,
-                    }
-                    inventory_data.append(item)
-                    total_inventory_value += item['Stock Value']
-                except Exception as e:
-                    # Log errors for individual products
-                    log.app.error(f"Error processing product {product.id}: {str(e)}")
-                    log.trace.trace(traceback.format_exc())
-                    continue  # Skip this product and continue with the next one
-            
-            # Convert inventory data to a pandas DataFrame
-            df = pd.DataFrame(inventory_data)
-
-            # Add a row for the total inventory value
-            total_row = {
-                'Product Name': 'Total Inventory Value',
-                'UPC': '',
-                'Item Code': '',
-                'Stock Quantity': '',
-                'Purchase Price': '',
-                'Stock Value': float(total_inventory_value),  # Convert Decimal to float for Excel
-                'Reorder Level': '',
-                'Batch/Lot Number': '',
-                'As On Date': '',
-                'Specifications': '',
-                'Description': '',
-                'Tags': '',
-                'Images': '',
-            }
-            total_df = pd.DataFrame([total_row])
-            df = pd.concat([df, total_df], ignore_index=True)
+            start_date = request.GET.get('start_date')
+            end_date = request.GET.get('end_date')
+            try:
+                start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None
+                end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
+            except ValueError:
+                return Response({"error": "Dates must be in YYYY-MM-DD format."}, status=status.HTTP_400_BAD_REQUEST)
+
+            opening = 0
+            if start_date:
+                opening = stock.quantities_as_of(start_date - timedelta(days=1), Product.objects.filter(id=product.id)).get(product.id, 0)
+            data = list(stock.movements(start_date, end_date, product).values(
+                'id', 'date', 'source_type', 'source_id', 'quantity', 'unit_cost', 'running_quantity'
+            ))
+            return Response({
+                'product': {'id': product.id, 'product_name': product.product_name, 'sku': product.sku},
+                'opening_quantity': opening,
+                'movements': data,
+                'closing_quantity': data[-1]['running_quantity'] if data else opening,
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            log.trace.trace(f"Error occurred while fetching stock movements, {traceback.format_exc()}")
+            return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            # Create the HttpResponse object with the appropriate Excel headers
-            response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-            response['Content-Disposition'] = 'attachment; filename=detailed_inventory_report.xlsx'
 
-            # Save the DataFrame to the HttpResponse as an Excel file
-            with pd.ExcelWriter(response, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='Inventory Report')
+class ReorderAlertView(APIView):
+    """
+    Products at or below their reorder level, with days of cover at the
+    trailing sales velocity. `window_days` sets the velocity window (30 by
+    default); `cover_days` also lists products that will run out sooner.
+    """
+    permission_classes = [IsAuthenticated]
 
-            return response
+    def get(self, request):
+        try:
+            try:
+                window_days = int(request.GET.get('window_days', reorder.VELOCITY_WINDOW_DAYS))
+                cover_days = int(request.GET['cover_days']) if request.GET.get('cover_days') else None
+            except ValueError:
+                return Response({"error": "window_days and cover_days must be whole numbers."}, status=status.HTTP_400_BAD_REQUEST)
+            if window_days < 1:
+                return Response({"error": "window_days must be positive."}, status=status.HTTP_400_BAD_REQUEST)
+
+            products = reorder.at_risk(window_days=window_days, cover_days=cover_days)
+            return Response({
+                'window_days': window_days,
+                'cover_days': cover_days,
+                'count': len(products),
+                'products': products,
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            log.trace.trace(f"Error occurred while fetching reorder alerts, {traceback.format_exc()}")
+            return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class ProductSearchView(APIView):
+    """
+    Ranked product search for typeahead: `q` is matched word by word as
+    prefixes of the name, SKU, barcode, description, tags and category.
+    Optional `product_type` and `limit` (20 by default, at most 100).
+    """
+    permission_classes = [IsAuthenticated]
+    default_limit = 20
+    max_limit = 100
+
+    def get(self, request):
+        try:
+            try:
+                limit = min(int(request.GET.get('limit', self.default_limit)), self.max_limit)
+            except ValueError:
+                return Response({"error": "limit must be a whole number."}, status=status.HTTP_400_BAD_REQUEST)
+            if limit < 1:
+                return Response({"error": "limit must be positive."}, status=status.HTTP_400_BAD_REQUEST)
+
+            results = search.search(request.GET.get('q', ''), product_type=request.GET.get('product_type'), limit=limit)
+            return Response({'count': len(results), 'results': results}, status=status.HTTP_200_OK)
+        except Exception as e:
+            log.trace.trace(f"Error occurred while searching products, {traceback.format_exc()}")
+            return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+
+class ScanLookupView(APIView):
+    """
+    Resolve scanned barcodes or SKUs to products with their current stock.
+    GET takes one `code`; POST takes {"codes": [...]} (at most max_codes)
+    and answers every code in one round trip.
+    """
+    permission_classes = [IsAuthenticated]
+    max_codes = 500
+
+    def get(self, request):
+        code = request.GET.get('code', '').strip()
+        if not code:
+            return Response({"error": "code is required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            product = scan.lookup([code])[code]
+        except Exception as e:
+            log.trace.trace(f"Error occurred while looking up scanned code, {traceback.format_exc()}")
+            return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if product is None:
+            return Response({"detail": f"No active product with barcode or SKU {code}."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(product, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        codes = request.data.get('codes')
+        if not isinstance(codes, list) or not codes:
+            return Response({"error": "codes must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(codes) > self.max_codes:
+            return Response({"error": f"At most {self.max_codes} codes per request."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            results = scan.lookup(codes)
+            return Response({
+                'results': results,
+                'found': [code for code, product in results.items() if product],
+                'not_found': [code for code, product in results.items() if product is None],
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            log.trace.trace(f"Error occurred while looking up scanned codes, {traceback.format_exc()}")
+            return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class DetailedInventoryReportView(APIView):
+    def get(self, request):
+        products = valuation.valued_products().order_by('category', 'product_name', 'id').values(
+            'category', 'product_name', 'sku', 'barcode', 'stock_quantity', 'stock_value',
+            'reorder_level', 'batch_lot_number', 'as_on_date', 'specifications', 'tags', 'images',
+            stock_purchase_price=F('purchase_price'),
+            description=F('purchase_description'),
+        )
+        return Response(list(products))
+
+
+
+class DetailedInventoryReportExcelExportView(APIView):
+    def get(self, request):
+        try:
+            # Values come from the database; rows stream into a constant-memory workbook on disk
+            output = valuation.write_xlsx(valuation.product_rows(), valuation.total_value())
+            return FileResponse(
+                output,
+                as_attachment=True,
+                filename='detailed_inventory_report.xlsx',
+                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            )
 
         except Exception as e:
             # Log the error and return a 500 response
@@ -0,0 +1,155 @@
+"""
+Idempotency keys for write endpoints.
+
+A client that may retry a request (after a timeout, say) sends the same
+Idempotency-Key header with every attempt. The first request with a key
+runs the view and stores its status and response body as an
+accounts.models.IdempotencyRecord; a retry with the same key gets the
+stored response back without running the view again. A retry that arrives
+while the first request is still running waits for it, up to
+WAIT_TIMEOUT seconds, then gets 409. Keys are scoped per user, and a key
+reused for a different request (path or body) is rejected with 422.
+
+The claim is an insert into a unique column, so it holds across worker
+processes. It is committed before the view runs, with a short lease
+(PENDING_LEASE seconds). The view then runs inside a transaction that also
+stores the response, so the view's writes and the stored response are
+committed together: if the worker dies before that commit, nothing was
+written and the key is free again once the lease has run out. A stored
+response is kept for settings.IDEMPOTENCY_KEY_TTL seconds. Server errors
+and exceptions are not stored; the key is released so the request can be
+retried. Decorated views must therefore answer unexpected errors with a
+5xx status, never a 4xx that would be replayed. Expired rows are deleted
+after each keyed request.
+
+The body is stored as DRF's JSON renderer encodes it (a Decimal becomes a
+number, as on the first response), so a replay renders the same content.
+
+The request hash covers the method, path and parsed form or JSON fields,
+plus the name, size and a streamed digest of every uploaded file, so large
+uploads are never read into memory as a whole. Requests without the header
+run as before.
+"""
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from accounts.models import IdempotencyRecord
+
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+MAX_KEY_LENGTH = 255
+
+# seconds a duplicate waits for the first request, and between checks
+WAIT_TIMEOUT = 30
+POLL_INTERVAL = 0.2
+
+# seconds a claim stays pending before another request may take the key over
+PENDING_LEASE = 2 * WAIT_TIMEOUT
+
+
+def request_hash(request):
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    files = request.FILES
+    data = request.data
+    if hasattr(data, 'lists'):
+        # form data: a QueryDict that also holds the uploaded files
+        data = sorted((key, values) for key, values in data.lists() if key not in files)
+    digest.update(json.dumps(data, sort_keys=True, default=str).encode())
+    for name in sorted(files):
+        for upload in files.getlist(name):
+            digest.update(f"\n{name} {upload.name} {upload.size}\n".encode())
+            for chunk in upload.chunks():
+                digest.update(chunk)
+            upload.seek(0)
+    return digest.hexdigest()
+
+
+def _stored_body(data):
+    """`data` in the JSON types the response renderer produces for it."""
+    return json.loads(JSONRenderer().render(data) or 'null')
+
+
+def _claim(key, hashed):
+    """
+    Insert a pending record for `key`. Returns (True, the new record) when
+    this request claimed it, else (False, the existing record, or None if it
+    just went away or had expired).
+    """
+    expires_at = timezone.now() + timedelta(seconds=PENDING_LEASE)
+    try:
+        with transaction.atomic():
+            record = IdempotencyRecord.objects.create(key=key, request_hash=hashed, expires_at=expires_at)
+        return True, record
+    except IntegrityError:
+        record = IdempotencyRecord.objects.filter(key=key).first()
+        if record is not None and record.expires_at <= timezone.now():
+            record.delete()
+            return False, None
+        return False, record
+
+
+def idempotent(view_func):
+    """Decorator for APIView write methods honouring the Idempotency-Key header."""
+    @wraps(view_func)
+    def wrapped_view(self, request, *args, **kwargs):
+        client_key = request.headers.get(HEADER)
+        if not client_key:
+            return view_func(self, request, *args, **kwargs)
+        if len(client_key) > MAX_KEY_LENGTH:
+            return Response({"detail": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        key = f"{request.user.pk}:{client_key}"
+        hashed = request_hash(request)
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        claimed, record = _claim(key, hashed)
+        while not claimed:
+            if record is None:
+                claimed, record = _claim(key, hashed)
+                continue
+            if record.request_hash != hashed:
+                return Response({"detail": f"{HEADER} was already used for a different request."},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if record.status_code is not None:
+                return Response(record.response_body, status=record.status_code, headers={REPLAYED_HEADER: 'true'})
+            if time.monotonic() >= deadline:
+                return Response({"detail": f"A request with this {HEADER} is still being processed."},
+                                status=status.HTTP_409_CONFLICT)
+            # wait with reads only, so the first request's writes are not contended
+            time.sleep(POLL_INTERVAL)
+            record = IdempotencyRecord.objects.filter(key=key).first()
+            if record is not None and record.status_code is None and record.expires_at <= timezone.now():
+                # the first request's lease ran out without a response: take the key over
+                record = None
+
+        claim = IdempotencyRecord.objects.filter(id=record.id)
+        try:
+            with transaction.atomic():
+                response = view_func(self, request, *args, **kwargs)
+                stored = response.status_code < 500 and hasattr(response, 'data')
+                if stored and not claim.update(
+                    status_code=response.status_code, response_body=_stored_body(response.data),
+                    expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+                ):
+                    # the lease ran out and another request took the key over: undo this one
+                    transaction.set_rollback(True)
+                    return Response({"detail": f"A request with this {HEADER} is still being processed."},
+                                    status=status.HTTP_409_CONFLICT)
+        except Exception:
+            claim.delete()
+            raise
+        if not stored:
+            claim.delete()
+        IdempotencyRecord.objects.filter(expires_at__lte=timezone.now()).delete()
+        return response
+    return wrapped_view
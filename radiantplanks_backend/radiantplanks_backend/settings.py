@@ -106,10 +106,21 @@ LOG_DIR = os.path.join(BASE_DIR, 'logs')
 os.makedirs(LOG_DIR, exist_ok=True)
 
 
+# Writers take the SQLite write lock when their transaction begins and wait up to
+# SQLITE_BUSY_TIMEOUT seconds for it, so concurrent invoices queue instead of failing
+# with "database is locked". Tests use a file database: the shared in-memory one
+# fails on a locked table at once, whatever the timeout.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'timeout': int(os.environ.get("SQLITE_BUSY_TIMEOUT", 20)),
+            'transaction_mode': 'IMMEDIATE',
+        },
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -191,3 +202,15 @@ EMAIL_HOST_USER = os.environ.get("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = os.environ.get("DEFAULT_FROM_EMAIL")
 PATH_TO_WFK = os.environ.get("PATH_TO_WFK")
+
+# Inventory costing method for invoices and losses: "fifo" or "average" (see inventory.costing)
+INVENTORY_COSTING_METHOD = os.environ.get("INVENTORY_COSTING_METHOD", "fifo")
+
+# Invoice ledger lines: "aggregated" (one line per account) or "itemized" (per product; see inventory.invoice_ledger)
+INVOICE_POSTING_MODE = os.environ.get("INVOICE_POSTING_MODE", "aggregated")
+
+# How long a stored Idempotency-Key response is replayed, in seconds (see radiantplanks_backend.idempotency)
+IDEMPOTENCY_KEY_TTL = int(os.environ.get("IDEMPOTENCY_KEY_TTL", 24 * 60 * 60))
+
+# How long a document number reserved for the UI stays held, in seconds (see inventory.numbering)
+DOCUMENT_NUMBER_RESERVATION_TTL = int(os.environ.get("DOCUMENT_NUMBER_RESERVATION_TTL", 30 * 60))